@@ -1,24 +1,93 @@
 import sys
+import time
 import datetime
-import sqlite3
+from contextlib import contextmanager
+
+STARTED_AT = time.perf_counter()  # Start of the import phase reported by --profile-startup
 
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QLineEdit, QComboBox, QPushButton, QVBoxLayout,
     QMessageBox, QDialog, QTableWidget, QTableWidgetItem, QDateEdit, QTabWidget,
-    QCheckBox, QFormLayout
+    QCheckBox, QFormLayout, QHBoxLayout, QTableView, QFileDialog, QProgressDialog, QInputDialog
 )
-from PyQt5.QtCore import QDate, Qt
+from PyQt5.QtCore import QDate, Qt, QThreadPool, QTimer
 from PyQt5.QtGui import QDoubleValidator, QIntValidator, QIcon
-from sklearn.linear_model import LinearRegression
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-import seaborn as sns
-import pandas as pd
 import matplotlib.colors as mcolors
+import matplotlib.ticker as mticker
 import colorsys
-import yfinance as yf  # type: ignore
 
-pd.set_option('future.no_silent_downcasting', True)
+from market_data import Quote, SingleFlightProvider, create_provider
+from quote_cache import QuoteCache
+from price_history import PriceHistoryStore
+from workers import ExportWorker, ImportWorker, QuoteRefresher
+from exporter import formats as export_formats
+from importer import AmbiguousDateFormat
+from resilience import ResilientProvider
+from recurrence import next_due_date, occurrences_between
+from engine import (DEFAULT_VOLATILITY, FIRE_DEFAULTS, MAX_MONTE_CARLO_PATHS, MONTE_CARLO_PATHS, PREDICTION_PERIODS, RETURN_MODELS,
+                    FinanceEngine, FireInputs, load_pandas)
+from storage import DB_PATH, Holding, RecordFilter, Storage
+from invalidation import DependencyGraph
+from table_models import RecordsTableModel, SqlTableModel
+
+IMPORTED_AT = time.perf_counter()
+
+# pandas, seaborn and scikit-learn are imported on first use (predictions and the FIRE chart),
+# so they are not paid for when the window opens
+HEAVY_MODULES = ['pandas', 'seaborn', 'sklearn', 'yfinance', 'matplotlib.pyplot']
+
+FIXED_ROI = 'Fixed ROI'  # Return model of the deterministic FIRE projection; the others are simulated
+
+
+# Wall-clock time per startup phase, printed with --profile-startup
+class StartupProfile:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = [('imports', IMPORTED_AT - STARTED_AT)]
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def report(self):
+        if not self.enabled:
+            return
+        print("Startup profile:")
+        for name, seconds in self.phases:
+            print(f"  {name:<18}{seconds * 1000:9.1f} ms")
+        print(f"  {'first event loop':<18}{(time.perf_counter() - STARTED_AT) * 1000:9.1f} ms since start")
+        loaded = [module for module in HEAVY_MODULES if module in sys.modules]
+        print(f"  heavy modules loaded: {', '.join(loaded) or 'none'}")
+
+SNAPSHOT_VERSION = 1  # Bump when the layout of the saved view state changes
+
+# The window's views in refresh order: (name, method that refreshes it, the tables and views it reads,
+# attribute of the tab it renders on or None). Tables are records, recurring_records, assets, loans,
+# portfolio, quotes and net_worth_history, so view names must differ from them.
+VIEWS = [
+    ('recurring_catch_up', 'update_recurring_records', ['recurring_records'], None),
+    ('graph', 'show_graph', ['records', 'recurring_records'], 'graph_tab'),
+    ('portfolio_value', 'update_portfolio_value', ['portfolio', 'quotes'], None),
+    ('portfolio_table', 'update_portfolio', ['portfolio'], 'portfolio_tab'),
+    ('assets_table', 'update_assets_table', ['assets'], 'assets_loans_tab'),
+    # Not bound to its tab: it also accrues loan interest, which net worth needs
+    ('loans_table', 'update_loans_table', ['loans', 'recurring_records'], None),
+    ('net_worth', 'update_net_worth', ['records', 'assets', 'loans_table', 'portfolio_value'], None),
+    ('net_worth_graph', 'show_net_worth_graph', ['net_worth_history'], 'net_worth_tab'),
+    ('fire', 'update_fire_values', ['portfolio_value', 'recurring_records'], 'fire_tab'),
+]
+
+RECORD_CATEGORIES = ["Groceries", "Utilities", "Rent", "Entertainment", "Transport", "Healthcare", "Paycheck", "Investments", "Other", "Loan"]
+
+# Chart ranges on the Income and Expenses tab: days ending today (Custom uses the date pickers)
+GRAPH_RANGES = {'Week': 7, 'Month': 30, 'Quarter': 91, 'Year': 365, 'Custom': None}
 
 # User login dialog
 class UserLoginDialog(QDialog):
@@ -48,80 +117,83 @@ class UserLoginDialog(QDialog):
 
 # Main Finance Application
 class FinanceApp(QWidget):
-    def __init__(self):
+    def __init__(self, profile=None):
         super().__init__()
+        self.profile = profile or StartupProfile()
         self.setWindowTitle("Fire Journey")
         # Set the window icon
         self.setWindowIcon(QIcon('applogo.png'))
         # Set the initial window size
         self.resize(1200, 800)
 
-        self.conn = sqlite3.connect('finance.db')  # Connect to SQLite database
-        self.c = self.conn.cursor()
-        self.create_tables()  # Create necessary tables
+        self.storage = Storage(DB_PATH)  # Owns the SQLite connections (WAL mode)
+        with self.profile.phase('create_tables'):
+            self.create_tables()  # Create necessary tables
+
+        # Network provider behind retries, a rate limiter and a circuit breaker
+        self.single_flight = SingleFlightProvider(ResilientProvider(create_provider()))  # Shares one fetch per symbol per refresh cycle
+        self.market_data = QuoteCache(self.single_flight, self.storage)  # Cached source of stock quotes (live or local fixture)
+        self.price_history = PriceHistoryStore(self.market_data, self.storage)  # Local daily price bars
+        self.quotes = {}  # Quotes fetched during the current refresh, keyed by symbol
+        self.engine = FinanceEngine(self.storage, self.market_data)  # Computations shared with the headless CLI
 
         self.user_id = None
         self.user_name = None
-        self.login_user()  # Show login dialog
+        with self.profile.phase('login'):
+            self.login_user()  # Show login dialog
 
         self.main_layout = QVBoxLayout()
+        # Shown while the visible tab still displays values from the last saved snapshot
+        self.stale_label = QLabel("")
+        self.stale_label.setAlignment(Qt.AlignCenter)
+        self.stale_label.setStyleSheet("color: gray;")
+        self.stale_label.hide()
+        self.main_layout.addWidget(self.stale_label)
         self.tab_widget = QTabWidget()
         self.main_layout.addWidget(self.tab_widget)
         self.setLayout(self.main_layout)
 
-        self.figure_net_worth = plt.figure()
+        self.figure_net_worth = Figure()
         self.canvas_net_worth = FigureCanvas(self.figure_net_worth)
 
         self.current_portfolio_value = 0.0  # Initialize the portfolio value variable
-
-        self.setup_tabs()  # Setup tabs for the application
-        self.update_all()  # Call update_all on startup
+        self.net_worth_excluding_portfolio = 0.0  # Everything in net worth except the stock portfolio
+        self.holdings = []  # Portfolio rows grouped by symbol
+        self.one_year_ago_prices = {}  # Close price one year ago, keyed by symbol
+        self.unknown_symbols = set()  # Symbols the market data provider does not recognise
+        self.graph_series = None  # Last income and expenses chart, as drawn
+        self.asset_rows = []  # Last contents of the assets table
+        self.loan_rows = []  # Last contents of the loans table
+        self.stale_views = set()  # Views still showing snapshot values
+        self.stale_symbols = set()  # Quotes restored from the snapshot and not refreshed yet
+        self.snapshot_saved_at = None
+
+        # Quotes and price history are fetched on a worker pool and posted back via signals
+        self.quote_refresher = QuoteRefresher(self.market_data, self.price_history, parent=self)
+        self.quote_refresher.quotes_ready.connect(self.on_quotes_ready)
+        self.quote_refresher.history_ready.connect(self.on_history_ready)
+        self.quote_refresher.finished.connect(self.on_quotes_finished)
+        self.market_data.on_refreshed = self.quote_refresher.quotes_ready.emit  # Stale-while-revalidate results
+
+        with self.profile.phase('setup_tabs'):
+            self.setup_tabs()  # Setup tabs for the application
+            self.setup_views()  # Declare what each view depends on
+        with self.profile.phase('restore_snapshot'):
+            self.restore_snapshot()  # Paint the last known state before anything is recomputed
+        with self.profile.phase('update_all'):
+            self.update_all()  # Call update_all on startup
+            if self.profile.enabled:
+                self.views.flush()  # Run the first refresh pass now so its cost is measured
 
     def create_tables(self):
-        # SQL queries to create necessary tables if they don't exist
-        tables = {
-            'users': '''CREATE TABLE IF NOT EXISTS users
-                        (user_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL)''',
-            'records': '''CREATE TABLE IF NOT EXISTS records
-                        (record_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, date TEXT NOT NULL, category TEXT, type TEXT, amount REAL, linked_loan INTEGER,
-                        FOREIGN KEY(user_id) REFERENCES users(user_id), FOREIGN KEY(linked_loan) REFERENCES loans(id))''',
-            'recurring_records': '''CREATE TABLE IF NOT EXISTS recurring_records
-                        (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, date TEXT NOT NULL, category TEXT, type TEXT, amount REAL, frequency TEXT, linked_loan INTEGER,
-                        FOREIGN KEY(user_id) REFERENCES users(user_id), FOREIGN KEY(linked_loan) REFERENCES loans(id))''',
-            'portfolio': '''CREATE TABLE IF NOT EXISTS portfolio
-                        (portfolio_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, symbol TEXT NOT NULL, purchase_price REAL, quantity REAL, company_name TEXT, purchase_date TEXT,
-                        FOREIGN KEY(user_id) REFERENCES users(user_id))''',
-            'assets': '''CREATE TABLE IF NOT EXISTS assets
-                        (asset_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT NOT NULL, purchase_price REAL, year_of_purchase INTEGER,
-                        FOREIGN KEY(user_id) REFERENCES users(user_id))''',
-            'loans': '''CREATE TABLE IF NOT EXISTS loans
-                        (loan_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT NOT NULL, principal REAL, initial_principal REAL, interest_rate REAL, signing_date TEXT, interest REAL, last_calculated_date TEXT,
-                        FOREIGN KEY(user_id) REFERENCES users(user_id))''',
-            'net_worth_history': '''CREATE TABLE IF NOT EXISTS net_worth_history
-                        (user_id INTEGER, date TEXT PRIMARY KEY, net_worth REAL,
-                        FOREIGN KEY(user_id) REFERENCES users(user_id))''',
-            'loan_repayment': '''CREATE TABLE IF NOT EXISTS loan_repayment
-                                (loan_id INTEGER PRIMARY KEY, repaid_principal REAL,
-                                FOREIGN KEY(loan_id) REFERENCES loans(loan_id))'''
-        }
-
-        for table, query in tables.items():
-            self.c.execute(query)
-
-        self.conn.commit()
+        # Create or upgrade the schema to the latest version
+        self.storage.migrate()
 
     def login_user(self):
         dialog = UserLoginDialog(self)
         if dialog.exec_() == QDialog.Accepted:
             self.user_name = dialog.name_input.text()
-            self.c.execute("SELECT user_id FROM users WHERE name = ?", (self.user_name,))
-            user = self.c.fetchone()
-            if user:
-                self.user_id = user[0]  # Set user_id if user exists
-            else:
-                self.c.execute("INSERT INTO users (name) VALUES (?)", (self.user_name,))
-                self.conn.commit()
-                self.user_id = self.c.lastrowid  # Set user_id for new user
+            self.user_id = self.storage.users.get_or_create(self.user_name)  # Creates the user on first login
         else:
             sys.exit(0)  # Exit the application if login is not accepted
 
@@ -133,22 +205,124 @@ class FinanceApp(QWidget):
         self.setup_net_worth_tab()
         self.setup_fire_tab()
 
+    def setup_views(self):
+        # Mutations invalidate the tables they wrote and only the views downstream refresh (see VIEWS).
+        # Views bound to a tab render only while it is the visible one.
+        self.views = DependencyGraph(self.tab_widget, self)
+        for name, refresh, depends_on, tab in VIEWS:
+            self.views.add_view(name, getattr(self, refresh), depends_on, tab=getattr(self, tab) if tab else None)
+        self.views.refreshed.connect(self.on_views_refreshed)
+        self.tab_widget.currentChanged.connect(self.update_stale_label)
+
+    def restore_snapshot(self):
+        # Paint the state saved at the end of the last session; every restored view is marked stale
+        # until its own refresh replaces it
+        try:
+            snapshot = self.storage.snapshots.load(self.user_id)
+        except Exception as e:
+            print(f"Snapshot unavailable: {e}")
+            return
+        if snapshot is None or snapshot[1].get('version') != SNAPSHOT_VERSION:
+            return
+        self.snapshot_saved_at, state = snapshot
+
+        graph = state['graph']
+        if graph and graph['range'] == self.graph_range_combobox.currentText():
+            self.graph_series = graph
+            self.draw_graph(graph)
+            self.stale_views.add('graph')
+
+        self.holdings = [Holding(*holding) for holding in state['holdings']]
+        self.quotes = {symbol: Quote(symbol, *quote) for symbol, quote in state['quotes'].items()}
+        self.stale_symbols = set(self.quotes)
+        self.one_year_ago_prices = state['one_year_ago_prices']
+        self.render_portfolio()
+
+        self.net_worth_excluding_portfolio = state['net_worth_excluding_portfolio']
+        self.current_portfolio_value = state['portfolio_value']
+        self.show_net_worth()
+
+        self.asset_rows = state['assets']
+        self.fill_table(self.assets_table, self.asset_rows)
+        self.loan_rows = state['loans']
+        self.fill_table(self.loans_table, self.loan_rows)
+
+        self.portfolio_value_input.setText(state['fire']['portfolio_value'])
+        self.annual_income_input.setText(state['fire']['annual_income'])
+
+        self.stale_views.update(['portfolio_table', 'assets_table', 'loans_table', 'net_worth', 'fire'])
+        self.update_stale_label()
+
+    def save_snapshot(self):
+        symbols = {holding.symbol for holding in self.holdings}
+        state = {
+            'version': SNAPSHOT_VERSION,
+            'graph': self.graph_series,
+            'holdings': [list(holding) for holding in self.holdings],
+            'quotes': {symbol: [quote.company_name, quote.price, quote.open] for symbol, quote in self.quotes.items() if symbol in symbols},
+            'one_year_ago_prices': {symbol: price for symbol, price in self.one_year_ago_prices.items() if symbol in symbols},
+            'net_worth_excluding_portfolio': self.net_worth_excluding_portfolio,
+            'portfolio_value': self.current_portfolio_value,
+            'assets': self.asset_rows,
+            'loans': self.loan_rows,
+            'fire': {'portfolio_value': self.portfolio_value_input.text(), 'annual_income': self.annual_income_input.text()},
+        }
+        try:
+            self.storage.snapshots.save(self.user_id, state)
+        except Exception as e:
+            print(f"Could not save snapshot: {e}")
+
+    def on_views_refreshed(self, names):
+        # Portfolio prices stay stale until the background quote refresh has finished
+        self.stale_views.difference_update(name for name in names if name != 'portfolio_table')
+        self.update_stale_label()
+        self.save_snapshot()
+
+    def update_stale_label(self):
+        tab = self.tab_widget.currentWidget()
+        stale = any(self.views.tab(name) in (tab, None) for name in self.stale_views)
+        self.stale_label.setText(f"Showing data saved at {str(self.snapshot_saved_at).replace('T', ' ')}, refreshing...")
+        self.stale_label.setVisible(stale)
+
+    def closeEvent(self, event):
+        self.save_snapshot()
+        super().closeEvent(event)
+
+    def invalidate(self, *tables):
+        # Refresh the views that depend on tables once control returns to the event loop
+        self.views.invalidate(*tables)
+
     def update_all(self):
         # Update all relevant data in the application
-        self.update_recurring_records()
-        self.show_graph()
-        self.update_portfolio()
-        self.update_assets_table()
-        self.update_net_worth()
-        self.update_loans_table()
-        self.update_fire_values()
+        self.views.invalidate_all()
 
     # Tab setup methods
     def setup_graph_tab(self):
         self.graph_tab = QWidget()
         graph_layout = QVBoxLayout()
 
-        self.figure = plt.figure()
+        # Range selector for the income and expenses chart
+        range_layout = QHBoxLayout()
+        self.graph_range_combobox = QComboBox()
+        self.graph_range_combobox.addItems(list(GRAPH_RANGES))
+        range_layout.addWidget(QLabel("Range"))
+        range_layout.addWidget(self.graph_range_combobox)
+        self.graph_start_input = QDateEdit(QDate.currentDate().addDays(-30))
+        self.graph_end_input = QDateEdit(QDate.currentDate())
+        for date_input in (self.graph_start_input, self.graph_end_input):
+            date_input.setCalendarPopup(True)
+            date_input.setDisplayFormat("yyyy-MM-dd")
+            date_input.setEnabled(False)
+            date_input.dateChanged.connect(self.show_graph)
+        range_layout.addWidget(QLabel("From"))
+        range_layout.addWidget(self.graph_start_input)
+        range_layout.addWidget(QLabel("To"))
+        range_layout.addWidget(self.graph_end_input)
+        range_layout.addStretch()
+        self.graph_range_combobox.currentTextChanged.connect(self.change_graph_range)
+        graph_layout.addLayout(range_layout)
+
+        self.figure = Figure()
         self.canvas = FigureCanvas(self.figure)
         graph_layout.addWidget(self.canvas)
 
@@ -164,6 +338,14 @@ class FinanceApp(QWidget):
         self.view_recurring_records_button.clicked.connect(self.show_recurring_records)
         graph_layout.addWidget(self.view_recurring_records_button)
 
+        self.import_statement_button = QPushButton("Import Statement")
+        self.import_statement_button.clicked.connect(self.import_statement)
+        graph_layout.addWidget(self.import_statement_button)
+
+        self.export_data_button = QPushButton("Export Data")
+        self.export_data_button.clicked.connect(self.export_data)
+        graph_layout.addWidget(self.export_data_button)
+
         self.predict_expenses_button = QPushButton("Predict Expenses")
         self.predict_expenses_button.clicked.connect(self.show_predict_expenses)
         graph_layout.addWidget(self.predict_expenses_button)
@@ -175,6 +357,14 @@ class FinanceApp(QWidget):
         self.portfolio_tab = QWidget()
         portfolio_layout = QVBoxLayout()
 
+        # Non-modal notice shown when prices could not be refreshed
+        self.portfolio_status_label = QLabel("")
+        self.portfolio_status_label.setAlignment(Qt.AlignCenter)
+        self.portfolio_status_label.setStyleSheet("color: #b36b00;")
+        self.portfolio_status_label.setWordWrap(True)
+        self.portfolio_status_label.hide()
+        portfolio_layout.addWidget(self.portfolio_status_label)
+
         self.portfolio_table = QTableWidget()
         self.portfolio_table.setColumnCount(6)
         self.portfolio_table.setHorizontalHeaderLabels(["Symbol", "Company Name", "Purchase Price", "Quantity", "Current Price", "Total P&L"])
@@ -190,7 +380,7 @@ class FinanceApp(QWidget):
         portfolio_layout.addWidget(self.add_stock_button)
 
         self.update_portfolio_button = QPushButton("Update Portfolio")
-        self.update_portfolio_button.clicked.connect(self.update_portfolio)
+        self.update_portfolio_button.clicked.connect(self.force_update_portfolio)
         portfolio_layout.addWidget(self.update_portfolio_button)
 
         self.view_all_stocks_button = QPushButton("View All Records")
@@ -250,17 +440,17 @@ class FinanceApp(QWidget):
 
         self.savings_rate_input = QLineEdit()
         self.savings_rate_input.setValidator(QDoubleValidator(0, 100, 2))
-        self.savings_rate_input.setText("40")  # Set default savings rate
+        self.savings_rate_input.setText(str(FIRE_DEFAULTS['savings_rate']))  # Set default savings rate
         form_layout.addRow("Savings Rate (%):", self.savings_rate_input)
 
         self.income_growth_input = QLineEdit()
         self.income_growth_input.setValidator(QDoubleValidator(0, 100, 2))
-        self.income_growth_input.setText("2")  # Set default income growth rate
+        self.income_growth_input.setText(str(FIRE_DEFAULTS['income_growth_rate']))  # Set default income growth rate
         form_layout.addRow("Income Growth Rate (%):", self.income_growth_input)
 
         self.income_growth_duration_input = QLineEdit()
         self.income_growth_duration_input.setValidator(QIntValidator(0, 100))
-        self.income_growth_duration_input.setText("20")  # Set default income growth duration
+        self.income_growth_duration_input.setText(str(FIRE_DEFAULTS['income_growth_duration']))  # Set default income growth duration
         form_layout.addRow("Income Growth Duration (years):", self.income_growth_duration_input)
 
         self.annual_expenses_input = QLineEdit()
@@ -272,14 +462,33 @@ class FinanceApp(QWidget):
 
         self.withdrawal_rate_input = QLineEdit()
         self.withdrawal_rate_input.setValidator(QDoubleValidator(0, 100, 2))
-        self.withdrawal_rate_input.setText("4.0")  # Set default withdrawal rate
+        self.withdrawal_rate_input.setText(str(FIRE_DEFAULTS['withdrawal_rate']))  # Set default withdrawal rate
         form_layout.addRow("Withdrawal Rate (%):", self.withdrawal_rate_input)
 
         self.annual_roi_input = QLineEdit()
         self.annual_roi_input.setValidator(QDoubleValidator(0, 100, 2))
-        self.annual_roi_input.setText("5.0")  # Set default annual ROI
+        self.annual_roi_input.setText(str(FIRE_DEFAULTS['annual_roi']))  # Set default annual ROI
         form_layout.addRow("Annual ROI (%):", self.annual_roi_input)
 
+        self.return_model_combobox = QComboBox()
+        self.return_model_combobox.addItems([FIXED_ROI] + RETURN_MODELS)
+        self.return_model_combobox.setToolTip("Fixed ROI grows the portfolio by the annual ROI every year. The other models simulate many "
+                                              "return paths: Normal and Lognormal around the annual ROI with the given volatility, "
+                                              "Bootstrap and Historical from the stored daily prices of your portfolio.")
+        self.return_model_combobox.currentTextChanged.connect(self.update_return_model_inputs)
+        form_layout.addRow("Return Model:", self.return_model_combobox)
+
+        self.volatility_input = QLineEdit()
+        self.volatility_input.setValidator(QDoubleValidator(0, 100, 2))
+        self.volatility_input.setText(str(DEFAULT_VOLATILITY))  # Set default return volatility
+        form_layout.addRow("Return Volatility (%):", self.volatility_input)
+
+        self.paths_input = QLineEdit()
+        self.paths_input.setValidator(QIntValidator(1, MAX_MONTE_CARLO_PATHS))
+        self.paths_input.setText(str(MONTE_CARLO_PATHS))  # Set default number of simulated paths
+        form_layout.addRow("Simulated Paths:", self.paths_input)
+        self.update_return_model_inputs(FIXED_ROI)
+
         self.include_loan_expenses_checkbox = QCheckBox()
         self.include_loan_expenses_checkbox.setToolTip("If checked, annual loan expenses will be deducted from the annual income until the loan is repaid.")
         form_layout.addRow("Include Loan Expenses:", self.include_loan_expenses_checkbox)
@@ -294,7 +503,7 @@ class FinanceApp(QWidget):
 
         fire_layout.addLayout(form_layout)
 
-        self.figure_fire = plt.figure()
+        self.figure_fire = Figure()
         self.canvas_fire = FigureCanvas(self.figure_fire)
         fire_layout.addWidget(self.canvas_fire)
 
@@ -403,12 +612,10 @@ class FinanceApp(QWidget):
             name, purchase_price, year_of_purchase = [inp.text().strip() for inp in inputs]
             if not name or not purchase_price or not year_of_purchase:
                 raise ValueError("All fields must be filled.")
-            self.c.execute('INSERT INTO assets (user_id, name, purchase_price, year_of_purchase) VALUES (?, ?, ?, ?)',
-                           (self.user_id, name, float(purchase_price), int(year_of_purchase)))
-            self.conn.commit()
+            self.storage.assets.add(self.user_id, name, float(purchase_price), int(year_of_purchase))
             QMessageBox.information(self, "Success", "Asset added successfully")
             dialog.close()
-            self.update_all()  # Update all relevant data
+            self.invalidate('assets')
         except ValueError as ve:
             QMessageBox.critical(self, "Input Error", str(ve))
         except Exception as e:
@@ -421,21 +628,12 @@ class FinanceApp(QWidget):
             if not name or not principal or not interest_rate or not signing_date:
                 raise ValueError("All fields must be filled.")
 
-            initial_principal = float(principal)
-
-            # Ensure interest is set to 0.0
-            interest = 0.0
-            last_calculated_date = signing_date
-
-            self.c.execute('''
-                INSERT INTO loans (user_id, name, principal, initial_principal, interest_rate, signing_date, last_calculated_date, interest)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (self.user_id, name, initial_principal, initial_principal, float(interest_rate), signing_date, last_calculated_date, interest))
+            # Interest starts at 0.0 and is calculated from the signing date
+            self.storage.loans.add(self.user_id, name, float(principal), float(interest_rate), signing_date)
 
-            self.conn.commit()
             QMessageBox.information(self, "Success", "Loan added successfully")
             dialog.close()
-            self.update_all()  # Update all relevant data
+            self.invalidate('loans')
 
 
         except ValueError as ve:
@@ -451,8 +649,7 @@ class FinanceApp(QWidget):
         dialog.resize(800, 600)
         layout = QVBoxLayout()
 
-        self.c.execute('SELECT asset_id, name, purchase_price, year_of_purchase FROM assets WHERE user_id = ?', (self.user_id,))
-        assets = self.c.fetchall()
+        assets = self.storage.assets.list(self.user_id)
 
         self.remove_asset_table = QTableWidget()
         self.remove_asset_table.setColumnCount(4)
@@ -487,15 +684,12 @@ class FinanceApp(QWidget):
 
     def confirm_remove_asset(self, dialog):
         try:
-            for row in range(self.remove_asset_table.rowCount()):
-                checkbox = self.remove_asset_table.cellWidget(row, 0)
-                if checkbox.isChecked():
-                    asset_id = checkbox.property('asset_id')
-                    self.c.execute('DELETE FROM assets WHERE asset_id = ?', (asset_id,))
-            self.conn.commit()
+            asset_ids = [self.remove_asset_table.cellWidget(row, 0).property('asset_id') for row in range(self.remove_asset_table.rowCount())
+                         if self.remove_asset_table.cellWidget(row, 0).isChecked()]
+            self.storage.assets.delete(asset_ids)
             QMessageBox.information(self, "Success", "Selected assets removed")
             dialog.close()
-            self.update_all()  # Update all relevant data
+            self.invalidate('assets')
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
 
@@ -505,8 +699,7 @@ class FinanceApp(QWidget):
         dialog.resize(800, 600)
         layout = QVBoxLayout()
 
-        self.c.execute('SELECT loan_id, name, principal, interest_rate, signing_date, interest FROM loans WHERE user_id = ?', (self.user_id,))
-        loans = self.c.fetchall()
+        loans = self.storage.loans.list(self.user_id)
 
         self.remove_loan_table = QTableWidget()
         self.remove_loan_table.setColumnCount(7)
@@ -518,13 +711,13 @@ class FinanceApp(QWidget):
         self.remove_loan_table.horizontalHeader().setStyleSheet("font-weight: bold; font-size: 14px;")
 
         for row, loan in enumerate(loans):
-            loan_id, name, principal, interest_rate, signing_date, interest = loan
             checkbox = QCheckBox()
             checkbox.setStyleSheet("margin:auto;")  # Center the checkbox
-            checkbox.setProperty('loan_id', loan_id)
+            checkbox.setProperty('loan_id', loan.loan_id)
             self.remove_loan_table.setCellWidget(row, 0, checkbox)
 
-            items = [name, f"{principal:.2f}", f"{interest_rate:.2f}%", signing_date, f"{interest:.2f}", "No Linked Expense"]
+            items = [loan.name, f"{loan.principal:.2f}", f"{loan.interest_rate:.2f}%", loan.signing_date, f"{loan.interest:.2f}",
+                     "No Linked Expense"]
             for col, item in enumerate(items, start=1):
                 cell_item = QTableWidgetItem(item)
                 cell_item.setTextAlignment(Qt.AlignCenter)
@@ -541,154 +734,45 @@ class FinanceApp(QWidget):
 
     def confirm_remove_loan(self, dialog):
         try:
-            for row in range(self.remove_loan_table.rowCount()):
-                checkbox = self.remove_loan_table.cellWidget(row, 0)
-                if checkbox.isChecked():
-                    loan_id = checkbox.property('loan_id')
-                    if loan_id:
-                        # Remove linked recurring records
-                        self.c.execute('DELETE FROM recurring_records WHERE linked_loan = ?', (loan_id,))
-                        # Remove associated records in the main records table
-                        self.c.execute('DELETE FROM records WHERE linked_loan = ?', (loan_id,))
-                        # Reset principal and interest
-                        self.c.execute('UPDATE loans SET principal = 0, interest = 0 WHERE loan_id = ?', (loan_id,))
-                        self.c.execute('DELETE FROM loans WHERE loan_id = ?', (loan_id,))
-                        self.c.execute('DELETE FROM loan_repayment WHERE loan_id = ?', (loan_id,))
-            self.conn.commit()
+            loan_ids = [self.remove_loan_table.cellWidget(row, 0).property('loan_id') for row in range(self.remove_loan_table.rowCount())
+                        if self.remove_loan_table.cellWidget(row, 0).isChecked()]
+            # Removes the loans with their linked recurring records and records in one transaction
+            self.storage.loans.delete([loan_id for loan_id in loan_ids if loan_id])
             QMessageBox.information(self, "Success", "Selected loans removed")
             dialog.close()
-            self.update_all()  # Update all relevant data
+            self.invalidate('loans', 'records', 'recurring_records')
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
 
     # Update methods
     def update_loans_table(self):
-        # Explicitly selecting the columns
-        self.c.execute('SELECT loan_id, name, principal, initial_principal, interest_rate, signing_date, last_calculated_date, interest FROM loans WHERE user_id = ?', (self.user_id,))
-        loans = self.c.fetchall()
-        self.loans_table.setRowCount(len(loans))
-        today = datetime.datetime.today().date()
-
-        for row, loan in enumerate(loans):
-            loan_id, name, principal, initial_principal, interest_rate, signing_date, last_calculated_date, interest = loan
-
-            try:
-                signing_date = datetime.datetime.strptime(signing_date, '%Y-%m-%d').date()
-                last_calculated_date = datetime.datetime.strptime(last_calculated_date, '%Y-%m-%d').date()
-            except ValueError as ve:
-                print(f"Date conversion error: {ve}")
-
-            days_elapsed = (today - last_calculated_date).days
-            accumulated_interest = (initial_principal * interest_rate / 100) * (days_elapsed / 365)  # Simple interest calculation
-            try:
-                current_interest = max(0, float(interest) + accumulated_interest)  # Ensure interest is not negative
-            except ValueError as ve:
-                print(f"Interest conversion error: {ve}")
-
-            self.c.execute('SELECT repaid_principal FROM loan_repayment WHERE loan_id = ?', (loan_id,))
-            repaid_principal_data = self.c.fetchone()
-            repaid_principal = repaid_principal_data[0] if repaid_principal_data else 0.0
-
-            principal_to_repay = max(0, principal - repaid_principal)  # Ensure principal to repay is not negative
-            self.c.execute('SELECT date FROM recurring_records WHERE linked_loan = ? AND user_id = ? ORDER BY date LIMIT 1', (loan_id, self.user_id))
-            next_repayment_date = self.c.fetchone()
-            if next_repayment_date:
-                next_repayment_date = next_repayment_date[0]
-            else:
-                next_repayment_date = "No Linked Expense"
-
-            if principal_to_repay == 0:
-                principal_to_repay_str = "Loan Repaid"
-            else:
-                principal_to_repay_str = f"{principal_to_repay:.2f}"
-
-            items = [name, f"{initial_principal:.2f}", f"{interest_rate:.2f}%", signing_date.strftime('%Y-%m-%d'), f"{current_interest:.2f}", principal_to_repay_str, next_repayment_date]
-            for col, item in enumerate(items):
-                cell_item = QTableWidgetItem(item)
-                cell_item.setTextAlignment(Qt.AlignCenter)
-                self.loans_table.setItem(row, col, cell_item)
-
-            # Update last_calculated_date in the database to today after interest calculation
-            self.c.execute('UPDATE loans SET last_calculated_date = ?, interest = ? WHERE user_id = ? AND loan_id = ?', (today.strftime('%Y-%m-%d'), current_interest, self.user_id, loan_id))
-
-        self.conn.commit()
+        # Accrues interest up to today as a side effect
+        self.loan_rows = []
+        for loan in self.engine.accrue_loan_interest(self.user_id):
+            principal_to_repay_str = "Loan Repaid" if loan.principal_to_repay == 0 else f"{loan.principal_to_repay:.2f}"
+            self.loan_rows.append([loan.name, f"{loan.initial_principal:.2f}", f"{loan.interest_rate:.2f}%", loan.signing_date.strftime('%Y-%m-%d'),
+                                   f"{loan.interest:.2f}", principal_to_repay_str, loan.next_repayment_date or "No Linked Expense"])
+        self.fill_table(self.loans_table, self.loan_rows)
 
     def update_assets_table(self):
-        self.c.execute('SELECT name, purchase_price, year_of_purchase FROM assets WHERE user_id = ?', (self.user_id,))
-        assets = self.c.fetchall()
-        self.assets_table.setRowCount(len(assets))
-        for row, asset in enumerate(assets):
-            name, purchase_price, year_of_purchase = asset
-            items = [name, f"{purchase_price:.2f}", f"{year_of_purchase}"]
+        assets = self.storage.assets.list(self.user_id)
+        self.asset_rows = [[asset.name, f"{asset.purchase_price:.2f}", f"{asset.year_of_purchase}"] for asset in assets]
+        self.fill_table(self.assets_table, self.asset_rows)
+
+    def fill_table(self, table, rows):
+        table.setRowCount(len(rows))
+        for row, items in enumerate(rows):
             for col, item in enumerate(items):
                 cell_item = QTableWidgetItem(item)
                 cell_item.setTextAlignment(Qt.AlignCenter)
-                self.assets_table.setItem(row, col, cell_item)
+                table.setItem(row, col, cell_item)
 
     def update_recurring_records(self):
-        self.c.execute('SELECT id, date, category, type, amount, frequency, linked_loan FROM recurring_records WHERE user_id = ?', (self.user_id,))
-        recurring_records = self.c.fetchall()
-
-        for record in recurring_records:
-            record_id, date, category, record_type, amount, frequency, linked_loan = record
-            next_due_date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
-            end_date = datetime.datetime.today().date()
-
-            while next_due_date <= end_date:
-                if linked_loan:
-                    self.c.execute('SELECT loan_id, principal, initial_principal, interest, interest_rate, last_calculated_date FROM loans WHERE user_id = ? AND loan_id = ?', (self.user_id, linked_loan))
-                    loan = self.c.fetchone()
-                    if loan:
-                        loan_id, principal, initial_principal, current_interest, annual_interest_rate, last_calculated_date = loan
-                        last_calculated_date = datetime.datetime.strptime(last_calculated_date, '%Y-%m-%d').date()
-
-                        # Calculate interest for the period
-                        days_elapsed = (next_due_date - last_calculated_date).days
-                        daily_interest_rate = annual_interest_rate / 365 / 100
-                        new_interest = principal * daily_interest_rate * days_elapsed
-                        current_interest += new_interest
-
-                        # Ensure the amount is positive
-                        amount = abs(float(amount))
-
-                        # Apply the payment to the interest first, then principal
-                        if amount <= current_interest:
-                            current_interest -= amount
-                        else:
-                            remaining_payment = amount - current_interest
-                            current_interest = 0
-                            principal = max(0, principal - remaining_payment)
-
-                        # Update loan information in the database
-                        self.c.execute('UPDATE loans SET principal = ?, interest = ?, last_calculated_date = ? WHERE user_id = ? AND loan_id = ?',
-                                       (principal, current_interest, next_due_date.strftime('%Y-%m-%d'), self.user_id, loan_id))
-
-                    else:
-                        # Loan not found, break out of the loop
-                        break
-
-                # Insert the record
-                self.c.execute('INSERT OR IGNORE INTO records (user_id, date, category, type, amount, linked_loan) VALUES (?, ?, ?, ?, ?, ?)',
-                               (self.user_id, next_due_date.strftime('%Y-%m-%d'), category, record_type, float(amount), linked_loan))
-                next_due_date = self.calculate_next_due_date(next_due_date, frequency)
-
-            # Update the next due date of the recurring record
-            self.c.execute('UPDATE recurring_records SET date = ? WHERE id = ?', (next_due_date.strftime('%Y-%m-%d'), record_id))
-
-        # Commit the changes to the database
-        self.conn.commit()
+        if self.engine.catch_up_recurring(self.user_id):
+            self.invalidate('records', 'loans')
 
     def calculate_next_due_date(self, current_date, frequency):
-        if frequency == 'Daily':
-            return current_date + datetime.timedelta(days=1)
-        elif frequency == 'Weekly':
-            return current_date + datetime.timedelta(weeks=1)
-        elif frequency == 'Monthly':
-            return current_date + datetime.timedelta(days=30)
-        elif frequency == 'Annual':
-            return current_date + datetime.timedelta(days=365)
-        else:
-            return current_date
+        return next_due_date(current_date, frequency)
 
     # Graph and prediction methods
     def show_predict_expenses(self):
@@ -697,9 +781,8 @@ class FinanceApp(QWidget):
         self.predict_expenses_dialog.resize(400, 300)
         layout = QVBoxLayout()
 
-        prediction_periods = ["Next Day", "Next Week", "Next Month"]
         self.period_combobox = QComboBox()
-        self.period_combobox.addItems(prediction_periods)
+        self.period_combobox.addItems(list(PREDICTION_PERIODS))
         layout.addWidget(self.period_combobox)
 
         self.predict_button = QPushButton("Predict")
@@ -714,76 +797,13 @@ class FinanceApp(QWidget):
 
     def predict_expenses(self):
         period = self.period_combobox.currentText()
-
-        if period == "Next Day":
-            freq = 'D'
-            periods = 1
-        elif period == "Next Week":
-            freq = 'W'
-            periods = 1
-        elif period == "Next Month":
-            freq = 'ME'
-            periods = 1
-
         try:
-            # Fetching past expense records, excluding Income and Investments
-            self.c.execute('''
-                SELECT date, amount FROM records 
-                WHERE user_id = ? AND type = "Expense" AND category != "Investments"
-            ''', (self.user_id,))
-            records = self.c.fetchall()
-            df = pd.DataFrame(records, columns=['date', 'amount'])
-            df['date'] = pd.to_datetime(df['date'])
-            df.set_index('date', inplace=True)
-
-            # Group by the appropriate frequency
-            if freq == 'D':
-                df = df.resample('D').sum().fillna(0)
-            elif freq == 'W':
-                df = df.resample('W').sum().fillna(0)
-            elif freq == 'ME':
-                df = df.resample('ME').sum().fillna(0)
-
-            # Ensure there are at least 4 observations
-            if len(df) < 4:
+            total_expenses = self.engine.predict_expenses(self.user_id, period)
+            if total_expenses is None:
                 QMessageBox.warning(self, "Warning", "Not enough data to make a prediction. At least 4 observations are required.")
                 return
 
-            # Create lag features
-            df['lag_1'] = df['amount'].shift(1).fillna(0)
-            df['lag_2'] = df['amount'].shift(2).fillna(0)
-            df['lag_3'] = df['amount'].shift(3).fillna(0)
-
-            # Preparing the data for the model
-            X = df[['lag_1', 'lag_2', 'lag_3']].values
-            y = df['amount'].values
-
-            # Training the model
-            model = LinearRegression()
-            model.fit(X, y)
-
-            # Predicting expenses
-            last_known_index = df.index[-1]
-            future_dates = pd.date_range(start=last_known_index + pd.Timedelta(days=1), periods=periods, freq=freq)
-            future_days = pd.DataFrame(index=future_dates)
-            future_days['lag_1'] = df['amount'].iloc[-1]
-            future_days['lag_2'] = df['amount'].iloc[-2] if len(df) > 1 else 0
-            future_days['lag_3'] = df['amount'].iloc[-3] if len(df) > 2 else 0
-
-            predictions = []
-            for i in range(periods):
-                pred = model.predict(future_days.iloc[i].values.reshape(1, -1))[0]
-                pred = max(0, pred)  # Ensure predictions are not negative
-                predictions.append(pred)
-
-                # Update lag features for the next prediction
-                if i + 1 < periods:
-                    future_days.iloc[i + 1, future_days.columns.get_loc('lag_1')] = pred
-                    future_days.iloc[i + 1, future_days.columns.get_loc('lag_2')] = future_days.iloc[i, future_days.columns.get_loc('lag_1')]
-                    future_days.iloc[i + 1, future_days.columns.get_loc('lag_3')] = future_days.iloc[i, future_days.columns.get_loc('lag_2')]
-
             # Displaying the result
-            total_expenses = sum(predictions)
             self.result_label_prediction.setText(f"Predicted expenses for {period}:\n${total_expenses:.2f}")
             self.result_label_prediction.setStyleSheet("font-size: 18px; font-weight: bold;")
             self.result_label_prediction.setAlignment(Qt.AlignCenter)
@@ -791,47 +811,73 @@ class FinanceApp(QWidget):
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
 
+    def change_graph_range(self, name):
+        custom = GRAPH_RANGES[name] is None
+        self.graph_start_input.setEnabled(custom)
+        self.graph_end_input.setEnabled(custom)
+        self.show_graph()
+
+    def graph_range(self):
+        days = GRAPH_RANGES[self.graph_range_combobox.currentText()]
+        if days is None:
+            start = self.graph_start_input.date().toPyDate()
+            end = self.graph_end_input.date().toPyDate()
+            return min(start, end), max(start, end)
+        today = datetime.date.today()
+        return today - datetime.timedelta(days=days - 1), today
+
     def show_graph(self):
-        self.tab_widget.setCurrentWidget(self.graph_tab)
-
-        # Fetch regular records from the past 7 days
-        self.c.execute('''
-            SELECT strftime("%w", date) as weekday, sum(amount), type 
-            FROM records 
-            WHERE user_id = ? AND date >= date('now', 'weekday 0', '-7 days') AND date < date('now', 'weekday 0')
-            GROUP BY weekday, type
-        ''', (self.user_id,))
-        data = self.c.fetchall()
-
-        # Fetch recurring records that fall within the past 7 days
-        today = datetime.datetime.today().date()
-        last_week = today - datetime.timedelta(days=7)
-
-        self.c.execute('''
-            SELECT id, date, category, type, amount, frequency, linked_loan 
-            FROM recurring_records 
-            WHERE user_id = ? AND category != "Investments"
-        ''', (self.user_id,))
-        recurring_records = self.c.fetchall()
-
-        recurring_data = []
-        for record in recurring_records:
-            record_id, date, category, record_type, amount, frequency, linked_loan = record
-            next_due_date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
-            while next_due_date <= today:
-                if next_due_date >= last_week:
-                    weekday = next_due_date.weekday()
-                    recurring_data.append((str(weekday), amount, record_type))
-                next_due_date = self.calculate_next_due_date(next_due_date, frequency)
-
-        # Combine regular and recurring data
-        combined_data = data + recurring_data
-
-        # Create dataframe for visualization
-        df = pd.DataFrame(combined_data, columns=['weekday', 'amount', 'type'])
-        all_days = pd.DataFrame({'weekday': [str(i) for i in range(7)] * 2, 'amount': [0] * 14, 'type': ['Expense'] * 7 + ['Income'] * 7})
-        df = all_days.merge(df, on=['weekday', 'type'], how='left').fillna(0).infer_objects(copy=False)
-        df = df.drop('amount_x', axis=1).rename(columns={'amount_y': 'amount'}).infer_objects(copy=False)
+        start, end = self.graph_range()
+        days = (end - start).days + 1
+
+        # Bars per day for up to a month, per week (starting on Sunday) up to half a year, per month beyond that
+        if days <= 31:
+            def bucket(day):
+                return day
+            label_format = '%a %d' if days <= 7 else '%d %b'
+            period = 'Daily'
+        elif days <= 184:
+            def bucket(day):
+                return day - datetime.timedelta(days=(day.weekday() + 1) % 7)
+            label_format = '%d %b'
+            period = 'Weekly'
+        else:
+            def bucket(day):
+                return day.replace(day=1)
+            label_format = '%b %Y'
+            period = 'Monthly'
+
+        buckets = sorted({bucket(start + datetime.timedelta(days=i)) for i in range(days)})
+        totals = {(b, record_type): 0.0 for b in buckets for record_type in ('Expense', 'Income')}
+
+        # Recorded amounts come from the daily rollups, so the cost depends on the range, not on the number of records
+        for day, record_type, amount in self.storage.rollups.daily(self.user_id, start, end):
+            key = (bucket(datetime.date.fromisoformat(day)), record_type)
+            if key in totals:
+                totals[key] += amount
+
+        # Add recurring records that are due within the range but not yet recorded
+        for record in self.storage.records.recurring(self.user_id):
+            if record.category == "Investments":
+                continue
+            anchor = datetime.datetime.strptime(record.date, '%Y-%m-%d').date()
+            for due_date in occurrences_between(anchor, record.frequency, start, end):
+                key = (bucket(due_date), record.type)
+                if key in totals:
+                    totals[key] += record.amount
+
+        self.graph_series = {
+            'range': self.graph_range_combobox.currentText(),
+            'title': f'{period} Income and Expenses, {start} to {end}',
+            'labels': [b.strftime(label_format) for b in buckets],
+            'Expense': [totals[(b, 'Expense')] for b in buckets],
+            'Income': [totals[(b, 'Income')] for b in buckets],
+        }
+        self.draw_graph(self.graph_series)
+
+    def draw_graph(self, series):
+        # Plain matplotlib grouped bars, so the startup chart does not need pandas or seaborn
+        labels = series['labels']
 
         self.figure.clear()
         self.figure.set_size_inches(12, 8)
@@ -846,24 +892,29 @@ class FinanceApp(QWidget):
             return colorsys.hls_to_rgb(c[0], 1 - amount * (1 - c[1]), c[2])
 
         colors = {'Expense': lighten_color('darkred', 0.5), 'Income': lighten_color('darkgreen', 0.5)}
-        sns.barplot(x='weekday', y='amount', hue='type', data=df, palette=colors, edgecolor=".2", ax=ax)
+        width = 0.4
+        for offset, record_type in ((-width / 2, 'Expense'), (width / 2, 'Income')):
+            ax.bar([i + offset for i in range(len(labels))], series[record_type], width=width,
+                   color=colors[record_type], edgecolor=".2", label=record_type)
 
-        ax.set_title('Weekly Income and Expenses')
+        ax.set_title(series['title'])
         ax.spines['top'].set_visible(False)
         ax.spines['right'].set_visible(False)
         ax.spines['left'].set_visible(False)
 
-        plt.rcParams['font.sans-serif'] = ['Arial']
+        matplotlib.rcParams['font.sans-serif'] = ['Arial']
 
-        for p in ax.patches:
-            if p.get_height() > 0:
-                ax.text(p.get_x() + p.get_width() / 2., p.get_height(), '%d' % int(p.get_height()),
-                        fontsize=12, color='black', ha='center', va='bottom')
-
-        ax.set_yticks([])
+        # Value labels stay readable only while there are few bars
+        if len(labels) <= 14:
+            for p in ax.patches:
+                if p.get_height() > 0:
+                    ax.text(p.get_x() + p.get_width() / 2., p.get_height(), '%d' % int(p.get_height()),
+                            fontsize=12, color='black', ha='center', va='bottom')
+            ax.set_yticks([])
         ax.set_ylabel('')
-        ax.set_xticks(range(7))
-        ax.set_xticklabels(['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat'])
+        ax.set_xlabel('')
+        ax.set_xticks(range(len(labels)))
+        ax.set_xticklabels(labels, rotation=45 if len(labels) > 14 else 0, ha='right' if len(labels) > 14 else 'center')
         ax.legend()
 
         self.canvas.draw()
@@ -882,8 +933,7 @@ class FinanceApp(QWidget):
         dialog.resize(800, 600)
         layout = QVBoxLayout()
 
-        self.c.execute('SELECT portfolio_id, UPPER(symbol), company_name, purchase_price, quantity, purchase_date FROM portfolio WHERE user_id = ?', (self.user_id,))
-        stocks = self.c.fetchall()
+        stocks = self.storage.portfolio.lots(self.user_id)
 
         self.remove_stock_table = QTableWidget()
         self.remove_stock_table.setColumnCount(6)
@@ -922,31 +972,50 @@ class FinanceApp(QWidget):
 
     def confirm_remove_stock(self, dialog):
         try:
-            total_pl = 0
-            for row in range(self.remove_stock_table.rowCount()):
-                checkbox = self.remove_stock_table.cellWidget(row, 0)
-                if checkbox.isChecked():
-                    stock_id = checkbox.property('stock_id')
-                    symbol = self.remove_stock_table.item(row, 1).text()
-                    purchase_price = float(self.remove_stock_table.item(row, 3).text())
-                    quantity = float(self.remove_stock_table.item(row, 4).text())
-                    current_price = self.get_stock_info(symbol)[1]
-                    pl = (current_price - purchase_price) * quantity
-                    total_pl += pl
-                    self.c.execute('DELETE FROM portfolio WHERE portfolio_id = ?', (stock_id,))
-                    if self.add_to_records_checkbox.isChecked():
-                        category = "Investments"
-                        record_type = "Income" if pl >= 0 else "Expense"
-                        self.c.execute('INSERT INTO records (user_id, date, category, type, amount) VALUES (?, ?, ?, ?, ?)',
-                                    (self.user_id, datetime.datetime.now().date(), category, record_type, abs(pl)))
-            self.conn.commit()
+            selected_rows = [row for row in range(self.remove_stock_table.rowCount())
+                             if self.remove_stock_table.cellWidget(row, 0).isChecked()]
+            # Price all selected holdings with a single batched request
+            quotes = self.get_quotes([self.remove_stock_table.item(row, 1).text() for row in selected_rows])
+
+            # Without a price the P&L is unknown, so the user decides what happens to those lots
+            # before anything is deleted
+            unpriced = sorted({self.remove_stock_table.item(row, 1).text().upper() for row in selected_rows
+                               if self.remove_stock_table.item(row, 1).text().upper() not in quotes})
+            if unpriced and self.add_to_records_checkbox.isChecked():
+                message_box = QMessageBox(QMessageBox.Warning, "No Price Data",
+                                          f"No current price for: {', '.join(unpriced)}. Their profit or loss cannot be "
+                                          "added to the records.", parent=dialog)
+                keep_button = message_box.addButton("Keep Unpriced Lots", QMessageBox.AcceptRole)
+                remove_button = message_box.addButton("Remove Without Records", QMessageBox.DestructiveRole)
+                message_box.addButton(QMessageBox.Cancel)
+                message_box.exec_()
+                if message_box.clickedButton() == keep_button:
+                    selected_rows = [row for row in selected_rows if self.remove_stock_table.item(row, 1).text().upper() in quotes]
+                elif message_box.clickedButton() != remove_button:
+                    return
+
+            stock_ids = []
+            pl_records = []
+            today = datetime.datetime.now().date()
+            for row in selected_rows:
+                stock_ids.append(self.remove_stock_table.cellWidget(row, 0).property('stock_id'))
+                quote = quotes.get(self.remove_stock_table.item(row, 1).text().upper())
+                if quote is None:
+                    continue  # The user chose to remove it without a record
+                purchase_price = float(self.remove_stock_table.item(row, 3).text())
+                quantity = float(self.remove_stock_table.item(row, 4).text())
+                pl = (quote.price - purchase_price) * quantity
+                if self.add_to_records_checkbox.isChecked():
+                    pl_records.append((today, "Investments", "Income" if pl >= 0 else "Expense", abs(pl)))
+            # The lots and their realized P&L records are written together: one delete, one batched insert
+            with self.storage.transaction():
+                self.storage.portfolio.delete(stock_ids)
+                self.storage.records.add_many(self.user_id, pl_records)
             QMessageBox.information(self, "Success", "Selected stocks removed")
             dialog.close()
-            self.update_all()  # Update all relevant data
+            self.invalidate('portfolio', 'records')
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
-        finally:
-            dialog.deleteLater()  # Ensure dialog is deleted
         
 
     def save_stock(self, dialog, inputs):
@@ -957,12 +1026,10 @@ class FinanceApp(QWidget):
             symbol = symbol.upper()  # Convert the ticker symbol to uppercase
             company_name, current_price = self.get_stock_info(symbol)
             purchase_date_obj = datetime.datetime.strptime(purchase_date, '%Y-%m-%d').date()
-            self.c.execute('INSERT INTO portfolio (user_id, symbol, purchase_price, quantity, company_name, purchase_date) VALUES (?, ?, ?, ?, ?, ?)',
-                           (self.user_id, symbol, float(purchase_price), float(quantity), company_name, purchase_date_obj))
-            self.conn.commit()
+            self.storage.portfolio.add(self.user_id, symbol, float(purchase_price), float(quantity), company_name, purchase_date_obj)
             QMessageBox.information(self, "Success", "Stock added successfully")
             dialog.close()
-            self.update_all()  # Update all relevant data
+            self.invalidate('portfolio')
         except ValueError as ve:
             QMessageBox.critical(self, "Error", str(ve))
         except Exception as e:
@@ -970,10 +1037,9 @@ class FinanceApp(QWidget):
 
     def get_stock_info(self, symbol):
         try:
-            ticker = yf.Ticker(symbol)
-            info = ticker.info
-            company_name = info.get('shortName', None)
-            current_price = info.get('regularMarketPrice', info.get('currentPrice', None))
+            quote = self.market_data.get_quote(symbol, with_names=True)
+            company_name = quote.company_name if quote else None
+            current_price = quote.price if quote else None
 
             if not company_name or not current_price:
                 raise ValueError(f"Invalid ticker: {symbol}")
@@ -982,44 +1048,103 @@ class FinanceApp(QWidget):
         except Exception as e:
             raise ValueError(f"Error fetching data for symbol {symbol}: {str(e)}")
 
+    def get_quotes(self, symbols):
+        # Reuse quotes from the current refresh and batch-fetch only the missing symbols
+        symbols = [symbol.upper() for symbol in symbols]
+        missing = [symbol for symbol in symbols if symbol not in self.quotes or symbol in self.stale_symbols]
+        if missing:
+            try:
+                fetched = self.market_data.get_quotes(missing)
+                self.quotes.update(fetched)
+                self.stale_symbols.difference_update(fetched)
+            except Exception as e:
+                print(f"Error fetching quotes: {e}")
+                self.quotes.update(self.market_data.get_cached(missing))  # Fall back to the last known prices
+        return {symbol: self.quotes[symbol] for symbol in symbols if symbol in self.quotes}
+
     def show_all_stocks(self):
         dialog = QDialog(self)
         dialog.setWindowTitle("All Stock Records")
         dialog.resize(800, 600)
         layout = QVBoxLayout()
 
-        all_stocks_table = QTableWidget()
-        all_stocks_table.setColumnCount(6)
-        all_stocks_table.setHorizontalHeaderLabels(["Symbol", "Company Name", "Purchase Price", "Quantity", "Purchase Date", "Total P&L"])
-        all_stocks_table.horizontalHeader().setStretchLastSection(True)
-        all_stocks_table.setAlternatingRowColors(True)
-        all_stocks_table.setStyleSheet("alternate-background-color: #f0f0f0;")
-        all_stocks_table.horizontalHeader().setStyleSheet("font-weight: bold; font-size: 14px;")
-        all_stocks_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        # One batched quote lookup for the distinct symbols; the lots themselves are paged in
+        quotes = self.get_quotes(self.storage.portfolio.symbols([self.user_id]))
 
-        self.c.execute('SELECT symbol, company_name, purchase_price, quantity, purchase_date FROM portfolio WHERE user_id = ?', (self.user_id,))
-        stocks = self.c.fetchall()
-        all_stocks_table.setRowCount(len(stocks))
-
-        for row, stock in enumerate(stocks):
+        def format_stock(stock):
             symbol, company_name, purchase_price, quantity, purchase_date = stock
-            current_price = self.get_stock_info(symbol)[1]
-            total_pl = (current_price - purchase_price) * quantity
-            items = [symbol, company_name, f"{purchase_price:.2f}", f"{quantity:.2f}", purchase_date, f"{total_pl:.2f}"]
-            for col, item in enumerate(items):
-                cell_item = QTableWidgetItem(item)
-                cell_item.setTextAlignment(Qt.AlignCenter)
-                all_stocks_table.setItem(row, col, cell_item)
-
-        all_stocks_table.resizeColumnsToContents()
-        layout.addWidget(all_stocks_table)
+            quote = quotes.get(symbol.upper())
+            total_pl = f"{(quote.price - purchase_price) * quantity:.2f}" if quote else "N/A"
+            return [symbol, company_name, f"{purchase_price:.2f}", f"{quantity:.2f}", purchase_date, total_pl]
+
+        model = SqlTableModel(self.storage.conn, *self.storage.portfolio.lots_query(self.user_id),
+            ["Symbol", "Company Name", "Purchase Price", "Quantity", "Purchase Date", "Total P&L"],
+            ['symbol', 'company_name', 'purchase_price', 'quantity', 'purchase_date', None],
+            format_row=format_stock, parent=dialog)
+        layout.addWidget(self.create_filter_input(model))
+        layout.addWidget(self.create_table_view(model, sort_column=4))
         dialog.setLayout(layout)
         dialog.exec_()
 
+    def force_update_portfolio(self):
+        # Bypass the quote cache TTL when the user explicitly asks for fresh prices
+        self.single_flight.begin_cycle()
+        self.load_portfolio()
+        self.quote_refresher.start([stock[0] for stock in self.holdings], force=True)
+
+    def update_portfolio_value(self):
+        # Value the holdings with the quotes loaded so far and cached prices for the rest, without
+        # touching the network, so net worth and FIRE are right before the Portfolio tab is opened
+        self.holdings = self.storage.portfolio.holdings(self.user_id)
+        self.current_portfolio_value = self.engine.portfolio_value(self.holdings, self.quotes)
+
     def update_portfolio(self):
-        self.c.execute('SELECT UPPER(symbol), company_name, SUM(purchase_price * quantity) / SUM(quantity) as avg_price, SUM(quantity) as total_quantity FROM portfolio WHERE user_id = ? GROUP BY UPPER(symbol), company_name', (self.user_id,))
-        combined_stocks = self.c.fetchall()
-        self.portfolio_table.setRowCount(len(combined_stocks))
+        # Show the holdings with the quotes we already have, then refresh prices in the background
+        self.single_flight.begin_cycle()  # Start a new quote refresh cycle
+        self.load_portfolio()
+        self.quote_refresher.start([stock[0] for stock in self.holdings])
+
+    def load_portfolio(self):
+        self.holdings = self.storage.portfolio.holdings(self.user_id)
+        self.render_portfolio()
+
+    def on_quotes_ready(self, quotes):
+        # Called on the GUI thread each time a batch of quotes arrives
+        self.quotes.update(quotes)
+        self.stale_symbols.difference_update(quotes)
+        self.render_portfolio()
+        self.show_net_worth()
+
+    def on_history_ready(self, prices):
+        self.one_year_ago_prices.update(prices)
+        self.render_portfolio()
+
+    def on_quotes_finished(self, missing, errors):
+        # Holdings are never deleted here: a rate limit or outage must not cost the user data.
+        # Symbols the provider answered for but never priced are flagged so they can be removed by hand.
+        self.unknown_symbols = {symbol for symbol in missing if symbol not in self.quotes}
+        notices = []
+        if errors:
+            notices.append("Prices could not be refreshed, showing the last known prices.")
+        if self.unknown_symbols:
+            notices.append(f"No price data for: {', '.join(sorted(self.unknown_symbols))}")
+        self.portfolio_status_label.setText(" ".join(notices))
+        self.portfolio_status_label.setVisible(bool(notices))
+
+        # The refresh counters and the full error messages are kept out of the way, on hover
+        stats = self.single_flight.stats()
+        self.single_flight.end_cycle()  # Later lookups, e.g. cache revalidation, must reach the network
+        self.portfolio_status_label.setToolTip("\n".join(errors + [
+            f"Quote lookups: {stats['lookups']}, network requests: {stats['network_calls']}, "
+            f"saved by coalescing: {stats['coalesced']}"]))
+        self.render_portfolio()
+
+        self.stale_views.discard('portfolio_table')
+        self.update_stale_label()
+        self.invalidate('quotes')  # Record today's net worth with the refreshed prices
+
+    def render_portfolio(self):
+        self.portfolio_table.setRowCount(len(self.holdings))
 
         current_value = 0
         total_purchase_value = 0
@@ -1027,31 +1152,29 @@ class FinanceApp(QWidget):
         yearly_change = 0
         total_change = 0
 
-        for row, stock in enumerate(combined_stocks):
+        for row, stock in enumerate(self.holdings):
             symbol, company_name, avg_price, total_quantity = stock
-            try:
-                ticker = yf.Ticker(symbol)
-                info = ticker.info
-                current_price = self.get_stock_info(symbol)[1]
-                opening_price = info.get('regularMarketOpen', 0)
-                one_year_ago_price = ticker.history(start=datetime.datetime.now() - datetime.timedelta(days=365), end=datetime.datetime.now())['Close'].iloc[0]
+            quote = self.quotes.get(symbol)
+            if quote is None:
+                # Price not loaded yet; the row fills in when its batch arrives
+                status = "Unavailable" if symbol in self.unknown_symbols else "Loading..."
+                items = [symbol, company_name, f"{avg_price:.2f}", f"{total_quantity:.2f}", status, ""]
+            else:
+                current_price = quote.price
+                opening_price = quote.open
+                one_year_ago_price = self.one_year_ago_prices.get(symbol, current_price)
                 total_pl = (current_price - avg_price) * total_quantity
                 current_value += current_price * total_quantity
                 total_purchase_value += avg_price * total_quantity
                 daily_change += (current_price - opening_price) * total_quantity
                 yearly_change += (current_price - one_year_ago_price) * total_quantity
                 total_change += total_pl
-
                 items = [symbol, company_name, f"{avg_price:.2f}", f"{total_quantity:.2f}", f"{current_price:.2f}", f"{total_pl:.2f}"]
-                for col, item in enumerate(items):
-                    cell_item = QTableWidgetItem(item)
-                    cell_item.setTextAlignment(Qt.AlignCenter)
-                    self.portfolio_table.setItem(row, col, cell_item)
-            except ValueError as e:
-                QMessageBox.warning(self, "Warning", str(e))
-                self.c.execute('DELETE FROM portfolio WHERE user_id = ? AND symbol = ?', (self.user_id, symbol))
-                self.conn.commit()
-                self.portfolio_table.removeRow(row)
+
+            for col, item in enumerate(items):
+                cell_item = QTableWidgetItem(item)
+                cell_item.setTextAlignment(Qt.AlignCenter)
+                self.portfolio_table.setItem(row, col, cell_item)
 
         self.current_portfolio_value = current_value  # Update the portfolio value variable
 
@@ -1082,56 +1205,32 @@ class FinanceApp(QWidget):
             label.setAlignment(Qt.AlignCenter)
             self.portfolio_tab.layout().insertWidget(self.portfolio_tab.layout().count() - 5, label)  # Insert above the buttons
 
-        self.update_fire_values()  # Update FIRE values after updating the portfolio
-
     # Net worth methods
     def update_net_worth(self):
         try:
-            # Fetch total income
-            self.c.execute('SELECT SUM(amount) FROM records WHERE user_id = ? AND type="Income"', (self.user_id,))
-            total_income = self.c.fetchone()[0] or 0
-
-            # Fetch total expenses excluding those linked to loans
-            self.c.execute('SELECT SUM(amount) FROM records WHERE user_id = ? AND type="Expense" AND linked_loan IS NULL', (self.user_id,))
-            total_expenses = self.c.fetchone()[0] or 0
-
-            # Fetch total value of portfolio (current value)
-            self.c.execute('SELECT symbol, SUM(quantity) FROM portfolio WHERE user_id = ? GROUP BY symbol', (self.user_id,))
-            portfolio = self.c.fetchall()
-            total_portfolio_value = 0
-            for stock in portfolio:
-                symbol, total_quantity = stock
-                current_price = self.get_stock_info(symbol)[1]
-                total_portfolio_value += current_price * total_quantity
-
-            # Fetch total value of assets   
-            self.c.execute('SELECT SUM(purchase_price) FROM assets WHERE user_id = ?', (self.user_id,))
-            total_assets_value = self.c.fetchone()[0] or 0
-
-            # Fetch total liabilities (principal to be repaid plus current interest)
-            self.c.execute('SELECT SUM(principal + interest) FROM loans WHERE user_id = ?', (self.user_id,))
-            total_liabilities = self.c.fetchone()[0] or 0
-
-            # Calculate net worth
-            net_worth = total_income - total_expenses + total_portfolio_value + total_assets_value - total_liabilities
-
-            # Update net worth label style based on value
-            if net_worth < 0:
-                self.net_worth_label.setStyleSheet("font-size: 20px; color: red;")
-            else:
-                self.net_worth_label.setStyleSheet("font-size: 20px; color: green;")
-            self.net_worth_label.setText(f"${net_worth:,.2f}")
+            # Calculate net worth; the portfolio part is priced from the quotes loaded so far
+            self.net_worth_excluding_portfolio = self.engine.net_worth_excluding_portfolio(self.user_id)
+            net_worth = self.show_net_worth()
 
             # Update net worth history table
             today = datetime.datetime.now().date()
-            self.c.execute('INSERT OR REPLACE INTO net_worth_history (user_id, date, net_worth) VALUES (?, ?, ?)', (self.user_id, today, net_worth))
-            self.conn.commit()
+            self.storage.net_worth.record(self.user_id, today, net_worth)
+            self.invalidate('net_worth_history')  # Redraw the graph when its tab is visible
 
-            # Update net worth graph
-            self.c.execute('SELECT date, net_worth FROM net_worth_history WHERE user_id = ? ORDER BY date', (self.user_id,))
-            records = self.c.fetchall()
-            dates = [datetime.datetime.strptime(record[0], '%Y-%m-%d') for record in records]
-            net_worths = [record[1] for record in records]
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e))
+
+    def show_net_worth_graph(self):
+        try:
+            self.net_worth_series = [list(record) for record in self.storage.net_worth.history(self.user_id)]
+            self.draw_net_worth_graph(self.net_worth_series)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e))
+
+    def draw_net_worth_graph(self, series):
+        try:
+            dates = [datetime.datetime.strptime(record[0], '%Y-%m-%d') for record in series]
+            net_worths = [record[1] for record in series]
 
             self.figure_net_worth.clear()
             ax_net_worth = self.figure_net_worth.add_subplot(111)
@@ -1144,10 +1243,88 @@ class FinanceApp(QWidget):
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
 
+    def show_net_worth(self):
+        # Cheap label refresh used while quote batches are still arriving
+        net_worth = self.net_worth_excluding_portfolio + self.current_portfolio_value
+
+        # Update net worth label style based on value
+        if net_worth < 0:
+            self.net_worth_label.setStyleSheet("font-size: 20px; color: red;")
+        else:
+            self.net_worth_label.setStyleSheet("font-size: 20px; color: green;")
+        self.net_worth_label.setText(f"${net_worth:,.2f}")
+        return net_worth
+
     # Record methods
+    def import_statement(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Import Statement", "", "Bank statements (*.csv *.ofx *.qfx)")
+        if path:
+            self.start_import(path)
+
+    def start_import(self, path, date_format=None):
+        progress = QProgressDialog("Importing statement...", "Cancel", 0, 100, self)
+        progress.setWindowTitle("Import Statement")
+        progress.setMinimumDuration(0)
+
+        def show_progress(read, percent):
+            progress.setLabelText(f"{read} lines read")
+            progress.setValue(percent)
+
+        # The import runs on a pool thread; the window stays responsive and is refreshed once at the end
+        self.import_worker = ImportWorker(self.storage, self.user_id, path, date_format)
+        self.import_worker.signals.progress.connect(show_progress)
+        self.import_worker.signals.finished.connect(lambda result, error: self.statement_imported(progress, result, error))
+        progress.canceled.connect(self.import_worker.cancel)
+        self.import_statement_button.setEnabled(False)
+        QThreadPool.globalInstance().start(self.import_worker)
+
+    def statement_imported(self, progress, result, error):
+        progress.close()
+        self.import_statement_button.setEnabled(True)
+        worker, self.import_worker = self.import_worker, None
+        if isinstance(worker.error, AmbiguousDateFormat):
+            # Nothing was written yet; ask which way the dates read and import again
+            date_format, ok = QInputDialog.getItem(self, "Import Statement", "The dates fit more than one format. Date format",
+                                                   worker.error.candidates, 0, False)
+            if ok:
+                self.start_import(worker.path, date_format)
+            return
+        # Chunks committed before a cancel or an error stay imported, so refresh either way
+        self.invalidate('records')
+        if error:
+            QMessageBox.critical(self, "Import Error", error)
+        else:
+            QMessageBox.information(self, "Import Statement",
+                                    f"Imported {result.imported} record(s). {result.duplicates} were already imported, "
+                                    f"{result.skipped} line(s) could not be read.")
+
+    def export_data(self):
+        directory = QFileDialog.getExistingDirectory(self, "Export Data")
+        if not directory:
+            return
+        export_format = 'csv'
+        if len(export_formats()) > 1:
+            export_format, ok = QInputDialog.getItem(self, "Export Data", "Format", export_formats(), 0, False)
+            if not ok:
+                return
+
+        # Runs on a pool thread against a read snapshot, so the window stays usable during large exports
+        self.export_worker = ExportWorker(self.storage, self.user_id, directory, export_format)
+        self.export_worker.signals.finished.connect(self.data_exported)
+        self.export_data_button.setEnabled(False)
+        QThreadPool.globalInstance().start(self.export_worker)
+
+    def data_exported(self, exported, error):
+        self.export_data_button.setEnabled(True)
+        self.export_worker = None
+        if error:
+            QMessageBox.critical(self, "Export Error", error)
+        else:
+            QMessageBox.information(self, "Export Data", "\n".join(f"{table}: {rows} row(s)" for table, rows in exported.items()))
+
     def show_form(self):
         inputs = [QDateEdit(), QComboBox(), QComboBox(), QLineEdit(), QCheckBox(), QComboBox(), QComboBox()]
-        inputs[1].addItems(["Groceries", "Utilities", "Rent", "Entertainment", "Transport", "Healthcare", "Paycheck", "Investments", "Other", "Loan"])
+        inputs[1].addItems(RECORD_CATEGORIES)
         inputs[2].addItems(["Income", "Expense"])
         inputs[4].setText("Recurring Record")
         inputs[6].addItems(["Daily", "Weekly", "Monthly", "Annual"])  # Recurrence frequency
@@ -1182,10 +1359,8 @@ class FinanceApp(QWidget):
             inputs[6].setEnabled(False)
 
     def load_loans_into_combobox(self, loan_combobox):
-        self.c.execute('SELECT loan_id, name FROM loans WHERE user_id = ?', (self.user_id,))
-        loans = self.c.fetchall()
-        for loan in loans:
-            loan_combobox.addItem(loan[1], loan[0])
+        for loan in self.storage.loans.list(self.user_id):
+            loan_combobox.addItem(loan.name, loan.loan_id)
 
     def add_record(self, dialog, inputs):
         try:
@@ -1203,24 +1378,13 @@ class FinanceApp(QWidget):
             date_obj = datetime.datetime.strptime(date, '%Y-%m-%d').date()
 
             if is_recurring:
-                if loan_id:
-                    self.c.execute('INSERT INTO recurring_records (user_id, date, category, type, amount, frequency, linked_loan) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                                   (self.user_id, date, category, record_type, amount, frequency, loan_id))
-                else:
-                    self.c.execute('INSERT INTO recurring_records (user_id, date, category, type, amount, frequency) VALUES (?, ?, ?, ?, ?, ?)',
-                                   (self.user_id, date, category, record_type, amount, frequency))
+                self.storage.records.add_recurring(self.user_id, date, category, record_type, amount, frequency, loan_id or None)
             else:
-                if loan_id:
-                    self.c.execute('INSERT INTO records (user_id, date, category, type, amount, linked_loan) VALUES (?, ?, ?, ?, ?, ?)',
-                                   (self.user_id, date, category, record_type, amount, loan_id))
-                else:
-                    self.c.execute('INSERT INTO records (user_id, date, category, type, amount) VALUES (?, ?, ?, ?, ?)',
-                                   (self.user_id, date, category, record_type, amount))
-
-            self.conn.commit()
+                self.storage.records.add(self.user_id, date, category, record_type, amount, loan_id or None)
+
             QMessageBox.information(self, "Success", "Record added successfully")
             dialog.close()
-            self.update_all()  # Update all relevant data
+            self.invalidate('recurring_records' if is_recurring else 'records')
         except ValueError as ve:
             QMessageBox.critical(self, "Input Error", str(ve))
         except Exception as e:
@@ -1233,157 +1397,146 @@ class FinanceApp(QWidget):
         dialog.resize(800, 600)  # Adjust the size of the dialog window
         layout = QVBoxLayout()
 
-        self.records_table = QTableWidget()
-        self.records_table.setColumnCount(5)
-        self.records_table.setHorizontalHeaderLabels(["Select", "Date", "Category", "Type", "Amount"])
-        self.records_table.horizontalHeader().setStretchLastSection(True)
-        self.records_table.setAlternatingRowColors(True)
-        self.records_table.setStyleSheet("alternate-background-color: #f0f0f0;")
-        self.records_table.horizontalHeader().setStyleSheet("font-weight: bold; font-size: 14px;")
-        self.records_table.setEditTriggers(QTableWidget.NoEditTriggers)  # Make table read-only
-
-        # Fetch only non-recurring records
-        self.c.execute('''
-            SELECT rowid, date, category, type, amount 
-            FROM records 
-            WHERE user_id = ? 
-            AND rowid NOT IN (SELECT rowid FROM records WHERE user_id = ? AND linked_loan IS NOT NULL)
-            ORDER BY date DESC
-        ''', (self.user_id, self.user_id))
-        records = self.c.fetchall()
-
-        self.records_table.setRowCount(len(records))
-
-        for row, record in enumerate(records):
-            checkbox = QCheckBox()
-            checkbox.setStyleSheet("margin:auto;")  # Center the checkbox
-            checkbox.stateChanged.connect(self.toggle_remove_button)
-            checkbox.setProperty('record_id', record[0])
-            self.records_table.setCellWidget(row, 0, checkbox)
-
-            for col, value in enumerate(record[1:], start=1):
-                cell_item = QTableWidgetItem(str(value))
-                cell_item.setTextAlignment(Qt.AlignCenter)
-                self.records_table.setItem(row, col, cell_item)
-
-        # Resize columns to fit the contents
-        self.records_table.resizeColumnsToContents()
+        # Only records not linked to a loan, newest first; pages are loaded as the table scrolls
+        self.records_model = RecordsTableModel(self.storage.records, self.user_id, RecordFilter(linked_loan=False),
+                                               checkable=True, parent=dialog)
+        layout.addLayout(self.create_records_filter())
+        layout.addWidget(self.create_select_all_checkbox(self.records_model))
+        self.records_table = self.create_table_view(self.records_model, sort_column=1)
 
         self.remove_record_button = QPushButton("Remove Record")
         self.remove_record_button.setEnabled(False)
         self.remove_record_button.clicked.connect(lambda: self.remove_selected_records(dialog))
+        self.records_model.checked_changed.connect(lambda count: self.remove_record_button.setEnabled(count > 0))
         layout.addWidget(self.records_table)
         layout.addWidget(self.remove_record_button)
 
         dialog.setLayout(layout)
         dialog.exec_()
 
+    def create_records_filter(self):
+        filter_layout = QHBoxLayout()
+        self.records_category_filter = QComboBox()
+        self.records_category_filter.addItems(["All Categories"] + RECORD_CATEGORIES)
+        self.records_type_filter = QComboBox()
+        self.records_type_filter.addItems(["All Types", "Income", "Expense"])
+        self.records_filter_inputs = {}
+        for name, placeholder in (('start', "From (YYYY-MM-DD)"), ('end', "To (YYYY-MM-DD)"), ('min_amount', "Min Amount"), ('max_amount', "Max Amount")):
+            line_edit = QLineEdit()
+            line_edit.setPlaceholderText(placeholder)
+            if name.endswith('amount'):
+                line_edit.setValidator(QDoubleValidator(0.0, 1e9, 2))
+            line_edit.textChanged.connect(self.apply_records_filter)
+            self.records_filter_inputs[name] = line_edit
+
+        self.records_category_filter.currentTextChanged.connect(self.apply_records_filter)
+        self.records_type_filter.currentTextChanged.connect(self.apply_records_filter)
+        filter_layout.addWidget(self.records_category_filter)
+        filter_layout.addWidget(self.records_type_filter)
+        for line_edit in self.records_filter_inputs.values():
+            filter_layout.addWidget(line_edit)
+        return filter_layout
+
+    def records_filter(self):
+        # Incomplete or invalid values are ignored while the user is still typing
+        values = {}
+        for name, line_edit in self.records_filter_inputs.items():
+            text = line_edit.text().strip()
+            try:
+                values[name] = float(text) if name.endswith('amount') else datetime.date.fromisoformat(text)
+            except ValueError:
+                values[name] = None
+        category = self.records_category_filter.currentText()
+        record_type = self.records_type_filter.currentText()
+        return RecordFilter(category=None if category == "All Categories" else category,
+                            record_type=None if record_type == "All Types" else record_type,
+                            linked_loan=False, **values)
+
+    def apply_records_filter(self):
+        self.records_model.set_record_filter(self.records_filter())
+
+    def create_table_view(self, model, sort_column):
+        # Read-only view over a paged model; clicking a header re-sorts in SQL
+        view = QTableView()
+        view.setModel(model)
+        view.horizontalHeader().setStretchLastSection(True)
+        view.setAlternatingRowColors(True)
+        view.setStyleSheet("alternate-background-color: #f0f0f0;")
+        view.horizontalHeader().setStyleSheet("font-weight: bold; font-size: 14px;")
+        view.setEditTriggers(QTableView.NoEditTriggers)  # Make table read-only
+        view.verticalHeader().hide()
+        view.horizontalHeader().setSortIndicator(sort_column, Qt.DescendingOrder)
+        view.setSortingEnabled(True)  # Sorts by the indicator, which loads the first page
+        view.resizeColumnsToContents()
+
+        # A click on a header the model cannot sort by leaves the rows as they are, so the indicator goes back too
+        sorted_by = [sort_column, Qt.DescendingOrder]
+
+        def keep_sort_indicator(section, order):
+            header = view.horizontalHeader()
+            if model.sortable(section):
+                sorted_by[:] = [section, order]
+                return
+            header.blockSignals(True)
+            header.setSortIndicator(*sorted_by)
+            header.blockSignals(False)
+
+        view.horizontalHeader().sortIndicatorChanged.connect(keep_sort_indicator)
+        return view
+
+    def create_filter_input(self, model):
+        filter_input = QLineEdit()
+        filter_input.setPlaceholderText("Filter")
+        filter_input.textChanged.connect(model.set_filter)
+        return filter_input
+
+    def create_select_all_checkbox(self, model):
+        # Checks every row matching the current filter, including rows that have not been loaded yet
+        checkbox = QCheckBox("Select all matching")
+        checkbox.toggled.connect(model.check_all)
+        return checkbox
+
     def show_recurring_records(self):
         dialog = QDialog(self)
         dialog.setWindowTitle("Recurring Records")
         dialog.resize(800, 600)  # Adjust the size of the dialog window
         layout = QVBoxLayout()
 
-        self.recurring_records_table = QTableWidget()
-        self.recurring_records_table.setColumnCount(6)
-        self.recurring_records_table.setHorizontalHeaderLabels(["Select", "Date", "Category", "Type", "Amount", "Frequency"])
-        self.recurring_records_table.horizontalHeader().setStretchLastSection(True)
-        self.recurring_records_table.setAlternatingRowColors(True)
-        self.recurring_records_table.setStyleSheet("alternate-background-color: #f0f0f0;")
-        self.recurring_records_table.horizontalHeader().setStyleSheet("font-weight: bold; font-size: 14px;")
-        self.recurring_records_table.setEditTriggers(QTableWidget.NoEditTriggers)  # Make table read-only
-
-        # Fetch recurring records
-        self.c.execute('''
-            SELECT id, date, category, type, amount, frequency FROM recurring_records 
-            WHERE user_id = ?
-            ORDER BY date DESC
-        ''', (self.user_id,))
-        records = self.c.fetchall()
-
-        self.recurring_records_table.setRowCount(len(records))
-
-        for row, record in enumerate(records):
-            checkbox = QCheckBox()
-            checkbox.setStyleSheet("margin:auto;")  # Center the checkbox
-            checkbox.stateChanged.connect(self.toggle_remove_button_recurring)
-            checkbox.setProperty('record_id', record[0])
-            self.recurring_records_table.setCellWidget(row, 0, checkbox)
-
-            for col, value in enumerate(record[1:], start=1):
-                cell_item = QTableWidgetItem(str(value))
-                cell_item.setTextAlignment(Qt.AlignCenter)
-                self.recurring_records_table.setItem(row, col, cell_item)
-
-        # Resize columns to fit the contents
-        self.recurring_records_table.resizeColumnsToContents()
+        self.recurring_records_model = SqlTableModel(self.storage.conn, *self.storage.records.recurring_query(self.user_id),
+            ["Date", "Category", "Type", "Amount", "Frequency"], ['date', 'category', 'type', 'amount', 'frequency'],
+            checkable=True, parent=dialog)
+        layout.addWidget(self.create_filter_input(self.recurring_records_model))
+        layout.addWidget(self.create_select_all_checkbox(self.recurring_records_model))
+        self.recurring_records_table = self.create_table_view(self.recurring_records_model, sort_column=1)
 
         self.remove_recurring_record_button = QPushButton("Remove Recurring Record")
         self.remove_recurring_record_button.setEnabled(False)
         self.remove_recurring_record_button.clicked.connect(lambda: self.remove_selected_recurring_records(dialog))
+        self.recurring_records_model.checked_changed.connect(lambda count: self.remove_recurring_record_button.setEnabled(count > 0))
         layout.addWidget(self.recurring_records_table)
         layout.addWidget(self.remove_recurring_record_button)
 
         dialog.setLayout(layout)
         dialog.exec_()
 
-    def toggle_remove_button_recurring(self):
-        any_checked = any(self.recurring_records_table.cellWidget(row, 0).isChecked() for row in range(self.recurring_records_table.rowCount()))
-        self.remove_recurring_record_button.setEnabled(any_checked)
-
     def remove_selected_recurring_records(self, dialog):
         try:
-            for row in range(self.recurring_records_table.rowCount()):
-                checkbox = self.recurring_records_table.cellWidget(row, 0)
-                if checkbox.isChecked():
-                    record_id = checkbox.property('record_id')
-                    print(f"Removing recurring record with ID: {record_id}")  # Debug print
-
-                    if record_id:
-                        # Get the linked loan before deleting the recurring record
-                        self.c.execute('SELECT linked_loan FROM recurring_records WHERE id = ?', (record_id,))
-                        linked_loan = self.c.fetchone()
-
-                        if linked_loan:
-                            linked_loan = linked_loan[0]
-                            print(f"Linked loan ID: {linked_loan}")  # Debug print
-                            if linked_loan:
-                                # Reset the loan to its initial state
-                                self.c.execute('SELECT initial_principal FROM loans WHERE loan_id = ?', (linked_loan,))
-                                initial_principal = self.c.fetchone()[0]
-                                self.c.execute('UPDATE loans SET principal = ?, interest = 0 WHERE loan_id = ?', (initial_principal, linked_loan))
-                                self.c.execute('DELETE FROM loan_repayment WHERE loan_id = ?', (linked_loan,))
-
-                            # Delete associated records in the main records table
-                            self.c.execute('DELETE FROM records WHERE linked_loan = ?', (linked_loan,))
-
-                        # Delete the recurring record
-                        self.c.execute('DELETE FROM recurring_records WHERE id = ?', (record_id,))
-
-            self.conn.commit()
+            # Removals and loan resets are set-based and committed together
+            self.storage.records.delete_recurring(self.recurring_records_model.checked_ids())
             QMessageBox.information(self, "Success", "Selected recurring records removed and loans reset to initial state")
             dialog.close()
-            self.update_all()  # Update all relevant data
+            self.invalidate('recurring_records', 'records', 'loans')
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
         finally:
             dialog.deleteLater()  # Ensure dialog is deleted
 
-    def toggle_remove_button(self):
-        any_checked = any(self.records_table.cellWidget(row, 0).isChecked() for row in range(self.records_table.rowCount()))
-        self.remove_record_button.setEnabled(any_checked)
-
     def remove_selected_records(self, dialog):
         try:
-            for row in range(self.records_table.rowCount()):
-                checkbox = self.records_table.cellWidget(row, 0)
-                if checkbox.isChecked():
-                    record_id = checkbox.property('record_id')
-                    self.c.execute('DELETE FROM records WHERE rowid = ?', (record_id,))
-            self.conn.commit()
+            self.storage.records.delete(self.records_model.checked_ids())
             QMessageBox.information(self, "Success", "Selected records removed")
             dialog.close()
-            self.update_all()  # Update all relevant data
+            self.invalidate('records')
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
         finally:
@@ -1415,12 +1568,19 @@ class FinanceApp(QWidget):
             annual_roi = float(annual_roi) / 100
             include_loan_expenses = self.include_loan_expenses_checkbox.isChecked()
 
-            years_to_retirement, portfolio_values = self.calculate_years_to_retirement(
-                portfolio_value, annual_income, savings_rate, income_growth_rate, income_growth_duration,
-                annual_expenses, withdrawal_rate, annual_roi, include_loan_expenses
-            )
+            inputs = FireInputs(portfolio_value, annual_income, savings_rate, income_growth_rate, income_growth_duration,
+                                annual_expenses, withdrawal_rate, annual_roi, include_loan_expenses)
+            return_model = self.return_model_combobox.currentText()
+            if return_model != FIXED_ROI:
+                self.simulate_fire(inputs, return_model)
+                return
 
-            self.result_label.setText(f"You can retire in <b>{years_to_retirement}</b> years.")
+            years_to_retirement, portfolio_values = self.engine.years_to_retirement(self.user_id, inputs)
+
+            if years_to_retirement is None:
+                self.result_label.setText(f"You cannot retire within <b>{len(portfolio_values) - 1}</b> years with these inputs.")
+            else:
+                self.result_label.setText(f"You can retire in <b>{years_to_retirement}</b> years.")
             self.result_label.setStyleSheet("font-size: 24px; text-align: center;")
             self.result_label.adjustSize()
             self.plot_fire_growth(portfolio_values)
@@ -1430,98 +1590,43 @@ class FinanceApp(QWidget):
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e))
 
-    def calculate_years_to_retirement(self, portfolio_value, annual_income, savings_rate, income_growth_rate,
-                                    income_growth_duration, annual_expenses, withdrawal_rate, annual_roi,
-                                    include_loan_expenses):
-        years = 0
-        portfolio_values = [portfolio_value]
-
-        if include_loan_expenses:
-            # Load loan data
-            self.c.execute('SELECT loan_id, principal, interest, interest_rate FROM loans WHERE user_id = ?', (self.user_id,))
-            loans = self.c.fetchall()
-            loan_details = {loan[0]: {'principal': loan[1], 'interest': loan[2], 'interest_rate': loan[3]} for loan in loans}
+    def simulate_fire(self, inputs, return_model):
+        volatility = self.volatility_input.text().strip()
+        paths = self.paths_input.text().strip()
+        if not volatility or not paths:
+            QMessageBox.warning(self, "Input Error", "All fields must be filled.")
+            return
+        paths = int(paths)
+        if not 0 < paths <= MAX_MONTE_CARLO_PATHS:
+            QMessageBox.warning(self, "Input Error", f"Simulated paths must be between 1 and {MAX_MONTE_CARLO_PATHS:,}.")
+            return
+
+        result = self.engine.simulate_fire(self.user_id, inputs, return_model, float(volatility) / 100, paths)
+
+        likely_years = next((year for year, probability in enumerate(result.success_probability) if probability >= 0.9), None)
+        if result.median_years is None:
+            self.result_label.setText(f"Fewer than half of {paths:,} simulations retire within <b>{len(result.success_probability) - 1}</b> years.")
+        elif likely_years is None:
+            self.result_label.setText(f"Half of {paths:,} simulations retire within <b>{result.median_years}</b> years.")
         else:
-            loan_details = {}
-
-        while True:
-            # Deduct loan repayments if included
-            total_loan_expenses = 0
-            if include_loan_expenses:
-                for loan_id, details in loan_details.items():
-                    principal = details['principal']
-                    interest = details['interest']
-                    interest_rate = details['interest_rate']
-
-                    # Calculate the interest accumulated for the year
-                    accumulated_interest = (principal * interest_rate / 100)
-                    details['interest'] += accumulated_interest
-
-                    # Get the recurring expense for this loan
-                    self.c.execute('SELECT amount, frequency FROM recurring_records WHERE user_id = ? AND linked_loan = ?',
-                                (self.user_id, loan_id))
-                    recurring_record = self.c.fetchone()
-                    if recurring_record:
-                        amount, frequency = recurring_record
-                        if frequency == 'Daily':
-                            annual_expense = amount * 365
-                        elif frequency == 'Weekly':
-                            annual_expense = amount * 52
-                        elif frequency == 'Monthly':
-                            annual_expense = amount * 12
-                        elif frequency == 'Annual':
-                            annual_expense = amount
-
-                        # Check if the loan can be repaid within this year
-                        total_debt = principal + details['interest']
-                        if annual_expense >= total_debt:
-                            annual_expense = total_debt
-                            details['principal'] = 0
-                            details['interest'] = 0
-                        else:
-                            if annual_expense <= details['interest']:
-                                details['interest'] -= annual_expense
-                            else:
-                                details['principal'] -= (annual_expense - details['interest'])
-                                details['interest'] = 0
-
-                        total_loan_expenses += annual_expense
-
-            if years < income_growth_duration:
-                annual_income *= (1 + income_growth_rate)
-
-            annual_income -= total_loan_expenses
-            annual_income = max(0, annual_income)  # Ensure income doesn't go below zero
-            annual_savings = annual_income * savings_rate
-
-            portfolio_value = (portfolio_value + annual_savings) * (1 + annual_roi)
-            portfolio_values.append(portfolio_value)
-            years += 1
-            if portfolio_value * withdrawal_rate >= annual_expenses:
-                break
-
-        return years, portfolio_values
+            self.result_label.setText(f"Half of {paths:,} simulations retire within <b>{result.median_years}</b> years, "
+                                      f"90% within <b>{likely_years}</b> years.")
+        self.result_label.setStyleSheet("font-size: 24px; text-align: center;")
+        self.result_label.adjustSize()
+        self.plot_fire_simulation(result)
+
+    def update_return_model_inputs(self, return_model):
+        # Volatility only applies to the parametric models; paths to every simulated one
+        self.volatility_input.setEnabled(return_model in ('Normal', 'Lognormal'))
+        self.paths_input.setEnabled(return_model != FIXED_ROI)
+        self.annual_roi_input.setEnabled(return_model in (FIXED_ROI, 'Normal', 'Lognormal'))
 
     def get_default_values(self):
         # Use the updated portfolio value
         portfolio_value = self.current_portfolio_value
 
         # Get annual income from recurring records with category "Paycheck"
-        self.c.execute('''
-            SELECT amount, frequency FROM recurring_records 
-            WHERE user_id = ? AND category = "Paycheck"
-        ''', (self.user_id,))
-        recurring_income_records = self.c.fetchall()
-        annual_income = 0
-        for amount, frequency in recurring_income_records:
-            if frequency == 'Daily':
-                annual_income += amount * 365
-            elif frequency == 'Weekly':
-                annual_income += amount * 52
-            elif frequency == 'Monthly':
-                annual_income += amount * 12
-            elif frequency == 'Annual':
-                annual_income += amount
+        annual_income = self.engine.annual_income(self.user_id)
 
         return portfolio_value, annual_income
     
@@ -1530,21 +1635,7 @@ class FinanceApp(QWidget):
             portfolio_value = self.current_portfolio_value
 
             # Get annual income from recurring records with category "Paycheck"
-            self.c.execute('''
-                SELECT amount, frequency FROM recurring_records 
-                WHERE user_id = ? AND category = "Paycheck"
-            ''', (self.user_id,))
-            recurring_income_records = self.c.fetchall()
-            annual_income = 0
-            for amount, frequency in recurring_income_records:
-                if frequency == 'Daily':
-                    annual_income += amount * 365
-                elif frequency == 'Weekly':
-                    annual_income += amount * 52
-                elif frequency == 'Monthly':
-                    annual_income += amount * 12
-                elif frequency == 'Annual':
-                    annual_income += amount
+            annual_income = self.engine.annual_income(self.user_id)
 
             self.portfolio_value_input.setText(str(portfolio_value))
             self.annual_income_input.setText(str(annual_income))
@@ -1576,6 +1667,9 @@ class FinanceApp(QWidget):
             pass
 
     def plot_fire_growth(self, portfolio_values):
+        pd = load_pandas()
+        import seaborn as sns
+
         self.figure_fire.clear()
         ax = self.figure_fire.add_subplot(111)
 
@@ -1606,13 +1700,52 @@ class FinanceApp(QWidget):
         self.canvas_fire.draw()
 
 
+    def plot_fire_simulation(self, result):
+        # Percentile fan of the portfolio value and the share of paths retired by each year, up to a
+        # few years after nearly every path has retired
+        probability = result.success_probability
+        last_year = len(probability) - 1
+        horizon = min(last_year, next((year for year, p in enumerate(probability) if p >= 0.99), last_year) + 5)
+        years = range(horizon + 1)
+        percentiles = {percentile: values[:horizon + 1] for percentile, values in result.percentiles.items()}
+
+        self.figure_fire.clear()
+        fan_ax, probability_ax = self.figure_fire.subplots(1, 2)
+
+        fan_ax.fill_between(years, percentiles[5], percentiles[95], color='tab:blue', alpha=0.15, label='5th-95th percentile')
+        fan_ax.fill_between(years, percentiles[25], percentiles[75], color='tab:blue', alpha=0.35, label='25th-75th percentile')
+        fan_ax.plot(years, percentiles[50], color='tab:blue', label='Median')
+        fan_ax.set_title("FIRE Portfolio Growth")
+        fan_ax.set_xlabel("Years")
+        fan_ax.set_ylabel("Portfolio Value")
+        fan_ax.yaxis.set_major_formatter(mticker.FuncFormatter(lambda value, _: f"{value:,.0f}"))
+        fan_ax.legend(loc='upper left', fontsize='small')
+
+        probability_ax.plot(years, probability[:horizon + 1] * 100, color='tab:green')
+        probability_ax.axhline(50, color='grey', linestyle='--', linewidth=0.8)
+        probability_ax.set_ylim(0, 100)
+        probability_ax.set_title(f"Probability of Retiring ({result.paths:,} paths)")
+        probability_ax.set_xlabel("Years")
+        probability_ax.set_ylabel("Retired (%)")
+
+        for ax in (fan_ax, probability_ax):
+            ax.spines['top'].set_visible(False)
+            ax.spines['right'].set_visible(False)
+
+        self.figure_fire.tight_layout()
+        self.canvas_fire.draw()
+
+
 # Main function to run the application
 def main():
-    app = QApplication(sys.argv)
-    window = FinanceApp()
+    profile = StartupProfile('--profile-startup' in sys.argv)
+    with profile.phase('qapplication'):
+        app = QApplication(sys.argv)
+    window = FinanceApp(profile)
     window.show()
     window.raise_()
     window.activateWindow()
+    QTimer.singleShot(0, profile.report)  # Reported once the event loop is running
     sys.exit(app.exec_())
 
 
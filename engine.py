@@ -0,0 +1,424 @@
+import datetime
+from collections import namedtuple
+
+from recurrence import OCCURRENCES_PER_YEAR, occurrences_until
+
+# Values prefilled on the FIRE tab, rates in percent as they are typed in
+FIRE_DEFAULTS = {'savings_rate': 40, 'income_growth_rate': 2, 'income_growth_duration': 20, 'withdrawal_rate': 4.0, 'annual_roi': 5.0}
+MAX_FIRE_YEARS = 100  # Projections stop here when the portfolio never covers the expenses
+
+# Monte Carlo FIRE: return models offered on the FIRE tab besides the fixed annual ROI, and run sizes
+RETURN_MODELS = ['Normal', 'Lognormal', 'Bootstrap', 'Historical']
+DEFAULT_VOLATILITY = 15.0  # Standard deviation of annual returns, in percent
+MONTE_CARLO_PATHS = 10000
+MAX_MONTE_CARLO_PATHS = 100000
+FAN_PERCENTILES = [5, 25, 50, 75, 95]
+FAN_SAMPLE_PATHS = 20000  # Paths the fan chart percentiles are computed from
+TRADING_DAYS = 252  # Daily returns per simulated year
+MIN_HISTORY_DAYS = 60  # Stored daily returns needed by the Bootstrap and Historical models
+BOOTSTRAP_POOL_SIZE = 20000  # Bootstrapped years each path year is drawn from
+
+# Periods offered by Predict Expenses, with the pandas resampling frequency of each
+PREDICTION_PERIODS = {'Next Day': 'D', 'Next Week': 'W', 'Next Month': 'ME'}
+
+# FIRE calculator inputs; rates are fractions
+FireInputs = namedtuple('FireInputs', ['portfolio_value', 'annual_income', 'savings_rate', 'income_growth_rate', 'income_growth_duration',
+                                       'annual_expenses', 'withdrawal_rate', 'annual_roi', 'include_loan_expenses'])
+
+# Outcome of simulate_fire: success_probability[year] is the share of paths retired by that year,
+# percentiles maps each of FAN_PERCENTILES to the portfolio value per year, and median_years is the
+# first year at least half the paths have retired (None if not within MAX_FIRE_YEARS)
+MonteCarloResult = namedtuple('MonteCarloResult', ['paths', 'success_probability', 'percentiles', 'median_years'])
+
+# One loan after interest has been accrued up to today; next_repayment_date is None without a linked expense
+LoanStatus = namedtuple('LoanStatus', ['loan_id', 'name', 'initial_principal', 'interest_rate', 'signing_date', 'interest',
+                                       'principal_to_repay', 'next_repayment_date'])
+
+# Outcome of a headless refresh of one user; years_to_retirement and predicted_expenses may be None,
+# unpriced_symbols are holdings with neither a fetched nor a cached price, left out of the net worth,
+# prediction_error says why predicted_expenses is None when the prediction failed
+RefreshResult = namedtuple('RefreshResult', ['user_id', 'records_added', 'net_worth', 'years_to_retirement', 'predicted_expenses',
+                                             'unpriced_symbols', 'prediction_error'])
+
+
+def load_pandas():
+    import pandas as pd
+    pd.set_option('future.no_silent_downcasting', True)
+    return pd
+
+
+# The finance computations behind the main window, free of Qt so they can run headless:
+# recurring catch-up, loan accrual, net worth, FIRE and expense prediction for one user at a time.
+# market_data is a QuoteCache. Only fetch_quotes, and refresh when it is not given quotes, wait on the network.
+class FinanceEngine:
+    def __init__(self, storage, market_data=None):
+        self.storage = storage
+        self.market_data = market_data
+
+    def catch_up_recurring(self, user_id, today=None):
+        # Insert every occurrence of the recurring records that fell due up to today, apply loan
+        # repayments among them and move each schedule to its next due date.
+        # Returns the number of occurrences written.
+        c = self.storage.conn.cursor()
+        c.execute('SELECT id, date, category, type, amount, frequency, linked_loan FROM recurring_records WHERE user_id = ?', (user_id,))
+        recurring_records = c.fetchall()
+        end_date = today or datetime.datetime.today().date()
+
+        # Load every loan once; repayments are folded into this state in memory
+        c.execute('SELECT loan_id, principal, interest, interest_rate, last_calculated_date FROM loans WHERE user_id = ?', (user_id,))
+        loans = {loan_id: {'principal': principal, 'interest': interest, 'interest_rate': interest_rate,
+                           'last_calculated_date': datetime.datetime.strptime(last_calculated_date, '%Y-%m-%d').date()}
+                 for loan_id, principal, interest, interest_rate, last_calculated_date in c.fetchall()}
+        changed_loans = set()
+
+        new_records = []
+        next_dates = []
+        for record in recurring_records:
+            record_id, date, category, record_type, amount, frequency, linked_loan = record
+            start_date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+            occurrences, next_due_date = occurrences_until(start_date, end_date, frequency)
+
+            if linked_loan and occurrences:
+                loan = loans.get(linked_loan)
+                if loan is None:
+                    # Loan not found, leave the schedule where it is
+                    continue
+
+                # Ensure the amount is positive
+                amount = abs(float(amount))
+                daily_interest_rate = loan['interest_rate'] / 365 / 100
+                for due_date in occurrences:
+                    # Calculate interest for the period
+                    days_elapsed = (due_date - loan['last_calculated_date']).days
+                    loan['interest'] += loan['principal'] * daily_interest_rate * days_elapsed
+
+                    # Apply the payment to the interest first, then principal
+                    if amount <= loan['interest']:
+                        loan['interest'] -= amount
+                    else:
+                        remaining_payment = amount - loan['interest']
+                        loan['interest'] = 0
+                        loan['principal'] = max(0, loan['principal'] - remaining_payment)
+                    loan['last_calculated_date'] = due_date
+                changed_loans.add(linked_loan)
+
+            new_records.extend((user_id, due_date.strftime('%Y-%m-%d'), category, record_type, float(amount), linked_loan, record_id)
+                               for due_date in occurrences)
+            if occurrences:
+                next_dates.append((next_due_date.strftime('%Y-%m-%d'), record_id))
+
+        if not next_dates:
+            return 0  # Nothing was due
+
+        # Write the whole catch-up in one transaction: bulk inserts, then one UPDATE per schedule and per loan
+        with self.storage.transaction() as c:
+            c.executemany('INSERT OR IGNORE INTO records (user_id, date, category, type, amount, linked_loan, recurrence_id) VALUES (?, ?, ?, ?, ?, ?, ?)', new_records)
+            c.executemany('UPDATE recurring_records SET date = ? WHERE id = ?', next_dates)
+            c.executemany('UPDATE loans SET principal = ?, interest = ?, last_calculated_date = ? WHERE user_id = ? AND loan_id = ?',
+                          [(loans[loan_id]['principal'], loans[loan_id]['interest'], loans[loan_id]['last_calculated_date'].strftime('%Y-%m-%d'), user_id, loan_id)
+                           for loan_id in changed_loans])
+        return len(new_records)
+
+    def accrue_loan_interest(self, user_id, today=None, save=True):
+        # Bring every loan's interest up to today and return the loans as LoanStatus; with save=False
+        # nothing is written, for callers on a read-only connection
+        loans = self.storage.loans.list(user_id)
+        repaid = self.storage.loans.repaid_principal(user_id)
+        next_repayment_dates = self.storage.loans.next_repayment_dates(user_id)
+        today = today or datetime.datetime.today().date()
+        accruals = []
+        statuses = []
+
+        for loan in loans:
+            loan_id, name, principal, initial_principal, interest_rate, signing_date, last_calculated_date, interest = loan
+
+            try:
+                signing_date = datetime.datetime.strptime(signing_date, '%Y-%m-%d').date()
+                last_calculated_date = datetime.datetime.strptime(last_calculated_date, '%Y-%m-%d').date()
+            except ValueError as ve:
+                print(f"Date conversion error: {ve}")
+
+            days_elapsed = (today - last_calculated_date).days
+            accumulated_interest = (initial_principal * interest_rate / 100) * (days_elapsed / 365)  # Simple interest calculation
+            try:
+                current_interest = max(0, float(interest) + accumulated_interest)  # Ensure interest is not negative
+            except ValueError as ve:
+                print(f"Interest conversion error: {ve}")
+
+            repaid_principal = repaid.get(loan_id, 0.0)
+            principal_to_repay = max(0, principal - repaid_principal)  # Ensure principal to repay is not negative
+
+            statuses.append(LoanStatus(loan_id, name, initial_principal, interest_rate, signing_date, current_interest,
+                                       principal_to_repay, next_repayment_dates.get(loan_id)))
+            accruals.append((loan_id, today.strftime('%Y-%m-%d'), current_interest))
+
+        # Update last_calculated_date to today after interest calculation, for all loans in one transaction
+        if save:
+            self.storage.loans.save_interest(user_id, accruals)
+        return statuses
+
+    def fetch_quotes(self, symbols):
+        # Current quotes in one batched request: fresh cached quotes are reused and stale or unknown ones
+        # fetched. When the fetch fails {} is returned, so portfolio_value falls back to the cached prices.
+        try:
+            return self.market_data.get_quotes(symbols, wait=True)
+        except Exception as e:
+            print(f"Quote refresh failed, using cached prices: {e}")
+            return {}
+
+    def portfolio_value(self, holdings, quotes=None):
+        # Value holdings with the given quotes and the last cached price of every other symbol
+        quotes = dict(quotes or {})
+        missing = [holding.symbol for holding in holdings if holding.symbol not in quotes]
+        if missing and self.market_data is not None:
+            quotes = {**self.market_data.get_cached(missing), **quotes}
+        return sum(quotes[holding.symbol].price * holding.quantity for holding in holdings if holding.symbol in quotes)
+
+    def net_worth_excluding_portfolio(self, user_id):
+        # Income, expenses excluding those linked to loans, asset values and liabilities
+        # (principal to be repaid plus current interest) are kept up to date by triggers
+        totals = self.storage.totals.get(user_id)
+        return totals.income - totals.expenses + totals.assets_value - totals.liabilities
+
+    def annual_income(self, user_id):
+        # Annualized recurring records with category "Paycheck"
+        rows = self.storage.conn.execute('''
+            SELECT amount, frequency FROM recurring_records
+            WHERE user_id = ? AND category = "Paycheck"
+        ''', (user_id,))
+        return sum(amount * OCCURRENCES_PER_YEAR.get(frequency, 0) for amount, frequency in rows)
+
+    def default_fire_inputs(self, user_id, portfolio_value):
+        income = self.annual_income(user_id)
+        savings_rate = FIRE_DEFAULTS['savings_rate'] / 100
+        return FireInputs(portfolio_value, income, savings_rate, FIRE_DEFAULTS['income_growth_rate'] / 100,
+                          FIRE_DEFAULTS['income_growth_duration'], income * (1 - savings_rate),
+                          FIRE_DEFAULTS['withdrawal_rate'] / 100, FIRE_DEFAULTS['annual_roi'] / 100, False)
+
+    def savings_schedule(self, user_id, inputs):
+        # Yield the amount saved in each of the next MAX_FIRE_YEARS years: income grows for
+        # income_growth_duration years and, with include_loan_expenses, loan repayments are
+        # deducted from it until each loan is repaid. The schedule does not depend on returns.
+        annual_income = inputs.annual_income
+
+        loan_details = {}
+        if inputs.include_loan_expenses:
+            # Load loan data together with the first recurring expense linked to each loan
+            repayments = {}
+            for loan_id, amount, frequency in self.storage.conn.execute('''
+                SELECT linked_loan, amount, frequency FROM recurring_records WHERE user_id = ? AND linked_loan IS NOT NULL ORDER BY id
+            ''', (user_id,)):
+                repayments.setdefault(loan_id, amount * OCCURRENCES_PER_YEAR.get(frequency, 0))
+            for loan_id, principal, interest, interest_rate in self.storage.conn.execute(
+                    'SELECT loan_id, principal, interest, interest_rate FROM loans WHERE user_id = ?', (user_id,)):
+                loan_details[loan_id] = {'principal': principal, 'interest': interest, 'interest_rate': interest_rate,
+                                         'annual_expense': repayments.get(loan_id)}
+
+        for years in range(1, MAX_FIRE_YEARS + 1):
+            # Deduct loan repayments if included
+            total_loan_expenses = 0
+            for details in loan_details.values():
+                # Calculate the interest accumulated for the year
+                details['interest'] += details['principal'] * details['interest_rate'] / 100
+
+                annual_expense = details['annual_expense']
+                if annual_expense is None:
+                    continue
+
+                # Check if the loan can be repaid within this year
+                total_debt = details['principal'] + details['interest']
+                if annual_expense >= total_debt:
+                    annual_expense = total_debt
+                    details['principal'] = 0
+                    details['interest'] = 0
+                elif annual_expense <= details['interest']:
+                    details['interest'] -= annual_expense
+                else:
+                    details['principal'] -= (annual_expense - details['interest'])
+                    details['interest'] = 0
+
+                total_loan_expenses += annual_expense
+
+            if years <= inputs.income_growth_duration:
+                annual_income *= (1 + inputs.income_growth_rate)
+
+            annual_income -= total_loan_expenses
+            annual_income = max(0, annual_income)  # Ensure income doesn't go below zero
+            yield annual_income * inputs.savings_rate
+
+    def years_to_retirement(self, user_id, inputs):
+        # Project the portfolio a year at a time until its withdrawals cover the annual expenses.
+        # Returns (years, portfolio value per year); years is None if that takes more than MAX_FIRE_YEARS.
+        portfolio_value = inputs.portfolio_value
+        portfolio_values = [portfolio_value]
+
+        for years, annual_savings in enumerate(self.savings_schedule(user_id, inputs), 1):
+            portfolio_value = (portfolio_value + annual_savings) * (1 + inputs.annual_roi)
+            portfolio_values.append(portfolio_value)
+            if portfolio_value * inputs.withdrawal_rate >= inputs.annual_expenses:
+                return years, portfolio_values
+
+        return None, portfolio_values
+
+    def simulate_fire(self, user_id, inputs, return_model, volatility, paths=MONTE_CARLO_PATHS, seed=None):
+        # Monte Carlo version of years_to_retirement: every path draws its own annual returns from
+        # return_model and all paths advance together as one (years x paths) array. volatility is the
+        # standard deviation of annual returns as a fraction; Bootstrap and Historical use the stored
+        # daily prices of the current holdings instead of annual_roi and volatility.
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        savings = np.fromiter(self.savings_schedule(user_id, inputs), dtype=float, count=MAX_FIRE_YEARS)
+        shape = (MAX_FIRE_YEARS, paths)
+
+        if return_model == 'Normal':
+            growth = np.maximum(1 + rng.normal(inputs.annual_roi, volatility, shape), 0)  # No year loses more than everything
+        elif return_model == 'Lognormal':
+            # 1 + return is lognormal with mean 1 + annual_roi and standard deviation volatility
+            sigma = np.sqrt(np.log(1 + volatility ** 2 / (1 + inputs.annual_roi) ** 2))
+            growth = np.exp(rng.normal(np.log(1 + inputs.annual_roi) - sigma ** 2 / 2, sigma, shape))
+        elif return_model in ('Bootstrap', 'Historical'):
+            daily_returns = self.historical_returns(self.storage.portfolio.holdings(user_id))
+            if len(daily_returns) < MIN_HISTORY_DAYS:
+                raise ValueError(f"{return_model} returns need at least {MIN_HISTORY_DAYS} days of stored prices "
+                                 f"for the portfolio, found {len(daily_returns)}. Update the portfolio to fetch them.")
+            if return_model == 'Historical':
+                # Lognormal fitted to the stored daily log returns
+                growth = np.exp(rng.normal(daily_returns.mean() * TRADING_DAYS, daily_returns.std() * np.sqrt(TRADING_DAYS), shape))
+            else:
+                # A pool of years, each made of TRADING_DAYS daily returns drawn with replacement, then
+                # every path year drawn from the pool, so a 100k-path run does not resample 2.5 billion days
+                pool = rng.choice(daily_returns, (BOOTSTRAP_POOL_SIZE, TRADING_DAYS)).sum(axis=1)
+                growth = np.exp(rng.choice(pool, shape))
+        else:
+            raise ValueError(f"Unknown return model: {return_model}")
+
+        values = np.empty((MAX_FIRE_YEARS + 1, paths))
+        values[0] = inputs.portfolio_value
+        for year in range(MAX_FIRE_YEARS):
+            np.multiply(values[year] + savings[year], growth[year], out=values[year + 1])
+
+        # A path has retired from the first year its withdrawals cover the expenses, as in years_to_retirement;
+        # paths that never do are counted past the horizon
+        covered = values[1:] * inputs.withdrawal_rate >= inputs.annual_expenses
+        first_year = np.where(covered.any(axis=0), covered.argmax(axis=0) + 1, MAX_FIRE_YEARS + 1)
+        success_probability = np.bincount(first_year, minlength=MAX_FIRE_YEARS + 2).cumsum()[:MAX_FIRE_YEARS + 1] / paths
+
+        # Paths are independent, so the fan chart is read from the first FAN_SAMPLE_PATHS of them,
+        # which keeps the percentiles of a 100k-path run from costing more than the simulation
+        percentiles = dict(zip(FAN_PERCENTILES, np.percentile(values[:, :FAN_SAMPLE_PATHS], FAN_PERCENTILES, axis=1)))
+        likely = np.flatnonzero(success_probability >= 0.5)
+        return MonteCarloResult(paths, success_probability, percentiles, int(likely[0]) if len(likely) else None)
+
+    def historical_returns(self, holdings):
+        # Daily log returns of the current holdings, valued at the stored closes of the days every
+        # held symbol has a bar
+        import numpy as np
+
+        quantities = {}
+        for holding in holdings:
+            quantities[holding.symbol] = quantities.get(holding.symbol, 0) + holding.quantity
+        if not quantities:
+            return np.empty(0)
+
+        placeholders = ', '.join('?' for _ in quantities)
+        closes = {}
+        for date, symbol, close in self.storage.conn.execute(f'''
+            SELECT date, symbol, close FROM price_history WHERE symbol IN ({placeholders}) AND close > 0 ORDER BY date
+        ''', list(quantities)):
+            closes.setdefault(date, {})[symbol] = close
+        values = np.array([sum(quantities[symbol] * close for symbol, close in day.items())
+                           for day in closes.values() if len(day) == len(quantities)])
+        if len(values) < 2:
+            return np.empty(0)
+        return np.diff(np.log(values))
+
+    def predict_expenses(self, user_id, period):
+        # Total expenses (excluding investments) predicted for the period by a linear regression on
+        # the last three periods. Returns None when there are fewer than 4 periods of history.
+        freq = PREDICTION_PERIODS[period]
+        periods = 1
+
+        pd = load_pandas()
+        from sklearn.linear_model import LinearRegression
+
+        # Fetching past expense records, excluding Income and Investments
+        records = self.storage.conn.execute('''
+            SELECT date, amount FROM records
+            WHERE user_id = ? AND type = "Expense" AND category != "Investments"
+        ''', (user_id,)).fetchall()
+        df = pd.DataFrame(records, columns=['date', 'amount'])
+        df['date'] = pd.to_datetime(df['date'])
+        df.set_index('date', inplace=True)
+
+        # Group by the appropriate frequency
+        df = df.resample(freq).sum().fillna(0)
+
+        # Ensure there are at least 4 observations
+        if len(df) < 4:
+            return None
+
+        # Create lag features
+        df['lag_1'] = df['amount'].shift(1).fillna(0)
+        df['lag_2'] = df['amount'].shift(2).fillna(0)
+        df['lag_3'] = df['amount'].shift(3).fillna(0)
+
+        # Preparing the data for the model
+        X = df[['lag_1', 'lag_2', 'lag_3']].values
+        y = df['amount'].values
+
+        # Training the model
+        model = LinearRegression()
+        model.fit(X, y)
+
+        # Predicting expenses
+        last_known_index = df.index[-1]
+        future_dates = pd.date_range(start=last_known_index + pd.Timedelta(days=1), periods=periods, freq=freq)
+        future_days = pd.DataFrame(index=future_dates)
+        future_days['lag_1'] = df['amount'].iloc[-1]
+        future_days['lag_2'] = df['amount'].iloc[-2] if len(df) > 1 else 0
+        future_days['lag_3'] = df['amount'].iloc[-3] if len(df) > 2 else 0
+
+        predictions = []
+        for i in range(periods):
+            pred = model.predict(future_days.iloc[i].values.reshape(1, -1))[0]
+            pred = max(0, pred)  # Ensure predictions are not negative
+            predictions.append(pred)
+
+            # Update lag features for the next prediction
+            if i + 1 < periods:
+                future_days.iloc[i + 1, future_days.columns.get_loc('lag_1')] = pred
+                future_days.iloc[i + 1, future_days.columns.get_loc('lag_2')] = future_days.iloc[i, future_days.columns.get_loc('lag_1')]
+                future_days.iloc[i + 1, future_days.columns.get_loc('lag_3')] = future_days.iloc[i, future_days.columns.get_loc('lag_2')]
+
+        return sum(predictions)
+
+    def refresh(self, user_id, today=None, predict=True, quotes=None):
+        # What opening the main window computes, without a window: catch up recurring records, accrue
+        # loan interest, record today's net worth, and project FIRE with the FIRE tab's default inputs and
+        # next month's expenses. quotes are the run's fetch_quotes result; without them the user's
+        # holdings are fetched here. Holdings missing from quotes are valued at their cached price.
+        today = today or datetime.datetime.today().date()
+        records_added = self.catch_up_recurring(user_id, today)
+        self.accrue_loan_interest(user_id, today)
+
+        holdings = self.storage.portfolio.holdings(user_id)
+        if quotes is None:
+            quotes = self.fetch_quotes([holding.symbol for holding in holdings])
+        quotes = {**self.market_data.get_cached([holding.symbol for holding in holdings if holding.symbol not in quotes]), **quotes}
+        unpriced_symbols = sorted({holding.symbol for holding in holdings} - set(quotes))
+
+        portfolio_value = self.portfolio_value(holdings, quotes)
+        net_worth = self.net_worth_excluding_portfolio(user_id) + portfolio_value
+        self.storage.net_worth.record(user_id, today, net_worth)
+
+        years, _ = self.years_to_retirement(user_id, self.default_fire_inputs(user_id, portfolio_value))
+        # The writes above are committed by now, so a failed prediction (missing pandas or scikit-learn,
+        # too little history) is a warning on an otherwise refreshed user
+        predicted_expenses = prediction_error = None
+        if predict:
+            try:
+                predicted_expenses = self.predict_expenses(user_id, 'Next Month')
+            except Exception as e:
+                prediction_error = str(e) or type(e).__name__
+        return RefreshResult(user_id, records_added, net_worth, years, predicted_expenses, unpriced_symbols, prediction_error)
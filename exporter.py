@@ -0,0 +1,140 @@
+import csv
+import os
+import sys
+
+from storage import DB_PATH, Storage
+
+CHUNK_SIZE = 10000  # Rows fetched from SQLite and written per step
+
+# Exported tables: (query for one user, [(column, type)]). The types fix the Parquet schema up front,
+# so a chunk whose values are all NULL cannot change it; CSV only uses the names.
+EXPORTS = {
+    'records': ('''
+        SELECT record_id, date, category, type, amount, linked_loan, recurrence_id, import_id
+        FROM records WHERE user_id = ? ORDER BY date, record_id
+    ''', [('record_id', 'int64'), ('date', 'string'), ('category', 'string'), ('type', 'string'), ('amount', 'float64'),
+          ('linked_loan', 'int64'), ('recurrence_id', 'int64'), ('import_id', 'string')]),
+    'recurring_records': ('''
+        SELECT id, date, category, type, amount, frequency, linked_loan FROM recurring_records WHERE user_id = ? ORDER BY id
+    ''', [('id', 'int64'), ('date', 'string'), ('category', 'string'), ('type', 'string'), ('amount', 'float64'),
+          ('frequency', 'string'), ('linked_loan', 'int64')]),
+    'net_worth_history': ('''
+        SELECT date, net_worth FROM net_worth_history WHERE user_id = ? ORDER BY date
+    ''', [('date', 'string'), ('net_worth', 'float64')]),
+    'portfolio': ('''
+        SELECT portfolio_id, UPPER(symbol), company_name, purchase_price, quantity, purchase_date
+        FROM portfolio WHERE user_id = ? ORDER BY portfolio_id
+    ''', [('portfolio_id', 'int64'), ('symbol', 'string'), ('company_name', 'string'), ('purchase_price', 'float64'),
+          ('quantity', 'float64'), ('purchase_date', 'string')]),
+}
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def formats():
+    return ['csv', 'parquet'] if parquet_available() else ['csv']
+
+
+def chunks(cursor, size):
+    # SQLite steps the query as rows are fetched, so only one chunk is ever materialized
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+
+def write_csv(path, columns, row_chunks):
+    rows = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in columns])
+        for chunk in row_chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+    return rows
+
+
+def write_parquet(path, columns, row_chunks):
+    # pyarrow is optional and only imported when a Parquet export is requested; every chunk
+    # becomes one row group
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, pa.type_for_alias(column_type)) for name, column_type in columns])
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in row_chunks:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows += len(chunk)
+        if not rows:
+            writer.write_table(schema.empty_table())
+    return rows
+
+
+WRITERS = {'csv': write_csv, 'parquet': write_parquet}
+
+
+# Writes a user's tables to <directory>/<table>.<format> from one read snapshot, streaming each
+# table through a pooled read connection so memory stays flat whatever the table size.
+# A file is written under a temporary name and only replaces the previous export once complete.
+class Exporter:
+    def __init__(self, storage, chunk_size=CHUNK_SIZE):
+        self.storage = storage
+        self.chunk_size = chunk_size
+
+    def export(self, user_id, directory, export_format='csv', tables=None, progress=None):
+        # progress(table, rows) is called after every table; returns {table: rows written}
+        if export_format not in WRITERS:
+            raise ValueError(f"Unknown export format: {export_format}")
+        if export_format == 'parquet' and not parquet_available():
+            raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+
+        os.makedirs(directory, exist_ok=True)
+        exported = {}
+        with self.storage.reader() as conn:
+            conn.execute('BEGIN')  # Every table is read from the same snapshot
+            for table in tables or EXPORTS:
+                query, columns = EXPORTS[table]
+                path = os.path.join(directory, f"{table}.{export_format}")
+                try:
+                    rows = WRITERS[export_format](f"{path}.part", columns,
+                                                  chunks(conn.execute(query, (user_id,)), self.chunk_size))
+                except BaseException:
+                    if os.path.exists(f"{path}.part"):
+                        os.remove(f"{path}.part")
+                    raise
+                os.replace(f"{path}.part", path)
+                exported[table] = rows
+                if progress:
+                    progress(table, rows)
+        return exported
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export Fire Journey data to CSV or Parquet')
+    parser.add_argument('directory', help='directory the files are written to')
+    parser.add_argument('--user', required=True, help='name of the user to export')
+    parser.add_argument('--format', default='csv', choices=list(WRITERS), help='file format (parquet needs pyarrow)')
+    parser.add_argument('--tables', nargs='+', choices=list(EXPORTS), help='tables to export (default: all)')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    args = parser.parse_args()
+
+    storage = Storage(args.db)
+    storage.migrate()
+    user_id = storage.users.find(args.user)
+    if user_id is None:
+        storage.close()
+        sys.exit(f"No user named {args.user!r}")
+    Exporter(storage).export(user_id, args.directory, args.format, args.tables,
+                             lambda table, rows: print(f"{table}: {rows} row(s)"))
+    storage.close()
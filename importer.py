@@ -0,0 +1,307 @@
+import csv
+import datetime
+import hashlib
+import html
+import io
+import os
+import re
+import sys
+from collections import namedtuple
+from functools import lru_cache
+from itertools import islice
+
+from storage import DB_PATH, Storage
+
+CHUNK_SIZE = 5000  # Rows written per executemany transaction
+CACHE_SIZE_KB = 65536  # Page cache of the import connection, so index pages stay in memory between chunks
+
+# Keywords looked up in a statement line's description; the first category with a match wins
+CATEGORY_RULES = {
+    "Paycheck": ("salary", "payroll", "paycheck", "wages"),
+    "Rent": ("rent", "landlord", "letting"),
+    "Groceries": ("grocery", "supermarket", "market", "aldi", "lidl", "tesco", "walmart", "costco", "kroger"),
+    "Utilities": ("electric", "energy", "water", "gas bill", "internet", "broadband", "mobile", "phone"),
+    "Transport": ("uber", "lyft", "taxi", "fuel", "petrol", "parking", "train", "metro", "bus ", "airline"),
+    "Healthcare": ("pharmacy", "doctor", "dental", "hospital", "clinic", "health"),
+    "Entertainment": ("netflix", "spotify", "cinema", "theatre", "steam", "restaurant", "bar ", "pub "),
+    "Investments": ("broker", "vanguard", "fidelity", "dividend", "invest"),
+}
+DEFAULT_CATEGORY = "Other"
+CATEGORY_CACHE_SIZE = 10000  # Distinct descriptions remembered while categorizing
+
+DATE_FORMATS = ('%Y-%m-%d', '%Y%m%d', '%d/%m/%Y', '%m/%d/%Y', '%d.%m.%Y', '%d-%m-%Y', '%Y/%m/%d')
+
+# Header names recognised in CSV statements, compared lowercased
+CSV_COLUMNS = {
+    'date': ('date', 'transaction date', 'posted date', 'posting date', 'booking date', 'value date'),
+    'amount': ('amount', 'transaction amount', 'value'),
+    'debit': ('debit', 'withdrawal', 'withdrawals', 'money out', 'paid out'),
+    'credit': ('credit', 'deposit', 'deposits', 'money in', 'paid in'),
+    'description': ('description', 'payee', 'name', 'details', 'narrative', 'memo', 'transaction description'),
+    'fitid': ('id', 'fitid', 'transaction id', 'reference number'),
+}
+
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+# One line of a bank statement; amount is signed, negative for money going out
+StatementLine = namedtuple('StatementLine', ['date', 'amount', 'description', 'fitid'])
+
+ImportResult = namedtuple('ImportResult', ['read', 'imported', 'duplicates', 'skipped'])
+
+
+def statement_kind(path):
+    return 'ofx' if os.path.splitext(path)[1].lower() in ('.ofx', '.qfx') else 'csv'
+
+
+# Raised when every date in a statement reads both day-first and month-first (no day after the 12th)
+class AmbiguousDateFormat(ValueError):
+    def __init__(self, candidates):
+        super().__init__(f"The statement's dates fit more than one format ({', '.join(candidates)}); "
+                         "choose the date format to import it")
+        self.candidates = candidates
+
+
+def date_text(text):
+    return text.strip()[:10]  # Drop any time of day
+
+
+def date_formats_of(text):
+    formats = []
+    for date_format in DATE_FORMATS:
+        try:
+            datetime.datetime.strptime(text, date_format)
+            formats.append(date_format)
+        except ValueError:
+            pass
+    return formats
+
+
+def detect_date_format(statement_lines):
+    # The one format of DATE_FORMATS that fits every date of the statement, so a US file is never read
+    # day-first on some lines and month-first on others. Stops at the first date that leaves a single
+    # format, usually within a few lines; only a statement whose dates all fit two formats is read to
+    # the end, and then raises. Lines with unreadable dates are skipped by the import and ignored here.
+    candidates = None
+    for line in statement_lines:
+        formats = date_formats_of(date_text(line.date))
+        if not formats:
+            continue
+        candidates = formats if candidates is None else [f for f in candidates if f in formats]
+        if not candidates:
+            raise ValueError("The statement mixes date formats")
+        if len(candidates) == 1:
+            return candidates[0]
+    if candidates is None:
+        return None  # No readable dates: every line is skipped anyway
+    raise AmbiguousDateFormat(candidates)
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text, date_format):
+    # 'YYYY-MM-DD' like everywhere else in the database. Cached because a statement repeats every
+    # date on many lines.
+    try:
+        return datetime.datetime.strptime(date_text(text), date_format).date().isoformat()
+    except (TypeError, ValueError):
+        raise ValueError(f"Unrecognised date: {text!r}") from None
+
+
+def parse_amount(text):
+    # Accepts currency symbols, thousands separators, decimal commas and (accounting) negatives
+    try:
+        return float(text)  # The common case
+    except ValueError:
+        pass
+    text = text.strip()
+    negative = text.startswith('(') and text.endswith(')')
+    text = re.sub(r'[^0-9,.\-]', '', text)
+    if ',' in text and ('.' not in text or text.rfind(',') > text.rfind('.')):
+        text = text.replace('.', '').replace(',', '.')  # 1.234,56
+    else:
+        text = text.replace(',', '')  # 1,234.56
+    amount = float(text)
+    return -abs(amount) if negative else amount
+
+
+# Readers: file -> StatementLine with the raw text of every field
+
+def read_csv(lines):
+    sample = ''.join(islice(lines, 20))
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+    except csv.Error:
+        dialect = csv.excel
+    rows = csv.reader(chain_text(sample, lines), dialect)
+
+    header = [name.strip().lower() for name in next(rows, [])]
+    columns = {field: next((header.index(name) for name in names if name in header), None)
+               for field, names in CSV_COLUMNS.items()}
+    if columns['date'] is None or (columns['amount'] is None and columns['debit'] is None and columns['credit'] is None):
+        raise ValueError("The CSV header needs a date column and an amount (or debit/credit) column")
+
+    # Missing columns (and cells missing from short rows) read as the empty cell padded onto each row
+    blank = len(header)
+    date, amount, debit, credit, description, fitid = (blank if index is None else index for index in columns.values())
+    padding = [''] * (blank + 1)
+    for row in rows:
+        if not any(row):
+            continue
+        row += padding[len(row):]
+        value = row[amount].strip()
+        if not value:
+            # Separate debit and credit columns, both unsigned
+            value = f"-{row[debit].strip().lstrip('-')}" if row[debit].strip() else row[credit]
+        yield StatementLine(row[date], value, row[description], row[fitid].strip())
+
+
+def chain_text(sample, lines):
+    yield from io.StringIO(sample)
+    yield from lines
+
+
+def read_ofx(lines):
+    # Handles both SGML (OFX 1.x, leaf tags left open) and XML (OFX 2.x) statements line by line
+    transaction = None
+    for line in lines:
+        for closing, tag, value in OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if transaction is not None:
+                    yield ofx_line(transaction)
+                transaction = None if closing else {}
+            elif transaction is not None and not closing and value.strip():
+                transaction[tag] = html.unescape(value.strip())
+    if transaction is not None:
+        yield ofx_line(transaction)
+
+
+def ofx_line(transaction):
+    description = transaction.get('NAME') or transaction.get('MEMO') or transaction.get('PAYEE', '')
+    return StatementLine(transaction.get('DTPOSTED', '')[:8], transaction.get('TRNAMT', ''), description, transaction.get('FITID', ''))
+
+
+READERS = {'csv': read_csv, 'ofx': read_ofx}
+
+
+# Pipeline stages; each one is a generator, so only the current chunk is held in memory
+
+def normalize(statement_lines, date_format, counts):
+    # Parse dates (all in the statement's one date format) and amounts; lines that cannot be parsed
+    # (or move no money) are counted and dropped
+    for line in statement_lines:
+        counts['read'] += 1
+        try:
+            amount = parse_amount(line.amount)
+            date = parse_date(line.date, date_format)
+        except ValueError:
+            counts['skipped'] += 1
+            continue
+        if amount == 0:
+            counts['skipped'] += 1
+            continue
+        yield StatementLine(date, round(amount, 2), ' '.join(line.description.split()), line.fitid)
+
+
+def categorize(statement_lines, rules):
+    categories = {}  # description -> category; the same merchants come back on many lines
+    for line in statement_lines:
+        category = categories.get(line.description)
+        if category is None:
+            if len(categories) >= CATEGORY_CACHE_SIZE:
+                categories.clear()
+            description = f" {line.description.lower()} "
+            category = categories[line.description] = next(
+                (category for category, keywords in rules.items() if any(keyword in description for keyword in keywords)),
+                DEFAULT_CATEGORY)
+        yield line, category
+
+
+def with_import_ids(categorized):
+    # Rows ready to insert. The import id is the bank's FITID when there is one; otherwise a hash of the
+    # line and how many identical lines preceded it in the file, so two equal purchases both import while
+    # a re-import of the same file matches them again. Statements are not always sorted by date (pending
+    # lines, posting order), so occurrences are counted over the whole file, keyed by an 8-byte digest of
+    # the line. Ids start with the date, which keeps inserts into idx_records_import close to each other
+    # instead of scattered over the whole index.
+    occurrences = {}
+    for line, category in categorized:
+        if line.fitid:
+            import_id = f"{line.date} fitid:{line.fitid}"
+        else:
+            key = f"{line.date}|{line.amount:.2f}|{line.description}"
+            digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+            occurrences[digest] = occurrences.get(digest, 0) + 1
+            import_id = f"{line.date} {hashlib.sha1(f'{key}|{occurrences[digest]}'.encode()).hexdigest()[:16]}"
+        record_type = 'Income' if line.amount > 0 else 'Expense'
+        yield line.date, category, record_type, abs(line.amount), import_id
+
+
+# Streams a CSV or OFX statement into the records table in chunked transactions.
+# Lines already imported (same import id) are skipped by the unique index, so the dedupe costs
+# no lookups of its own. Chunks committed before a cancel or an error stay imported.
+# date_format (one of DATE_FORMATS) overrides the format detected from the file.
+class StatementImporter:
+    def __init__(self, storage, rules=CATEGORY_RULES, chunk_size=CHUNK_SIZE, date_format=None):
+        self.storage = storage
+        self.rules = rules
+        self.chunk_size = chunk_size
+        self.date_format = date_format
+        self.cancelled = False
+
+    def detect_date_format(self, path):
+        with open(path, encoding='utf-8-sig', errors='replace', newline='') as lines:
+            return detect_date_format(READERS[statement_kind(path)](lines))
+
+    def run(self, user_id, path, progress=None):
+        # progress(lines_read, fraction_of_file) is called after every chunk. Raises AmbiguousDateFormat,
+        # before anything is written, when no date_format was given and the file's dates do not settle one.
+        date_format = self.date_format or self.detect_date_format(path)
+        counts = {'read': 0, 'skipped': 0}
+        imported = 0
+        size = os.path.getsize(path) or 1
+        with open(path, 'rb') as raw, self.storage.writer() as conn:
+            conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+            lines = io.TextIOWrapper(raw, encoding='utf-8-sig', errors='replace', newline='')
+            rows = with_import_ids(categorize(normalize(READERS[statement_kind(path)](lines), date_format, counts), self.rules))
+            while not self.cancelled:
+                chunk = [(user_id,) + row for row in islice(rows, self.chunk_size)]
+                if not chunk:
+                    break
+                imported += conn.executemany('''
+                    INSERT OR IGNORE INTO records (user_id, date, category, type, amount, import_id) VALUES (?, ?, ?, ?, ?, ?)
+                ''', chunk).rowcount
+                conn.commit()
+                if progress:
+                    progress(counts['read'], raw.tell() / size)
+        valid = counts['read'] - counts['skipped']
+        return ImportResult(counts['read'], imported, valid - imported, counts['skipped'])
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Import a CSV or OFX bank statement into Fire Journey')
+    parser.add_argument('path', help='statement file (.csv, .ofx or .qfx)')
+    parser.add_argument('--user', required=True, help='name of the user the records belong to')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--date-format', choices=DATE_FORMATS,
+                        help='date format of the statement, when its dates fit more than one (e.g. %%m/%%d/%%Y)')
+    args = parser.parse_args()
+
+    storage = Storage(args.db)
+    storage.migrate()
+    user_id = storage.users.find(args.user)
+    if user_id is None:
+        storage.close()
+        sys.exit(f"No user named {args.user!r}")
+    started = time.perf_counter()
+    try:
+        result = StatementImporter(storage, date_format=args.date_format).run(
+            user_id, args.path, lambda read, fraction: print(f"\r{read} lines read ({fraction:.0%})", end=''))
+    except AmbiguousDateFormat as e:
+        storage.close()
+        sys.exit(f"{e} with --date-format")
+    print(f"\nImported {result.imported} record(s) in {time.perf_counter() - started:.1f}s: "
+          f"{result.duplicates} already imported, {result.skipped} unreadable line(s)")
+    storage.close()
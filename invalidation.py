@@ -0,0 +1,75 @@
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+
+# Views declare the tables and other views they depend on. A mutation invalidates the tables it
+# wrote, every view downstream of them is marked dirty, and the dirty views are refreshed together
+# once control returns to the event loop, so several invalidations in one handler cost one pass.
+# A view that belongs to a tab is refreshed only while that tab is visible; otherwise it stays
+# dirty until the tab is activated.
+class DependencyGraph(QObject):
+    refreshed = pyqtSignal(list)  # Names of the views refreshed by a pass
+
+    def __init__(self, tab_widget=None, parent=None):
+        super().__init__(parent)
+        self.tab_widget = tab_widget
+        self.views = {}  # name -> (refresh callable, names it depends on, tab or None), in refresh order
+        self.dirty = set()
+        self.scheduled = False
+        if tab_widget is not None:
+            tab_widget.currentChanged.connect(self.tab_changed)
+
+    def add_view(self, name, refresh, depends_on, tab=None):
+        # Views are refreshed in the order they are added, so a view must come after its dependencies
+        for view, (_, dependencies, _) in self.views.items():
+            if name in dependencies:
+                raise ValueError(f"{view} depends on {name}, which must be added before it")
+        self.views[name] = (refresh, set(depends_on), tab)
+
+    def dependents(self, names):
+        # Every view reachable from names, including the names that are views themselves
+        affected = {name for name in names if name in self.views}
+        pending = set(names)
+        while pending:
+            name = pending.pop()
+            for view, (_, depends_on, _) in self.views.items():
+                if name in depends_on and view not in affected:
+                    affected.add(view)
+                    pending.add(view)
+        return affected
+
+    def tab(self, name):
+        return self.views[name][2]
+
+    def invalidate(self, *names):
+        self.dirty |= self.dependents(names)
+        if self.dirty and not self.scheduled:
+            self.scheduled = True
+            QTimer.singleShot(0, self.flush)
+
+    def invalidate_all(self):
+        self.invalidate(*self.views)
+
+    def is_visible(self, tab):
+        return tab is None or self.tab_widget is None or self.tab_widget.currentWidget() is tab
+
+    def tab_changed(self, index):
+        # Render the newly shown tab if anything it depends on changed while it was hidden
+        if any(self.views[name][2] is not None for name in self.dirty):
+            self.flush()
+
+    def flush(self):
+        self.scheduled = False
+        # A view may invalidate more tables while it refreshes; their dependents come later in the order
+        # and are picked up in this same pass
+        refreshed = []
+        for name, (refresh, _, tab) in self.views.items():
+            if name not in self.dirty or not self.is_visible(tab):
+                continue
+            self.dirty.discard(name)
+            try:
+                refresh()
+                refreshed.append(name)
+            except Exception as e:
+                print(f"Refreshing {name} failed: {e}")
+        if refreshed:
+            self.refreshed.emit(refreshed)
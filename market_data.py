@@ -0,0 +1,239 @@
+import abc
+import os
+import json
+import threading
+from collections import namedtuple
+
+# A single price quote; company_name may be None when the provider only fetched prices
+Quote = namedtuple('Quote', ['symbol', 'company_name', 'price', 'open'])
+
+# One daily OHLC bar; date is a 'YYYY-MM-DD' string like everywhere else in the database
+Bar = namedtuple('Bar', ['date', 'open', 'high', 'low', 'close', 'volume'])
+
+
+def normalize_symbols(symbols):
+    # Uppercase, strip and de-duplicate symbols while keeping their order
+    seen = []
+    for symbol in symbols:
+        symbol = (symbol or '').strip().upper()
+        if symbol and symbol not in seen:
+            seen.append(symbol)
+    return seen
+
+
+# Base class for all market data sources
+class MarketDataProvider(abc.ABC):
+    name = 'base'
+
+    @abc.abstractmethod
+    def get_quotes(self, symbols, with_names=False):
+        # Return {symbol: Quote} for every symbol that could be priced, in as few requests as possible
+        pass
+
+    def get_quote(self, symbol, with_names=False):
+        symbol = symbol.strip().upper()
+        return self.get_quotes([symbol], with_names=with_names).get(symbol)
+
+    @abc.abstractmethod
+    def get_history(self, symbols, start, end=None):
+        # Return {symbol: [Bar, ...]} of daily bars from start (inclusive) to end (exclusive)
+        pass
+
+
+# Live quotes from Yahoo Finance, one batched download per call.
+# yfinance (and pandas with it) is imported on first use, so it costs nothing at startup.
+class YFinanceProvider(MarketDataProvider):
+    name = 'yfinance'
+
+    def get_quotes(self, symbols, with_names=False):
+        symbols = normalize_symbols(symbols)
+        if not symbols:
+            return {}
+
+        import yfinance as yf  # type: ignore
+        data = yf.download(tickers=' '.join(symbols), period='5d', interval='1d',
+                           group_by='ticker', auto_adjust=False, threads=True, progress=False)
+
+        quotes = {}
+        for symbol in symbols:
+            # A single ticker comes back without the per-ticker column level
+            try:
+                frame = data[symbol] if len(symbols) > 1 else data
+                bars = frame.dropna(subset=['Close'])
+            except KeyError:
+                continue
+            if bars.empty:
+                continue
+            quotes[symbol] = Quote(symbol, None, float(bars['Close'].iloc[-1]), float(bars['Open'].iloc[-1]))
+
+        # Company names need the (slow) per-ticker info call, so only fetch them when asked
+        if with_names:
+            for symbol in symbols:
+                info = yf.Ticker(symbol).info
+                company_name = info.get('shortName', None)
+                price = info.get('regularMarketPrice', info.get('currentPrice', None))
+                quote = quotes.get(symbol)
+                if quote:
+                    quotes[symbol] = quote._replace(company_name=company_name)
+                elif price:
+                    quotes[symbol] = Quote(symbol, company_name, float(price), float(info.get('regularMarketOpen') or price))
+
+        return quotes
+
+    def get_history(self, symbols, start, end=None):
+        symbols = normalize_symbols(symbols)
+        if not symbols:
+            return {}
+
+        import yfinance as yf  # type: ignore
+        data = yf.download(tickers=' '.join(symbols), start=start, end=end, interval='1d',
+                           group_by='ticker', auto_adjust=False, threads=True, progress=False)
+
+        history = {}
+        for symbol in symbols:
+            try:
+                frame = data[symbol] if len(symbols) > 1 else data
+                bars = frame.dropna(subset=['Close'])
+            except KeyError:
+                continue
+            history[symbol] = [Bar(ts.strftime('%Y-%m-%d'), float(row['Open']), float(row['High']), float(row['Low']),
+                                   float(row['Close']), float(row['Volume'] or 0))
+                               for ts, row in bars.iterrows()]
+        return history
+
+
+# Quotes read from a local JSON fixture, for offline runs and demos
+# File format: {"AAPL": {"company_name": "Apple Inc.", "price": 190.5, "open": 189.0,
+#                        "history": {"2024-01-02": {"open": 187.2, "close": 185.6}, ...}}, ...}
+class LocalMarketDataProvider(MarketDataProvider):
+    name = 'local'
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+        self.data = {symbol.upper(): values for symbol, values in raw.items()}
+
+    def get_quotes(self, symbols, with_names=False):
+        quotes = {}
+        for symbol in normalize_symbols(symbols):
+            values = self.data.get(symbol)
+            if not values or values.get('price') is None:
+                continue
+            price = float(values['price'])
+            quotes[symbol] = Quote(symbol, values.get('company_name'), price, float(values.get('open', price)))
+        return quotes
+
+    def get_history(self, symbols, start, end=None):
+        start = str(start)[:10]
+        end = str(end)[:10] if end else None
+        history = {}
+        for symbol in normalize_symbols(symbols):
+            bars = []
+            for date, bar in sorted(self.data.get(symbol, {}).get('history', {}).items()):
+                if date < start or (end and date >= end):
+                    continue
+                close = float(bar['close'])
+                bars.append(Bar(date, float(bar.get('open', close)), float(bar.get('high', close)),
+                                float(bar.get('low', close)), close, float(bar.get('volume', 0))))
+            history[symbol] = bars
+        return history
+
+
+# Wraps a provider so that concurrent lookups of the same symbol share a single in-flight fetch.
+# Between begin_cycle and end_cycle (one portfolio refresh) fetched quotes are also memoized, so
+# repeated lookups in the cycle reuse them; outside a cycle every lookup reaches the provider, so
+# the quote cache's revalidation and forced refreshes never get an old price back.
+class SingleFlightProvider(MarketDataProvider):
+    name = 'single-flight'
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.lock = threading.Lock()
+        self.results = {}  # symbol -> Quote fetched during this cycle
+        self.in_flight = {}  # symbol -> (Event set when its fetch completes, whether it fetches names, {symbol: Quote} it found)
+        self.begin_cycle()
+        self.in_cycle = False
+
+    def begin_cycle(self):
+        # Forget the last cycle's results so the next lookups hit the network again
+        with self.lock:
+            self.results = {}
+            self.in_cycle = True
+            self.lookups = 0  # Symbols asked for
+            self.coalesced = 0  # Symbols answered by another caller's fetch
+            self.fetched = 0  # Symbols sent to the network
+            self.network_calls = 0  # Requests made to the wrapped provider
+
+    def end_cycle(self):
+        # Stop memoizing once the cycle's refresh has finished; the counters stay readable
+        with self.lock:
+            self.results = {}
+            self.in_cycle = False
+
+    def stats(self):
+        with self.lock:
+            return {'lookups': self.lookups, 'coalesced': self.coalesced,
+                    'fetched': self.fetched, 'network_calls': self.network_calls}
+
+    def get_quotes(self, symbols, with_names=False):
+        symbols = normalize_symbols(symbols)
+        with self.lock:
+            self.lookups += len(symbols)
+
+        found = {}
+        pending = symbols
+        while pending:
+            owned = []
+            waiting = []
+            with self.lock:
+                for symbol in pending:
+                    quote = self.results.get(symbol) if self.in_cycle else None
+                    if quote and (quote.company_name or not with_names):
+                        self.coalesced += 1
+                        found[symbol] = quote
+                    elif symbol in self.in_flight:
+                        # Never take over another caller's fetch; wait for it and look again
+                        self.coalesced += 1
+                        waiting.append((symbol, *self.in_flight[symbol]))
+                    else:
+                        self.in_flight[symbol] = (threading.Event(), with_names, {})
+                        owned.append(symbol)
+
+            if owned:
+                quotes = {}
+                try:
+                    quotes = self.provider.get_quotes(owned, with_names=with_names)
+                finally:
+                    with self.lock:
+                        self.network_calls += 1
+                        self.fetched += len(owned)
+                        if self.in_cycle:
+                            self.results.update(quotes)
+                        for symbol in owned:
+                            event, _, shared = self.in_flight.pop(symbol)
+                            if symbol in quotes:
+                                shared[symbol] = quotes[symbol]
+                            event.set()
+                found.update(quotes)
+
+            for symbol, event, fetching_names, shared in waiting:
+                event.wait()
+                found.update(shared)
+
+            # A fetch without names cannot answer a caller that wants them, so those symbols go round again
+            pending = [symbol for symbol, event, fetching_names, shared in waiting
+                       if with_names and not fetching_names and not getattr(found.get(symbol), 'company_name', None)]
+
+        return {symbol: found[symbol] for symbol in symbols if symbol in found}
+
+    def get_history(self, symbols, start, end=None):
+        return self.provider.get_history(symbols, start, end)
+
+
+def create_provider():
+    # PFM_QUOTES_FILE switches the app to the offline fixture provider
+    quotes_file = os.environ.get('PFM_QUOTES_FILE')
+    if quotes_file:
+        return LocalMarketDataProvider(quotes_file)
+    return YFinanceProvider()
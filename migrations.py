@@ -0,0 +1,231 @@
+# Versioned schema migrations. PRAGMA user_version stores how many of MIGRATIONS have
+# been applied, so an existing finance.db is upgraded in place by running the rest in order.
+
+
+def create_base_tables(c):
+    # SQL queries to create necessary tables if they don't exist
+    tables = {
+        'users': '''CREATE TABLE IF NOT EXISTS users
+                    (user_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL)''',
+        'records': '''CREATE TABLE IF NOT EXISTS records
+                    (record_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, date TEXT NOT NULL, category TEXT, type TEXT, amount REAL, linked_loan INTEGER,
+                    FOREIGN KEY(user_id) REFERENCES users(user_id), FOREIGN KEY(linked_loan) REFERENCES loans(id))''',
+        'recurring_records': '''CREATE TABLE IF NOT EXISTS recurring_records
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, date TEXT NOT NULL, category TEXT, type TEXT, amount REAL, frequency TEXT, linked_loan INTEGER,
+                    FOREIGN KEY(user_id) REFERENCES users(user_id), FOREIGN KEY(linked_loan) REFERENCES loans(id))''',
+        'portfolio': '''CREATE TABLE IF NOT EXISTS portfolio
+                    (portfolio_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, symbol TEXT NOT NULL, purchase_price REAL, quantity REAL, company_name TEXT, purchase_date TEXT,
+                    FOREIGN KEY(user_id) REFERENCES users(user_id))''',
+        'assets': '''CREATE TABLE IF NOT EXISTS assets
+                    (asset_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT NOT NULL, purchase_price REAL, year_of_purchase INTEGER,
+                    FOREIGN KEY(user_id) REFERENCES users(user_id))''',
+        'loans': '''CREATE TABLE IF NOT EXISTS loans
+                    (loan_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT NOT NULL, principal REAL, initial_principal REAL, interest_rate REAL, signing_date TEXT, interest REAL, last_calculated_date TEXT,
+                    FOREIGN KEY(user_id) REFERENCES users(user_id))''',
+        'net_worth_history': '''CREATE TABLE IF NOT EXISTS net_worth_history
+                    (user_id INTEGER, date TEXT PRIMARY KEY, net_worth REAL,
+                    FOREIGN KEY(user_id) REFERENCES users(user_id))''',
+        'loan_repayment': '''CREATE TABLE IF NOT EXISTS loan_repayment
+                            (loan_id INTEGER PRIMARY KEY, repaid_principal REAL,
+                            FOREIGN KEY(loan_id) REFERENCES loans(loan_id))''',
+        'quotes': '''CREATE TABLE IF NOT EXISTS quotes
+                    (symbol TEXT PRIMARY KEY, price REAL, open REAL, company_name TEXT, fetched_at TEXT NOT NULL)''',
+        'price_history': '''CREATE TABLE IF NOT EXISTS price_history
+                    (symbol TEXT NOT NULL, date TEXT NOT NULL, open REAL, high REAL, low REAL, close REAL, volume REAL,
+                    PRIMARY KEY(symbol, date))'''
+    }
+
+    for table, query in tables.items():
+        c.execute(query)
+
+
+def add_recurrence_ids(c):
+    # Databases created before records.recurrence_id existed may hold duplicated catch-up rows
+    c.execute('PRAGMA table_info(records)')
+    if 'recurrence_id' not in [column[1] for column in c.fetchall()]:
+        c.execute('ALTER TABLE records ADD COLUMN recurrence_id INTEGER REFERENCES recurring_records(id)')
+
+        # Attribute existing rows to the schedule that generated them: same template, a past due date on the schedule's step
+        c.execute('''
+            UPDATE records SET recurrence_id = (
+                SELECT rr.id FROM recurring_records rr
+                WHERE rr.user_id = records.user_id AND rr.category IS records.category AND rr.type IS records.type
+                AND rr.linked_loan IS records.linked_loan AND records.amount IN (rr.amount, ABS(rr.amount))
+                AND records.date < rr.date
+                AND CAST(julianday(rr.date) - julianday(records.date) AS INTEGER) %
+                    (CASE rr.frequency WHEN 'Daily' THEN 1 WHEN 'Weekly' THEN 7 WHEN 'Monthly' THEN 30 WHEN 'Annual' THEN 365 END) = 0
+                ORDER BY rr.id LIMIT 1)
+        ''')
+
+        # Keep the first copy of every occurrence
+        c.execute('''
+            DELETE FROM records WHERE recurrence_id IS NOT NULL AND record_id NOT IN (
+                SELECT MIN(record_id) FROM records WHERE recurrence_id IS NOT NULL GROUP BY recurrence_id, date)
+        ''')
+
+    # One row per occurrence of a recurring record, so catch-up can be re-run safely
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_records_recurrence ON records(recurrence_id, date) WHERE recurrence_id IS NOT NULL')
+
+
+def add_secondary_indexes(c):
+    # Covers the weekly chart (user, type, date range) and the income/expense sums without touching the table
+    c.execute('CREATE INDEX IF NOT EXISTS idx_records_user_type_date ON records(user_id, type, date, amount, linked_loan)')
+    # Loan removal and catch-up look records and schedules up by their loan
+    c.execute('CREATE INDEX IF NOT EXISTS idx_records_linked_loan ON records(linked_loan) WHERE linked_loan IS NOT NULL')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_recurring_records_user_loan ON recurring_records(user_id, linked_loan, date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_portfolio_user_symbol ON portfolio(user_id, symbol)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_assets_user ON assets(user_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_loans_user ON loans(user_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_net_worth_history_user_date ON net_worth_history(user_id, date)')
+
+
+def rebuild_user_totals(c):
+    # Recompute every user's running totals from the base tables
+    c.execute('DELETE FROM user_totals')
+    c.execute('''
+        INSERT INTO user_totals (user_id, income, expenses, assets_value, liabilities)
+        SELECT user_id, TOTAL(income), TOTAL(expenses), TOTAL(assets_value), TOTAL(liabilities) FROM (
+            SELECT user_id, CASE WHEN type = 'Income' THEN amount END AS income,
+                   CASE WHEN type = 'Expense' AND linked_loan IS NULL THEN amount END AS expenses,
+                   NULL AS assets_value, NULL AS liabilities FROM records
+            UNION ALL SELECT user_id, NULL, NULL, purchase_price, NULL FROM assets
+            UNION ALL SELECT user_id, NULL, NULL, NULL, principal + interest FROM loans)
+        WHERE user_id IS NOT NULL GROUP BY user_id
+    ''')
+
+
+def add_user_totals(c):
+    # Per-user sums of income, expenses (excluding loan repayments), asset values and liabilities,
+    # kept current by triggers so net worth no longer scans the base tables
+    c.execute('''CREATE TABLE IF NOT EXISTS user_totals
+                 (user_id INTEGER NOT NULL PRIMARY KEY, income REAL NOT NULL DEFAULT 0, expenses REAL NOT NULL DEFAULT 0,
+                 assets_value REAL NOT NULL DEFAULT 0, liabilities REAL NOT NULL DEFAULT 0,
+                 FOREIGN KEY(user_id) REFERENCES users(user_id))''')
+
+    # table: (columns the totals depend on, {total: contribution of one row})
+    sources = {
+        'records': ('user_id, type, amount, linked_loan', {
+            'income': "CASE WHEN {row}.type = 'Income' THEN {row}.amount END",
+            'expenses': "CASE WHEN {row}.type = 'Expense' AND {row}.linked_loan IS NULL THEN {row}.amount END",
+        }),
+        'assets': ('user_id, purchase_price', {'assets_value': '{row}.purchase_price'}),
+        'loans': ('user_id, principal, interest', {'liabilities': '{row}.principal + {row}.interest'}),
+    }
+
+    for table, (columns, totals) in sources.items():
+        def apply(row, sign):
+            # Add (or subtract) one row's contribution; NULL contributes nothing, as in SUM
+            assignments = ', '.join(f"{total} = {total} {sign} COALESCE({expression.format(row=row)}, 0)" for total, expression in totals.items())
+            return f"UPDATE user_totals SET {assignments} WHERE user_id = {row}.user_id;"
+
+        # A NULL user_id violates NOT NULL and is ignored
+        create_row = 'INSERT OR IGNORE INTO user_totals (user_id) VALUES (NEW.user_id);'
+        c.execute(f'CREATE TRIGGER IF NOT EXISTS {table}_totals_insert AFTER INSERT ON {table} BEGIN {create_row} {apply("NEW", "+")} END')
+        c.execute(f'CREATE TRIGGER IF NOT EXISTS {table}_totals_delete AFTER DELETE ON {table} BEGIN {apply("OLD", "-")} END')
+        c.execute(f'CREATE TRIGGER IF NOT EXISTS {table}_totals_update AFTER UPDATE OF {columns} ON {table} '
+                  f'BEGIN {apply("OLD", "-")} {create_row} {apply("NEW", "+")} END')
+
+    rebuild_user_totals(c)
+
+
+def rebuild_daily_rollups(c):
+    # Recompute the per-day sums from the records table
+    c.execute('DELETE FROM daily_rollups')
+    c.execute('''
+        INSERT INTO daily_rollups (user_id, day, type, category, amount, records)
+        SELECT user_id, date, COALESCE(type, ''), COALESCE(category, ''), TOTAL(amount), COUNT(*)
+        FROM records WHERE user_id IS NOT NULL GROUP BY user_id, date, COALESCE(type, ''), COALESCE(category, '')
+    ''')
+
+
+def add_daily_rollups(c):
+    # Records summed per user, day, type and category, kept current by triggers so charts
+    # over any date range read at most one row per day and category
+    c.execute('''CREATE TABLE IF NOT EXISTS daily_rollups
+                 (user_id INTEGER NOT NULL, day TEXT NOT NULL, type TEXT NOT NULL, category TEXT NOT NULL,
+                 amount REAL NOT NULL DEFAULT 0, records INTEGER NOT NULL DEFAULT 0,
+                 PRIMARY KEY(user_id, day, type, category),
+                 FOREIGN KEY(user_id) REFERENCES users(user_id)) WITHOUT ROWID''')
+
+    def add(row):
+        return (f"INSERT INTO daily_rollups (user_id, day, type, category, amount, records) "
+                f"SELECT {row}.user_id, {row}.date, COALESCE({row}.type, ''), COALESCE({row}.category, ''), COALESCE({row}.amount, 0), 1 "
+                f"WHERE {row}.user_id IS NOT NULL "
+                f"ON CONFLICT(user_id, day, type, category) DO UPDATE SET amount = amount + excluded.amount, records = records + 1;")
+
+    def remove(row):
+        key = f"user_id = {row}.user_id AND day = {row}.date AND type = COALESCE({row}.type, '') AND category = COALESCE({row}.category, '')"
+        # Days left without records are dropped so the table only holds days with activity
+        return (f"UPDATE daily_rollups SET amount = amount - COALESCE({row}.amount, 0), records = records - 1 WHERE {key}; "
+                f"DELETE FROM daily_rollups WHERE {key} AND records <= 0;")
+
+    c.execute(f'CREATE TRIGGER IF NOT EXISTS records_rollups_insert AFTER INSERT ON records BEGIN {add("NEW")} END')
+    c.execute(f'CREATE TRIGGER IF NOT EXISTS records_rollups_delete AFTER DELETE ON records BEGIN {remove("OLD")} END')
+    c.execute('CREATE TRIGGER IF NOT EXISTS records_rollups_update AFTER UPDATE OF user_id, date, type, category, amount ON records '
+              f'BEGIN {remove("OLD")} {add("NEW")} END')
+
+    rebuild_daily_rollups(c)
+
+
+def add_view_snapshots(c):
+    # Last computed state of the main window per user, painted at startup before the first refresh
+    c.execute('''CREATE TABLE IF NOT EXISTS view_snapshots
+                 (user_id INTEGER PRIMARY KEY, saved_at TEXT NOT NULL, state TEXT NOT NULL,
+                 FOREIGN KEY(user_id) REFERENCES users(user_id))''')
+
+
+def add_records_keyset_index(c):
+    # Records pages seek on (user_id, date, record_id); the rowid is implicitly the last index column
+    c.execute('CREATE INDEX IF NOT EXISTS idx_records_user_date ON records(user_id, date)')
+
+
+def add_import_ids(c):
+    # Statement lines carry a stable id (the bank's FITID or a hash of the line), so importing
+    # an overlapping statement again skips the rows that are already there
+    c.execute('ALTER TABLE records ADD COLUMN import_id TEXT')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_records_import ON records(user_id, import_id) WHERE import_id IS NOT NULL')
+
+
+def key_net_worth_history_by_user(c):
+    # net_worth_history was keyed by date alone, so recording one user's net worth replaced every
+    # other user's entry for that day
+    c.execute('''CREATE TABLE net_worth_history_by_user
+                 (user_id INTEGER NOT NULL, date TEXT NOT NULL, net_worth REAL, PRIMARY KEY(user_id, date),
+                 FOREIGN KEY(user_id) REFERENCES users(user_id))''')
+    c.execute('INSERT INTO net_worth_history_by_user (user_id, date, net_worth) SELECT user_id, date, net_worth FROM net_worth_history WHERE user_id IS NOT NULL')
+    c.execute('DROP TABLE net_worth_history')  # Also drops idx_net_worth_history_user_date, now covered by the primary key
+    c.execute('ALTER TABLE net_worth_history_by_user RENAME TO net_worth_history')
+
+
+# Append new migrations at the end; never reorder or edit one that has shipped
+MIGRATIONS = [
+    create_base_tables,
+    add_recurrence_ids,
+    add_secondary_indexes,
+    add_user_totals,
+    add_daily_rollups,
+    add_view_snapshots,
+    add_records_keyset_index,
+    add_import_ids,
+    key_net_worth_history_by_user,
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    # Apply every pending migration in its own transaction together with the version bump
+    version = schema_version(conn)
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        c = conn.cursor()
+        c.execute('BEGIN')
+        try:
+            migration(c)
+            c.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return schema_version(conn)
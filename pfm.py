@@ -0,0 +1,96 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from engine import FinanceEngine
+from market_data import create_provider
+from quote_cache import QuoteCache
+from resilience import ResilientProvider
+from storage import DB_PATH, Storage
+
+engine = None  # One engine, and so one set of SQLite connections, per worker process
+
+
+def create_engine(storage):
+    return FinanceEngine(storage, QuoteCache(ResilientProvider(create_provider()), storage))
+
+
+def start_worker(db_path):
+    global engine
+    engine = create_engine(Storage(db_path))
+
+
+def refresh_user(user_id, predict, quotes):
+    started = time.perf_counter()
+    return engine.refresh(user_id, predict=predict, quotes=quotes), time.perf_counter() - started
+
+
+def refresh(args):
+    # Migrate once up front so the workers never race on the schema
+    storage = Storage(args.db)
+    storage.migrate()
+    if args.all_users:
+        user_ids = storage.users.all_ids()
+    else:
+        user_ids = [storage.users.find(name) for name in args.user]
+    unknown = [name for name, user_id in zip(args.user or [], user_ids) if user_id is None]
+    if unknown:
+        storage.close()
+        print(f"No user named {', '.join(repr(name) for name in unknown)}", file=sys.stderr)
+        return 1
+
+    # Price every holding of the run in one batched request; if that fails the workers use cached prices
+    quotes = create_engine(storage).fetch_quotes(storage.portfolio.symbols(user_ids))
+    storage.close()
+
+    # Each user is refreshed in its own transactions; SQLite (WAL) serializes the short writes
+    # while the computations run in parallel
+    failed = 0
+    unpredicted = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=start_worker, initargs=(args.db,)) as pool:
+        futures = {pool.submit(refresh_user, user_id, not args.no_predict, quotes): user_id for user_id in user_ids}
+        for future in as_completed(futures):
+            try:
+                result, elapsed = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"User {futures[future]}: failed: {e}", file=sys.stderr)
+                continue
+            if result.unpriced_symbols:
+                print(f"User {result.user_id}: no price for {', '.join(result.unpriced_symbols)}, left out of the net worth",
+                      file=sys.stderr)
+            if result.prediction_error:
+                unpredicted += 1
+                print(f"User {result.user_id}: expense prediction failed: {result.prediction_error}", file=sys.stderr)
+            years = "not within 100 years" if result.years_to_retirement is None else f"{result.years_to_retirement} years"
+            predicted = "n/a" if result.predicted_expenses is None else f"${result.predicted_expenses:,.2f}"
+            print(f"User {result.user_id}: {result.records_added} recurring record(s) added, net worth ${result.net_worth:,.2f}, "
+                  f"FIRE in {years}, next month's expenses {predicted} ({elapsed:.2f}s)")
+    summary = f"Refreshed {len(user_ids) - failed} of {len(user_ids)} user(s)"
+    if unpredicted:
+        summary += f", expense prediction failed for {unpredicted}"
+    print(summary)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pfm', description='Fire Journey without the window')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    refresh_parser = commands.add_parser('refresh', help='catch up recurring records, accrue loan interest and record net worth')
+    users = refresh_parser.add_mutually_exclusive_group(required=True)
+    users.add_argument('--all-users', action='store_true', help='refresh every user in the database')
+    users.add_argument('--user', action='append', help='name of a user to refresh (repeatable)')
+    refresh_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes (default: CPU count)')
+    refresh_parser.add_argument('--no-predict', action='store_true', help='skip the expense prediction (needs pandas and scikit-learn)')
+    refresh_parser.set_defaults(run=refresh)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
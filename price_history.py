@@ -0,0 +1,74 @@
+import datetime
+
+from market_data import normalize_symbols
+
+# How far back a symbol is backfilled the first time it is seen
+BACKFILL_DAYS = 400
+
+
+# Daily OHLC bars stored locally in the price_history table.
+# A symbol is backfilled once and afterwards only the days after its latest stored bar are fetched.
+class PriceHistoryStore:
+    def __init__(self, provider, storage, backfill_days=BACKFILL_DAYS):
+        self.provider = provider
+        self.storage = storage
+        self.backfill_days = backfill_days
+        self.synced = {}  # symbol -> date of the last sync in this session
+
+    def sync(self, symbols):
+        today = datetime.date.today()
+        symbols = [symbol for symbol in normalize_symbols(symbols) if self.synced.get(symbol) != today]
+        if not symbols:
+            return
+
+        latest = self.latest_dates(symbols)
+
+        # Group symbols by the first missing day so each group is one batched request
+        groups = {}
+        for symbol in symbols:
+            if symbol in latest:
+                start = datetime.date.fromisoformat(latest[symbol]) + datetime.timedelta(days=1)
+            else:
+                start = today - datetime.timedelta(days=self.backfill_days)
+            if start < today:
+                groups.setdefault(start, []).append(symbol)
+
+        for start, group in groups.items():
+            # Today's bar is still moving, so only completed days are stored
+            history = self.provider.get_history(group, start.isoformat(), today.isoformat())
+            rows = [(symbol, bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume)
+                    for symbol, bars in history.items() for bar in bars if bar.date < today.isoformat()]
+            with self.storage.writer() as conn:
+                conn.executemany('INSERT OR REPLACE INTO price_history (symbol, date, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+        for symbol in symbols:
+            self.synced[symbol] = today
+
+    def latest_dates(self, symbols):
+        placeholders = ', '.join('?' for _ in symbols)
+        with self.storage.reader() as conn:
+            rows = conn.execute(f'SELECT symbol, MAX(date) FROM price_history WHERE symbol IN ({placeholders}) GROUP BY symbol', symbols).fetchall()
+        return dict(rows)
+
+    def closes_on_or_after(self, symbols, date):
+        # First stored close on or after date for each symbol, e.g. the price a year ago
+        symbols = normalize_symbols(symbols)
+        if not symbols:
+            return {}
+        placeholders = ', '.join('?' for _ in symbols)
+        with self.storage.reader() as conn:
+            rows = conn.execute(f'''
+                SELECT p.symbol, p.close FROM price_history p
+                JOIN (SELECT symbol, MIN(date) AS date FROM price_history
+                      WHERE symbol IN ({placeholders}) AND date >= ? GROUP BY symbol) first
+                ON p.symbol = first.symbol AND p.date = first.date
+            ''', symbols + [str(date)]).fetchall()
+        return dict(rows)
+
+    def get_bars(self, symbol, start=None, end=None):
+        with self.storage.reader() as conn:
+            return conn.execute('''
+                SELECT date, open, high, low, close, volume FROM price_history
+                WHERE symbol = ? AND date >= COALESCE(?, date) AND date < COALESCE(?, '9999-12-31')
+                ORDER BY date
+            ''', (symbol.upper(), start, end)).fetchall()
@@ -0,0 +1,115 @@
+import os
+import datetime
+import threading
+
+from market_data import MarketDataProvider, Quote, normalize_symbols
+
+# Quotes younger than this many seconds are served without touching the network
+DEFAULT_TTL = int(os.environ.get('PFM_QUOTE_TTL', 300))
+
+
+# Persistent quote cache in the quotes table, placed in front of another provider.
+# Fresh quotes are served from SQLite, stale quotes are returned immediately while
+# a background thread refreshes them, and only unknown symbols block on the network.
+class QuoteCache(MarketDataProvider):
+    name = 'cache'
+
+    def __init__(self, provider, storage, ttl=DEFAULT_TTL, on_refreshed=None):
+        self.provider = provider
+        self.storage = storage
+        self.ttl = ttl
+        self.on_refreshed = on_refreshed  # Called with {symbol: Quote} after a background refresh
+        self.refreshing = set()  # Symbols with a background refresh in flight
+        self.lock = threading.Lock()
+
+    def get_quotes(self, symbols, with_names=False, wait=False):
+        # With wait=True stale quotes are fetched before returning instead of in the background,
+        # for callers that record the prices, like the headless refresh
+        symbols = normalize_symbols(symbols)
+        if not symbols:
+            return {}
+
+        cached = self.load(symbols)
+        now = datetime.datetime.now()
+        quotes = {}
+        missing = []
+        stale = []
+        for symbol in symbols:
+            if symbol not in cached or (with_names and not cached[symbol][0].company_name):
+                missing.append(symbol)
+                continue
+            quote, fetched_at = cached[symbol]
+            quotes[symbol] = quote
+            if (now - fetched_at).total_seconds() > self.ttl:
+                stale.append(symbol)
+
+        # Nothing to show for unknown symbols, so those are fetched synchronously
+        if wait:
+            missing += stale
+        if missing:
+            quotes.update(self.fetch(missing, with_names))
+        if stale and not wait:
+            self.refresh_in_background(stale)
+
+        return quotes
+
+    def get_cached(self, symbols):
+        # Last known quotes regardless of age, used when the upstream is unavailable
+        return {symbol: quote for symbol, (quote, fetched_at) in self.load(normalize_symbols(symbols)).items()}
+
+    def get_history(self, symbols, start, end=None):
+        # Price history has its own store, so it is passed straight through
+        return self.provider.get_history(symbols, start, end)
+
+    def refresh(self, symbols):
+        # Force a synchronous network refresh, e.g. for the "Update Portfolio" button
+        return self.fetch(normalize_symbols(symbols))
+
+    def fetch(self, symbols, with_names=False):
+        quotes = self.provider.get_quotes(symbols, with_names=with_names)
+        self.store(quotes)
+        return quotes
+
+    def refresh_in_background(self, symbols):
+        with self.lock:
+            symbols = [symbol for symbol in symbols if symbol not in self.refreshing]
+            self.refreshing.update(symbols)
+        if not symbols:
+            return
+
+        def run():
+            try:
+                quotes = self.fetch(symbols)
+                if self.on_refreshed and quotes:
+                    self.on_refreshed(quotes)
+            except Exception as e:
+                print(f"Background quote refresh failed: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing.difference_update(symbols)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # Reads borrow a pooled read-only connection so the cache can be used from worker threads
+    def load(self, symbols):
+        placeholders = ', '.join('?' for _ in symbols)
+        with self.storage.reader() as conn:
+            rows = conn.execute(f'SELECT symbol, company_name, price, open, fetched_at FROM quotes WHERE symbol IN ({placeholders})',
+                                symbols).fetchall()
+
+        cached = {}
+        for symbol, company_name, price, opening_price, fetched_at in rows:
+            cached[symbol] = (Quote(symbol, company_name, price, opening_price), datetime.datetime.fromisoformat(fetched_at))
+        return cached
+
+    def store(self, quotes):
+        if not quotes:
+            return
+        fetched_at = datetime.datetime.now().isoformat(timespec='seconds')
+        with self.storage.writer() as conn:
+            # Batched downloads carry no company name, so keep the one already cached
+            conn.executemany('''
+                INSERT INTO quotes (symbol, price, open, company_name, fetched_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(symbol) DO UPDATE SET price = excluded.price, open = excluded.open,
+                    company_name = COALESCE(excluded.company_name, quotes.company_name), fetched_at = excluded.fetched_at
+            ''', [(q.symbol, q.price, q.open, q.company_name, fetched_at) for q in quotes.values()])
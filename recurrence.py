@@ -0,0 +1,48 @@
+import datetime
+
+# Fixed step between two occurrences of a recurring record
+FREQUENCY_STEPS = {
+    'Daily': datetime.timedelta(days=1),
+    'Weekly': datetime.timedelta(weeks=1),
+    'Monthly': datetime.timedelta(days=30),
+    'Annual': datetime.timedelta(days=365),
+}
+
+# Occurrences per year, used to annualize recurring amounts
+OCCURRENCES_PER_YEAR = {'Daily': 365, 'Weekly': 52, 'Monthly': 12, 'Annual': 1}
+
+
+def next_due_date(current_date, frequency):
+    step = FREQUENCY_STEPS.get(frequency)
+    return current_date + step if step else current_date
+
+
+def first_occurrence_on_or_after(anchor, frequency, start):
+    # Jump straight to the first occurrence on or after start instead of replaying the schedule
+    step = FREQUENCY_STEPS.get(frequency)
+    if step is None or start <= anchor:
+        return anchor
+    skipped = -(-(start - anchor).days // step.days)  # Ceiling division
+    return anchor + skipped * step
+
+
+def occurrences_between(anchor, frequency, start, end):
+    # Occurrences of a schedule anchored at anchor that fall within [start, end];
+    # the cost depends on the window size, not on the age of the schedule
+    step = FREQUENCY_STEPS.get(frequency)
+    if step is None:
+        return
+    due_date = first_occurrence_on_or_after(anchor, frequency, start)
+    while due_date <= end:
+        yield due_date
+        due_date += step
+
+
+def occurrences_until(start, end, frequency):
+    # Every occurrence from start up to and including end, generated with date arithmetic,
+    # together with the first due date after end
+    step = FREQUENCY_STEPS.get(frequency)
+    if step is None or start > end:
+        return [], start
+    count = (end - start).days // step.days + 1
+    return [start + i * step for i in range(count)], start + count * step
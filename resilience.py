@@ -0,0 +1,120 @@
+import time
+import random
+import threading
+
+from market_data import MarketDataProvider
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# Token bucket: at most `rate` requests per second on average, with bursts up to `burst`
+class RateLimiter:
+    def __init__(self, rate=2.0, burst=4):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Stops calling an unhealthy upstream after repeated failures and lets a single
+# trial request through once reset_timeout seconds have passed
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_running:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+def call_with_retry(func, attempts=3, base_delay=0.5, max_delay=8.0):
+    # Exponential backoff with jitter between attempts; the last error is re-raised
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+
+# Wraps a provider with a rate limiter, retries and a circuit breaker.
+# While the circuit is open calls fail fast with CircuitOpenError so callers can fall back to cached prices.
+class ResilientProvider(MarketDataProvider):
+    name = 'resilient'
+
+    def __init__(self, provider, rate_limiter=None, circuit_breaker=None, attempts=3):
+        self.provider = provider
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.attempts = attempts
+
+    def call(self, func, *args, **kwargs):
+        if not self.circuit_breaker.allow():
+            raise CircuitOpenError(f"{self.provider.name} is unavailable, using cached prices")
+
+        def attempt():
+            self.rate_limiter.acquire()
+            return func(*args, **kwargs)
+
+        try:
+            result = call_with_retry(attempt, attempts=self.attempts)
+        except Exception:
+            self.circuit_breaker.record_failure()
+            raise
+        self.circuit_breaker.record_success()
+        return result
+
+    def get_quotes(self, symbols, with_names=False):
+        return self.call(self.provider.get_quotes, symbols, with_names=with_names)
+
+    def get_history(self, symbols, start, end=None):
+        return self.call(self.provider.get_history, symbols, start, end)
@@ -0,0 +1,200 @@
+import datetime
+import hashlib
+import json
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from engine import FinanceEngine
+from market_data import create_provider
+from quote_cache import QuoteCache
+from resilience import ResilientProvider
+from storage import DB_PATH, Storage
+
+DEFAULT_PORT = 8765
+
+# FIRE inputs that can be overridden with query parameters, rates in percent as on the FIRE tab
+FIRE_PARAMETERS = {'portfolio_value': float, 'annual_income': float, 'savings_rate': float, 'income_growth_rate': float,
+                   'income_growth_duration': int, 'annual_expenses': float, 'withdrawal_rate': float, 'annual_roi': float}
+PERCENT_PARAMETERS = ('savings_rate', 'income_growth_rate', 'withdrawal_rate', 'annual_roi')
+
+
+class NotFound(Exception):
+    pass
+
+
+# The numbers the main window shows, as JSON-ready dicts per user. Every call borrows a pooled
+# read-only connection, so requests on different server threads never share one, and nothing
+# here writes to the database except the quote cache.
+class FinanceService:
+    def __init__(self, storage, market_data):
+        self.storage = storage
+        self.market_data = market_data  # Shared by every request, so a quote is fetched once per TTL
+
+    def users(self):
+        with self.storage.reader() as conn:
+            return [{'user_id': user_id, 'name': name} for user_id, name in self.storage.bound_to(conn).users.list()]
+
+    def portfolio(self, user_id):
+        with self.storage.reader() as conn:
+            storage = self.user_storage(conn, user_id)
+            holdings = storage.portfolio.holdings(user_id)
+        return self.value_holdings(holdings)
+
+    def net_worth(self, user_id):
+        with self.storage.reader() as conn:
+            storage = self.user_storage(conn, user_id)
+            excluding_portfolio = FinanceEngine(storage).net_worth_excluding_portfolio(user_id)
+            holdings = storage.portfolio.holdings(user_id)
+            history = storage.net_worth.history(user_id)
+        portfolio = self.value_holdings(holdings)
+        return {'net_worth': excluding_portfolio + portfolio['current_value'], 'portfolio_value': portfolio['current_value'],
+                'stale_prices': portfolio['stale_prices'], 'history': [{'date': date, 'net_worth': value} for date, value in history]}
+
+    def loans(self, user_id):
+        with self.storage.reader() as conn:
+            storage = self.user_storage(conn, user_id)
+            loans = FinanceEngine(storage).accrue_loan_interest(user_id, save=False)
+        return {'loans': [loan._asdict() for loan in loans]}
+
+    def fire(self, user_id, query):
+        overrides = {}
+        for name, convert in FIRE_PARAMETERS.items():
+            if name in query:
+                value = convert(query[name][-1])
+                overrides[name] = value / 100 if name in PERCENT_PARAMETERS else value
+        if 'include_loan_expenses' in query:
+            overrides['include_loan_expenses'] = query['include_loan_expenses'][-1].lower() in ('1', 'true', 'yes')
+
+        # The quote cache borrows its own reader, so holdings are valued outside this one
+        with self.storage.reader() as conn:
+            holdings = self.user_storage(conn, user_id).portfolio.holdings(user_id)
+        portfolio_value = FinanceEngine(self.storage, self.market_data).portfolio_value(holdings)
+
+        with self.storage.reader() as conn:
+            engine = FinanceEngine(self.user_storage(conn, user_id))
+            inputs = engine.default_fire_inputs(user_id, portfolio_value)._replace(**overrides)
+            if 'annual_expenses' not in overrides:
+                # Expenses follow income and savings rate, as on the FIRE tab
+                inputs = inputs._replace(annual_expenses=inputs.annual_income * (1 - inputs.savings_rate))
+            years, portfolio_values = engine.years_to_retirement(user_id, inputs)
+        return {'years_to_retirement': years, 'portfolio_values': portfolio_values, 'inputs': inputs._asdict()}
+
+    def user_storage(self, conn, user_id):
+        storage = self.storage.bound_to(conn)
+        if storage.users.name(user_id) is None:
+            raise NotFound(f"No user {user_id}")
+        return storage
+
+    def value_holdings(self, holdings):
+        # Same figures as the Portfolio tab. When the provider is unreachable the last cached prices are used.
+        symbols = [holding.symbol for holding in holdings]
+        stale = False
+        try:
+            quotes = self.market_data.get_quotes(symbols)
+        except Exception as e:
+            print(f"Quote refresh failed, using cached prices: {e}")
+            quotes = self.market_data.get_cached(symbols)
+            stale = True
+
+        rows = []
+        current_value = total_purchase_value = daily_change = 0
+        for holding in holdings:
+            quote = quotes.get(holding.symbol)
+            row = {'symbol': holding.symbol, 'company_name': holding.company_name, 'avg_price': holding.avg_price,
+                   'quantity': holding.quantity, 'price': None, 'value': None, 'total_pl': None}
+            if quote is not None:
+                row.update(price=quote.price, value=quote.price * holding.quantity,
+                           total_pl=(quote.price - holding.avg_price) * holding.quantity)
+                current_value += quote.price * holding.quantity
+                total_purchase_value += holding.avg_price * holding.quantity
+                daily_change += (quote.price - quote.open) * holding.quantity
+            rows.append(row)
+        return {'holdings': rows, 'current_value': current_value, 'daily_change': daily_change,
+                'total_change': current_value - total_purchase_value, 'stale_prices': stale}
+
+
+ROUTES = [
+    (re.compile(r'^/users$'), lambda service, query: service.users()),
+    (re.compile(r'^/users/(\d+)/portfolio$'), lambda service, query, user_id: service.portfolio(int(user_id))),
+    (re.compile(r'^/users/(\d+)/net-worth$'), lambda service, query, user_id: service.net_worth(int(user_id))),
+    (re.compile(r'^/users/(\d+)/loans$'), lambda service, query, user_id: service.loans(int(user_id))),
+    (re.compile(r'^/users/(\d+)/fire$'), lambda service, query, user_id: service.fire(int(user_id), query)),
+]
+
+
+# GET-only JSON API. The ETag is a hash of the body, so a client revalidating with
+# If-None-Match gets an empty 304 while the numbers are unchanged.
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'FireJourney'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        for pattern, handler in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            return self.send_json(404, {'error': f"Unknown resource {url.path}"})
+
+        try:
+            data = handler(self.server.service, parse_qs(url.query), *match.groups())
+        except NotFound as e:
+            return self.send_json(404, {'error': str(e)})
+        except ValueError as e:
+            return self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            return self.send_json(500, {'error': str(e)})
+
+        body = json.dumps(data, sort_keys=True, default=str).encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_json(200, body, etag)
+
+    def send_json(self, status, data, etag=None):
+        body = data if isinstance(data, bytes) else json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')  # Always revalidate; unchanged data costs a 304
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print(f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} {self.address_string()} {format % args}")
+
+
+def create_server(storage, market_data, host='127.0.0.1', port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.service = FinanceService(storage, market_data)
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve Fire Journey numbers as JSON over HTTP')
+    parser.add_argument('--host', default='127.0.0.1', help='interface to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    args = parser.parse_args()
+
+    storage = Storage(args.db)
+    storage.migrate()
+    # Quotes come from Yahoo Finance, or from the file named by PFM_QUOTES_FILE
+    server = create_server(storage, QuoteCache(ResilientProvider(create_provider()), storage), args.host, args.port)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        storage.close()
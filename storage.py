@@ -0,0 +1,450 @@
+import copy
+import datetime
+import json
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from migrations import migrate, rebuild_daily_rollups, rebuild_user_totals
+
+DB_PATH = 'finance.db'
+READ_POOL_SIZE = 4  # Read-only connections shared by worker threads
+PAGE_SIZE = 500  # Rows per page when iterating over large tables
+
+Holding = namedtuple('Holding', ['symbol', 'company_name', 'avg_price', 'quantity'])
+Lot = namedtuple('Lot', ['portfolio_id', 'symbol', 'company_name', 'purchase_price', 'quantity', 'purchase_date'])
+Asset = namedtuple('Asset', ['asset_id', 'name', 'purchase_price', 'year_of_purchase'])
+Loan = namedtuple('Loan', ['loan_id', 'name', 'principal', 'initial_principal', 'interest_rate', 'signing_date', 'last_calculated_date', 'interest'])
+Totals = namedtuple('Totals', ['income', 'expenses', 'assets_value', 'liabilities'])
+Record = namedtuple('Record', ['record_id', 'date', 'category', 'type', 'amount', 'linked_loan'])
+RecurringRecord = namedtuple('RecurringRecord', ['id', 'date', 'category', 'type', 'amount', 'frequency', 'linked_loan'])
+
+# Filters for the records query API; None means no restriction. start and end are inclusive dates,
+# linked_loan is a loan id, True for any loan or False for records without one.
+RecordFilter = namedtuple('RecordFilter', ['start', 'end', 'category', 'record_type', 'min_amount', 'max_amount', 'linked_loan'],
+                          defaults=(None,) * 7)
+
+# Orders the records query API can page in: the SQL sort key and the same key read from a Record.
+# Ties are broken by record_id; NULLs sort as empty or zero so keyset comparisons never see one.
+RECORD_ORDERS = {
+    'date': ('date', lambda record: record.date),
+    'category': ("COALESCE(category, '')", lambda record: record.category or ''),
+    'type': ("COALESCE(type, '')", lambda record: record.type or ''),
+    'amount': ('COALESCE(amount, 0)', lambda record: record.amount or 0),
+}
+
+
+def connect(db_path, read_only=False, check_same_thread=True):
+    conn = sqlite3.connect(db_path, timeout=10, check_same_thread=check_same_thread)
+    # WAL is persistent in the database file; NORMAL sync is safe with WAL and avoids an fsync per commit
+    conn.execute('PRAGMA synchronous=NORMAL')
+    if read_only:
+        conn.execute('PRAGMA query_only=ON')
+    return conn
+
+
+# Owns the SQLite connections: one write connection for the GUI thread, a bounded pool of
+# read-only connections for worker threads and short-lived write connections for background jobs.
+# With WAL, readers see the last committed state and never wait on the writer.
+class Storage:
+    def __init__(self, db_path=DB_PATH, read_pool_size=READ_POOL_SIZE):
+        self.db_path = db_path
+        self.conn = connect(db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.depth = 0  # Nesting level of transaction()
+
+        self.read_pool_size = read_pool_size
+        self.readers = queue.LifoQueue()
+        self.readers_created = 0
+        self.lock = threading.Lock()
+        self.create_repositories()
+
+    def create_repositories(self):
+        self.users = UsersRepository(self)
+        self.records = RecordsRepository(self)
+        self.assets = AssetsRepository(self)
+        self.loans = LoansRepository(self)
+        self.portfolio = PortfolioRepository(self)
+        self.net_worth = NetWorthRepository(self)
+        self.totals = TotalsRepository(self)
+        self.rollups = RollupsRepository(self)
+        self.snapshots = SnapshotsRepository(self)
+
+    def migrate(self):
+        return migrate(self.conn)
+
+    def bound_to(self, conn):
+        # The same repositories over another connection, e.g. a pooled reader on a server thread;
+        # the connection pools stay shared with this storage
+        view = copy.copy(self)
+        view.conn = conn
+        view.depth = 0
+        view.create_repositories()
+        return view
+
+    @contextmanager
+    def transaction(self):
+        # Group several writes into one commit; nested blocks join the outermost transaction
+        if self.depth:
+            self.depth += 1
+            try:
+                yield self.conn.cursor()
+            finally:
+                self.depth -= 1
+            return
+
+        if self.conn.in_transaction:
+            self.conn.commit()  # Close any implicit transaction left open by a plain execute
+        c = self.conn.cursor()
+        c.execute('BEGIN')
+        self.depth = 1
+        try:
+            yield c
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            self.depth = 0
+
+    @contextmanager
+    def reader(self):
+        # Borrow a read-only connection from the pool, waiting if all of them are in use
+        try:
+            conn = self.readers.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                create = self.readers_created < self.read_pool_size
+                if create:
+                    self.readers_created += 1
+            conn = connect(self.db_path, read_only=True, check_same_thread=False) if create else self.readers.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        # Separate write connection for worker threads; committed on success
+        conn = connect(self.db_path)
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def close(self):
+        while not self.readers.empty():
+            self.readers.get_nowait().close()
+        self.conn.close()
+
+
+# Subquery over a JSON array of ids bound to one parameter (see id_set), so a whole selection is
+# deleted by a single statement instead of one per id, and without hitting the variable limit
+IN_ID_SET = 'IN (SELECT value FROM json_each(?))'
+
+
+def id_set(ids):
+    return json.dumps([int(row_id) for row_id in ids])
+
+
+class Repository:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def execute(self, query, params=()):
+        return self.storage.conn.execute(query, params)
+
+
+class UsersRepository(Repository):
+    def find(self, name):
+        # Id of the user with this name, or None; unlike get_or_create this never adds a user
+        user = self.execute('SELECT user_id FROM users WHERE name = ?', (name,)).fetchone()
+        return user[0] if user else None
+
+    def get_or_create(self, name):
+        user_id = self.find(name)
+        if user_id is not None:
+            return user_id
+        with self.storage.transaction() as c:
+            c.execute('INSERT INTO users (name) VALUES (?)', (name,))
+            return c.lastrowid
+
+    def all_ids(self):
+        return [row[0] for row in self.execute('SELECT user_id FROM users ORDER BY user_id')]
+
+    def list(self):
+        return self.execute('SELECT user_id, name FROM users ORDER BY user_id').fetchall()
+
+    def name(self, user_id):
+        row = self.execute('SELECT name FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else None
+
+
+class RecordsRepository(Repository):
+    def add(self, user_id, date, category, record_type, amount, linked_loan=None):
+        with self.storage.transaction() as c:
+            c.execute('INSERT INTO records (user_id, date, category, type, amount, linked_loan) VALUES (?, ?, ?, ?, ?, ?)',
+                      (user_id, str(date), category, record_type, amount, linked_loan))
+            return c.lastrowid
+
+    def add_many(self, user_id, rows):
+        # rows: [(date, category, type, amount)], inserted by one statement
+        with self.storage.transaction() as c:
+            c.executemany('INSERT INTO records (user_id, date, category, type, amount) VALUES (?, ?, ?, ?, ?)',
+                          [(user_id, str(date), category, record_type, amount) for date, category, record_type, amount in rows])
+
+    def add_recurring(self, user_id, date, category, record_type, amount, frequency, linked_loan=None):
+        with self.storage.transaction() as c:
+            c.execute('INSERT INTO recurring_records (user_id, date, category, type, amount, frequency, linked_loan) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                      (user_id, str(date), category, record_type, amount, frequency, linked_loan))
+            return c.lastrowid
+
+    def delete(self, record_ids):
+        with self.storage.transaction() as c:
+            return c.execute(f'DELETE FROM records WHERE record_id {IN_ID_SET}', (id_set(record_ids),)).rowcount
+
+    def recurring(self, user_id):
+        return [RecurringRecord(*row) for row in self.execute(
+            'SELECT id, date, category, type, amount, frequency, linked_loan FROM recurring_records WHERE user_id = ?', (user_id,))]
+
+    def recurring_query(self, user_id):
+        # SELECT and parameters behind the paged table of a user's recurring records (table_models.SqlTableModel)
+        return 'SELECT id, date, category, type, amount, frequency FROM recurring_records WHERE user_id = ?', (user_id,)
+
+    def delete_recurring(self, recurring_ids):
+        # Removing a loan's repayment schedule also removes its repayments and resets the loan
+        # to its initial state; every table is written by one statement in one transaction
+        ids = id_set(recurring_ids)
+        linked_loans = f'IN (SELECT linked_loan FROM recurring_records WHERE id {IN_ID_SET} AND linked_loan IS NOT NULL)'
+        with self.storage.transaction() as c:
+            c.execute(f'UPDATE loans SET principal = initial_principal, interest = 0 WHERE loan_id {linked_loans}', (ids,))
+            c.execute(f'DELETE FROM loan_repayment WHERE loan_id {linked_loans}', (ids,))
+            c.execute(f'DELETE FROM records WHERE linked_loan {linked_loans}', (ids,))
+            return c.execute(f'DELETE FROM recurring_records WHERE id {IN_ID_SET}', (ids,)).rowcount
+
+    def where(self, user_id, record_filter=None):
+        # WHERE clause and parameters for a RecordFilter
+        record_filter = record_filter or RecordFilter()
+        clauses, params = ['user_id = ?'], [user_id]
+        for clause, value in (('date >= ?', record_filter.start), ('date <= ?', record_filter.end),
+                              ('category = ?', record_filter.category), ('type = ?', record_filter.record_type),
+                              ('amount >= ?', record_filter.min_amount), ('amount <= ?', record_filter.max_amount)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(str(value) if clause.startswith('date') else value)
+        if record_filter.linked_loan is True:
+            clauses.append('linked_loan IS NOT NULL')
+        elif record_filter.linked_loan is False:
+            clauses.append('linked_loan IS NULL')
+        elif record_filter.linked_loan is not None:
+            clauses.append('linked_loan = ?')
+            params.append(record_filter.linked_loan)
+        return ' AND '.join(clauses), params
+
+    def page(self, user_id, record_filter=None, after=None, limit=PAGE_SIZE, descending=True, order='date'):
+        # One page ordered by (order, record_id). after is the page_key() of the last row of the previous
+        # page; the next page seeks past it instead of skipping rows, on idx_records_user_date for dates.
+        where, params = self.where(user_id, record_filter)
+        key = RECORD_ORDERS[order][0]
+        direction, comparison = ('DESC', '<') if descending else ('ASC', '>')
+        if after is not None:
+            where += f' AND ({key}, record_id) {comparison} (?, ?)'
+            params += [str(after[0]) if order == 'date' else after[0], after[1]]
+        rows = self.execute(f'''
+            SELECT record_id, date, category, type, amount, linked_loan FROM records
+            WHERE {where} ORDER BY {key} {direction}, record_id {direction} LIMIT ?
+        ''', params + [limit])
+        return [Record(*row) for row in rows]
+
+    def page_key(self, record, order='date'):
+        # Where the page after record starts
+        return RECORD_ORDERS[order][1](record), record.record_id
+
+    def iterate(self, user_id, record_filter=None, descending=False, page_size=PAGE_SIZE):
+        # Every matching record, one page in memory at a time
+        after = None
+        while True:
+            page = self.page(user_id, record_filter, after, page_size, descending)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = self.page_key(page[-1])
+
+    def count(self, user_id, record_filter=None):
+        where, params = self.where(user_id, record_filter)
+        return self.execute(f'SELECT COUNT(*) FROM records WHERE {where}', params).fetchone()[0]
+
+    def ids(self, user_id, record_filter=None):
+        where, params = self.where(user_id, record_filter)
+        return [row[0] for row in self.execute(f'SELECT record_id FROM records WHERE {where}', params)]
+
+
+class AssetsRepository(Repository):
+    def list(self, user_id):
+        return [Asset(*row) for row in self.execute('SELECT asset_id, name, purchase_price, year_of_purchase FROM assets WHERE user_id = ?', (user_id,))]
+
+    def add(self, user_id, name, purchase_price, year_of_purchase):
+        with self.storage.transaction() as c:
+            c.execute('INSERT INTO assets (user_id, name, purchase_price, year_of_purchase) VALUES (?, ?, ?, ?)',
+                      (user_id, name, purchase_price, year_of_purchase))
+
+    def delete(self, asset_ids):
+        with self.storage.transaction() as c:
+            c.execute(f'DELETE FROM assets WHERE asset_id {IN_ID_SET}', (id_set(asset_ids),))
+
+
+class LoansRepository(Repository):
+    def list(self, user_id):
+        return [Loan(*row) for row in self.execute('SELECT loan_id, name, principal, initial_principal, interest_rate, signing_date, last_calculated_date, interest FROM loans WHERE user_id = ?', (user_id,))]
+
+    def add(self, user_id, name, principal, interest_rate, signing_date):
+        # A new loan starts with no interest, calculated from the signing date
+        with self.storage.transaction() as c:
+            c.execute('''
+                INSERT INTO loans (user_id, name, principal, initial_principal, interest_rate, signing_date, last_calculated_date, interest)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, name, principal, principal, interest_rate, signing_date, signing_date, 0.0))
+
+    def repaid_principal(self, user_id):
+        return dict(self.execute('''
+            SELECT r.loan_id, r.repaid_principal FROM loan_repayment r JOIN loans l ON l.loan_id = r.loan_id WHERE l.user_id = ?
+        ''', (user_id,)))
+
+    def next_repayment_dates(self, user_id):
+        return dict(self.execute('''
+            SELECT linked_loan, MIN(date) FROM recurring_records WHERE user_id = ? AND linked_loan IS NOT NULL GROUP BY linked_loan
+        ''', (user_id,)))
+
+    def save_interest(self, user_id, accruals):
+        # accruals: [(loan_id, last_calculated_date, interest)]
+        with self.storage.transaction() as c:
+            c.executemany('UPDATE loans SET last_calculated_date = ?, interest = ? WHERE user_id = ? AND loan_id = ?',
+                          [(date, interest, user_id, loan_id) for loan_id, date, interest in accruals])
+
+    def delete(self, loan_ids):
+        # Remove the loans together with their repayment schedules and records
+        ids = (id_set(loan_ids),)
+        with self.storage.transaction() as c:
+            c.execute(f'DELETE FROM recurring_records WHERE linked_loan {IN_ID_SET}', ids)
+            c.execute(f'DELETE FROM records WHERE linked_loan {IN_ID_SET}', ids)
+            c.execute(f'DELETE FROM loan_repayment WHERE loan_id {IN_ID_SET}', ids)
+            c.execute(f'DELETE FROM loans WHERE loan_id {IN_ID_SET}', ids)
+
+
+class PortfolioRepository(Repository):
+    def holdings(self, user_id):
+        # Lots grouped per symbol with their average purchase price
+        return [Holding(*row) for row in self.execute('''
+            SELECT UPPER(symbol), company_name, SUM(purchase_price * quantity) / SUM(quantity) as avg_price, SUM(quantity) as total_quantity
+            FROM portfolio WHERE user_id = ? GROUP BY UPPER(symbol), company_name
+        ''', (user_id,))]
+
+    def symbols(self, user_ids):
+        # Every symbol held by any of the users, e.g. to price a whole refresh run in one request
+        return [row[0] for row in self.execute(f'SELECT DISTINCT UPPER(symbol) FROM portfolio WHERE user_id {IN_ID_SET} ORDER BY 1',
+                                               (id_set(user_ids),))]
+
+    def lots(self, user_id):
+        return [Lot(*row) for row in self.execute('SELECT portfolio_id, UPPER(symbol), company_name, purchase_price, quantity, purchase_date FROM portfolio WHERE user_id = ?', (user_id,))]
+
+    def lots_query(self, user_id):
+        # SELECT and parameters behind the paged table of a user's lots (table_models.SqlTableModel)
+        return 'SELECT portfolio_id, symbol, company_name, purchase_price, quantity, purchase_date FROM portfolio WHERE user_id = ?', (user_id,)
+
+    def add(self, user_id, symbol, purchase_price, quantity, company_name, purchase_date):
+        with self.storage.transaction() as c:
+            c.execute('INSERT INTO portfolio (user_id, symbol, purchase_price, quantity, company_name, purchase_date) VALUES (?, ?, ?, ?, ?, ?)',
+                      (user_id, symbol, purchase_price, quantity, company_name, str(purchase_date)))
+
+    def delete(self, portfolio_ids):
+        with self.storage.transaction() as c:
+            c.execute(f'DELETE FROM portfolio WHERE portfolio_id {IN_ID_SET}', (id_set(portfolio_ids),))
+
+
+class NetWorthRepository(Repository):
+    def record(self, user_id, date, net_worth):
+        with self.storage.transaction() as c:
+            c.execute('INSERT OR REPLACE INTO net_worth_history (user_id, date, net_worth) VALUES (?, ?, ?)', (user_id, str(date), net_worth))
+
+    def history(self, user_id):
+        return self.execute('SELECT date, net_worth FROM net_worth_history WHERE user_id = ? ORDER BY date', (user_id,)).fetchall()
+
+
+# Running totals maintained by triggers on records, assets and loans (see migrations.add_user_totals)
+class TotalsRepository(Repository):
+    def get(self, user_id):
+        row = self.execute('SELECT income, expenses, assets_value, liabilities FROM user_totals WHERE user_id = ?', (user_id,)).fetchone()
+        return Totals(*row) if row else Totals(0.0, 0.0, 0.0, 0.0)
+
+    def rebuild(self, tolerance=0.005):
+        # Recompute the totals from scratch and return the users whose stored totals had drifted
+        with self.storage.transaction() as c:
+            before = {row[0]: row[1:] for row in c.execute('SELECT user_id, income, expenses, assets_value, liabilities FROM user_totals')}
+            rebuild_user_totals(c)
+            after = {row[0]: row[1:] for row in c.execute('SELECT user_id, income, expenses, assets_value, liabilities FROM user_totals')}
+
+        drifted = []
+        for user_id in sorted(before.keys() | after.keys()):
+            old = before.get(user_id, (0.0,) * 4)
+            new = after.get(user_id, (0.0,) * 4)
+            if any(abs(a - b) > tolerance for a, b in zip(old, new)):
+                drifted.append((user_id, Totals(*old), Totals(*new)))
+        return drifted
+
+
+# Per-day sums of records maintained by triggers (see migrations.add_daily_rollups)
+class RollupsRepository(Repository):
+    def daily(self, user_id, start, end):
+        # [(day, type, amount)] for every day in [start, end] with at least one record
+        return self.execute('''
+            SELECT day, type, SUM(amount) FROM daily_rollups
+            WHERE user_id = ? AND day BETWEEN ? AND ? GROUP BY day, type ORDER BY day
+        ''', (user_id, str(start), str(end))).fetchall()
+
+    def rebuild(self):
+        with self.storage.transaction() as c:
+            rebuild_daily_rollups(c)
+            return c.execute('SELECT COUNT(*) FROM daily_rollups').fetchone()[0]
+
+
+class SnapshotsRepository(Repository):
+    def save(self, user_id, state):
+        saved_at = datetime.datetime.now().isoformat(timespec='seconds')
+        with self.storage.transaction() as c:
+            c.execute('INSERT OR REPLACE INTO view_snapshots (user_id, saved_at, state) VALUES (?, ?, ?)',
+                      (user_id, saved_at, json.dumps(state, separators=(',', ':'))))
+
+    def load(self, user_id):
+        # (saved_at, state) of the last snapshot, or None
+        row = self.execute('SELECT saved_at, state FROM view_snapshots WHERE user_id = ?', (user_id,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+
+# Consistency checks: python storage.py [--check-totals] [--rebuild-rollups] [--db finance.db]
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fire Journey database maintenance')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--check-totals', action='store_true', help='rebuild user_totals from the base tables and report drift')
+    parser.add_argument('--rebuild-rollups', action='store_true', help='rebuild daily_rollups from the records table')
+    args = parser.parse_args()
+
+    storage = Storage(args.db)
+    storage.migrate()
+    if args.check_totals:
+        drifted = storage.totals.rebuild()
+        for user_id, old, new in drifted:
+            print(f"User {user_id}: {old} -> {new}")
+        print(f"Rebuilt user totals, {len(drifted)} user(s) had drifted")
+    if args.rebuild_rollups:
+        print(f"Rebuilt daily rollups, {storage.rollups.rebuild()} row(s)")
+    storage.close()
@@ -0,0 +1,253 @@
+import abc
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, pyqtSignal
+
+PAGE_SIZE = 200  # Rows loaded per fetchMore call
+
+
+# QAbstractTableModel has its own metaclass, so abstract methods need one that derives from both
+class AbstractTableModelMeta(type(QAbstractTableModel), abc.ABCMeta):
+    pass
+
+
+# Read-only table model that loads rows a page at a time as the view scrolls (canFetchMore/fetchMore),
+# so opening a dialog costs one page no matter how many rows match. The first value of every row is
+# its id: it is not displayed, but it is what the optional checkbox column reports.
+# Subclasses implement select() to load the page that follows the rows already loaded, and count() and
+# matching_ids() so "select all matching" can cover rows that were never loaded.
+class PagedTableModel(QAbstractTableModel, metaclass=AbstractTableModelMeta):
+    checked_changed = pyqtSignal(int)  # Number of checked rows
+
+    def __init__(self, headers, checkable=False, format_row=None, page_size=PAGE_SIZE, parent=None):
+        super().__init__(parent)
+        self.headers = (["Select"] if checkable else []) + list(headers)
+        self.checkable = checkable
+        self.format_row = format_row or (lambda row: [str(value) for value in row])
+        self.page_size = page_size
+
+        self.rows = []
+        self.display = []  # Formatted cells of the loaded rows
+        self.exhausted = False
+        self.checked = set()
+        self.all_checked = False  # Every row matching the query is checked, except those in unchecked
+        self.unchecked = set()
+
+    @abc.abstractmethod
+    def select(self, offset):
+        pass
+
+    @abc.abstractmethod
+    def count(self):
+        pass
+
+    @abc.abstractmethod
+    def matching_ids(self):
+        pass
+
+    def refresh(self):
+        # Drop the loaded pages and start again from the first one
+        self.beginResetModel()
+        self.rows = []
+        self.display = []
+        self.exhausted = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+        if self.all_checked:
+            # The query changed, and so did the rows "all matching" stands for
+            self.checked_changed.emit(self.checked_count())
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        page = self.select(len(self.rows))
+        if len(page) < self.page_size:
+            self.exhausted = True
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.display.extend(self.format_row(row[1:]) for row in page)
+            self.endInsertRows()
+
+    # Checked rows
+
+    def is_checked(self, row_id):
+        return row_id not in self.unchecked if self.all_checked else row_id in self.checked
+
+    def check_all(self, checked=True):
+        self.all_checked = checked
+        self.checked = set()
+        self.unchecked = set()
+        if self.rows and self.checkable:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self.rows) - 1, 0), [Qt.CheckStateRole])
+        self.checked_changed.emit(self.checked_count())
+
+    def checked_count(self):
+        return self.count() - len(self.unchecked) if self.all_checked else len(self.checked)
+
+    def checked_ids(self):
+        if self.all_checked:
+            return sorted(set(self.matching_ids()) - self.unchecked)
+        return sorted(self.checked)
+
+    def row_id(self, row):
+        return self.rows[row][0]
+
+    def sortable(self, column):
+        # Whether sort() can order by the header at column
+        return False
+
+    # QAbstractTableModel
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def flags(self, index):
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if self.checkable and index.column() == 0:
+            flags |= Qt.ItemIsUserCheckable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        column = index.column()
+        if self.checkable:
+            if column == 0:
+                if role == Qt.CheckStateRole:
+                    return Qt.Checked if self.is_checked(row[0]) else Qt.Unchecked
+                return None
+            column -= 1
+        if role == Qt.DisplayRole:
+            return self.display[index.row()][column]
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not (self.checkable and index.isValid() and index.column() == 0 and role == Qt.CheckStateRole):
+            return False
+        row_id = self.row_id(index.row())
+        if self.all_checked:
+            if value == Qt.Checked:
+                self.unchecked.discard(row_id)
+            else:
+                self.unchecked.add(row_id)
+        elif value == Qt.Checked:
+            self.checked.add(row_id)
+        else:
+            self.checked.discard(row_id)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        self.checked_changed.emit(self.checked_count())
+        return True
+
+
+# Paged model over an SQL query; sorting and the free-text filter are pushed into SQL
+class SqlTableModel(PagedTableModel):
+    def __init__(self, conn, query, params, headers, columns, checkable=False, format_row=None,
+                 page_size=PAGE_SIZE, parent=None):
+        super().__init__(headers, checkable, format_row, page_size, parent)
+        self.conn = conn
+        self.query = query  # SELECT id, ... without ORDER BY or LIMIT
+        self.params = list(params)
+        self.columns = list(columns)  # SQL column per header, None when it cannot be sorted or filtered on
+
+        # Name of the id column, used to break ties so pages never overlap or skip rows
+        self.id_column = conn.execute(f'SELECT * FROM ({query}) LIMIT 0', self.params).description[0][0]
+        self.order_by = None  # (column, descending)
+        self.filter_text = ''
+
+    def filtered(self, select='*'):
+        sql = f'SELECT {select} FROM ({self.query})'
+        params = list(self.params)
+        filter_columns = [column for column in self.columns if column]
+        if self.filter_text and filter_columns:
+            sql += ' WHERE ' + ' OR '.join(f'CAST({column} AS TEXT) LIKE ?' for column in filter_columns)
+            params += [f'%{self.filter_text}%'] * len(filter_columns)
+        return sql, params
+
+    def select(self, offset):
+        sql, params = self.filtered()
+        if self.order_by:
+            column, descending = self.order_by
+            direction = 'DESC' if descending else 'ASC'
+            sql += f' ORDER BY {column} {direction}, {self.id_column} {direction}'
+        else:
+            sql += f' ORDER BY {self.id_column}'
+        sql += ' LIMIT ? OFFSET ?'
+        return self.conn.execute(sql, params + [self.page_size, offset]).fetchall()
+
+    def count(self):
+        sql, params = self.filtered('COUNT(*)')
+        return self.conn.execute(sql, params).fetchone()[0]
+
+    def matching_ids(self):
+        sql, params = self.filtered(self.id_column)
+        return [row[0] for row in self.conn.execute(sql, params)]
+
+    def set_filter(self, text):
+        self.filter_text = text.strip()
+        self.refresh()
+
+    def sortable(self, column):
+        column -= 1 if self.checkable else 0
+        return 0 <= column < len(self.columns) and self.columns[column] is not None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if not self.sortable(column):
+            return
+        self.order_by = (self.columns[column - (1 if self.checkable else 0)], order == Qt.DescendingOrder)
+        self.refresh()
+
+
+# Paged model over the records query API: each page seeks past the last loaded row's sort key and
+# record_id, so scrolling deep into a long history costs the same as loading the first page
+class RecordsTableModel(PagedTableModel):
+    def __init__(self, records, user_id, record_filter, checkable=False, page_size=PAGE_SIZE, parent=None):
+        super().__init__(["Date", "Category", "Type", "Amount"], checkable, page_size=page_size, parent=parent)
+        self.records = records  # storage.RecordsRepository
+        self.user_id = user_id
+        self.record_filter = record_filter
+        self.orders = ['date', 'category', 'type', 'amount']  # storage.RECORD_ORDERS key per header
+        self.order = 'date'
+        self.descending = True
+        self.after = None  # page_key of the last loaded record
+
+    def select(self, offset):
+        page = self.records.page(self.user_id, self.record_filter, after=self.after if self.rows else None,
+                                 limit=self.page_size, descending=self.descending, order=self.order)
+        if page:
+            self.after = self.records.page_key(page[-1], self.order)
+        return [(record.record_id, record.date, record.category, record.type, record.amount) for record in page]
+
+    def count(self):
+        return self.records.count(self.user_id, self.record_filter)
+
+    def matching_ids(self):
+        return self.records.ids(self.user_id, self.record_filter)
+
+    def set_record_filter(self, record_filter):
+        self.record_filter = record_filter
+        self.refresh()
+
+    def sortable(self, column):
+        column -= 1 if self.checkable else 0
+        return 0 <= column < len(self.orders)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if not self.sortable(column):
+            return
+        self.order = self.orders[column - (1 if self.checkable else 0)]
+        self.descending = order == Qt.DescendingOrder
+        self.refresh()
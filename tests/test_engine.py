@@ -0,0 +1,44 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from engine import FinanceEngine
+from storage import Storage
+
+
+class NoMarketData:
+    def get_cached(self, symbols):
+        return {}
+
+
+class FailingPredictionEngine(FinanceEngine):
+    def predict_expenses(self, user_id, period):
+        raise ValueError("not enough history")
+
+
+class RefreshTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.directory.name, 'finance.db'))
+        self.storage.migrate()
+        self.user_id = self.storage.users.get_or_create('Maks')
+
+    def tearDown(self):
+        self.storage.close()
+        self.directory.cleanup()
+
+    def test_failed_prediction_is_a_warning(self):
+        today = datetime.date(2024, 6, 1)
+        result = FailingPredictionEngine(self.storage, NoMarketData()).refresh(self.user_id, today, quotes={})
+        self.assertIsNone(result.predicted_expenses)
+        self.assertEqual(result.prediction_error, "not enough history")
+        self.assertEqual(self.storage.net_worth.history(self.user_id), [(str(today), result.net_worth)])
+
+    def test_no_predict_has_no_prediction_error(self):
+        result = FailingPredictionEngine(self.storage, NoMarketData()).refresh(self.user_id, predict=False, quotes={})
+        self.assertIsNone(result.prediction_error)
+
+
+if __name__ == '__main__':
+    unittest.main()
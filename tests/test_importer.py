@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from importer import AmbiguousDateFormat, StatementImporter
+from storage import Storage
+
+
+class DateFormatTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.directory.name, 'finance.db'))
+        self.storage.migrate()
+
+    def tearDown(self):
+        self.storage.close()
+        self.directory.cleanup()
+
+    def statement(self, *dates):
+        path = os.path.join(self.directory.name, 'statement.csv')
+        with open(path, 'w', newline='') as f:
+            f.write('Date,Amount,Description\n')
+            for number, date in enumerate(dates):
+                f.write(f'{date},-{number + 1},Shop {number}\n')
+        return path
+
+    def imported_dates(self):
+        with self.storage.reader() as conn:
+            return [date for date, in conn.execute('SELECT date FROM records ORDER BY amount')]
+
+    def test_month_first_file_reads_every_line_month_first(self):
+        StatementImporter(self.storage).run(1, self.statement('01/05/2024', '02/01/2024', '01/13/2024'))
+        self.assertEqual(self.imported_dates(), ['2024-01-05', '2024-02-01', '2024-01-13'])
+
+    def test_ambiguous_file_raises_before_writing(self):
+        with self.assertRaises(AmbiguousDateFormat) as raised:
+            StatementImporter(self.storage).run(1, self.statement('01/05/2024', '02/01/2024'))
+        self.assertEqual(raised.exception.candidates, ['%d/%m/%Y', '%m/%d/%Y'])
+        self.assertEqual(self.imported_dates(), [])
+
+    def test_explicit_date_format(self):
+        StatementImporter(self.storage, date_format='%m/%d/%Y').run(1, self.statement('01/05/2024', '02/01/2024'))
+        self.assertEqual(self.imported_dates(), ['2024-01-05', '2024-02-01'])
+
+
+if __name__ == '__main__':
+    unittest.main()
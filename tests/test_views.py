@@ -0,0 +1,34 @@
+import unittest
+
+from PFM_app import VIEWS
+from invalidation import DependencyGraph
+
+TABLES = {'records', 'recurring_records', 'assets', 'loans', 'portfolio', 'quotes', 'net_worth_history'}
+
+
+class ViewGraphTest(unittest.TestCase):
+    def build(self):
+        views = DependencyGraph()
+        for name, refresh, depends_on, tab in VIEWS:
+            views.add_view(name, lambda: None, depends_on)
+        return views
+
+    def test_builds_in_declared_order(self):
+        self.assertEqual(list(self.build().views), [name for name, _, _, _ in VIEWS])
+
+    def test_view_names_differ_from_tables(self):
+        self.assertFalse(TABLES & {name for name, _, _, _ in VIEWS})
+
+    def test_dependencies_are_tables_or_earlier_views(self):
+        seen = set()
+        for name, _, depends_on, _ in VIEWS:
+            self.assertLessEqual(set(depends_on), TABLES | seen, name)
+            seen.add(name)
+
+    def test_portfolio_change_reaches_downstream_views(self):
+        self.assertEqual(self.build().dependents(['portfolio']),
+                         {'portfolio_value', 'portfolio_table', 'net_worth', 'fire'})
+
+
+if __name__ == '__main__':
+    unittest.main()
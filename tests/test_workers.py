@@ -0,0 +1,30 @@
+import unittest
+
+from PyQt5.QtCore import QCoreApplication
+
+from workers import QuoteRefresher
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+
+class EmptyPortfolioRefreshTest(unittest.TestCase):
+    def setUp(self):
+        # No market data or price history is touched when there is nothing to fetch
+        self.refresher = QuoteRefresher(market_data=None, price_history=None)
+        self.finished = []
+        self.refresher.finished.connect(lambda missing, errors: self.finished.append((missing, errors)))
+
+    def test_refresh_without_holdings_finishes(self):
+        self.refresher.start([])
+        app.processEvents()
+        self.assertEqual(self.finished, [([], [])])
+
+    def test_superseded_empty_refresh_finishes_once(self):
+        self.refresher.start([])
+        self.refresher.start([])  # A newer refresh started before the event loop ran
+        app.processEvents()
+        self.assertEqual(self.finished, [([], [])])
+
+
+if __name__ == '__main__':
+    unittest.main()
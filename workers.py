@@ -0,0 +1,159 @@
+import datetime
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+
+from market_data import normalize_symbols
+from exporter import Exporter
+from importer import StatementImporter
+
+MAX_WORKERS = 4  # Upper bound on concurrent market data requests
+BATCH_SIZE = 20  # Symbols per batched request
+
+
+class QuoteWorkerSignals(QObject):
+    quotes_ready = pyqtSignal(dict)  # {symbol: Quote}
+    history_ready = pyqtSignal(dict)  # {symbol: close price one year ago}
+    finished = pyqtSignal(int, list, str)  # generation, symbols the provider does not know, error message ('' on success)
+
+
+# Fetches quotes and price history for one batch of symbols on a pool thread
+class QuoteWorker(QRunnable):
+    def __init__(self, market_data, price_history, symbols, generation, force=False):
+        super().__init__()
+        self.market_data = market_data
+        self.price_history = price_history
+        self.symbols = symbols
+        self.generation = generation
+        self.force = force
+        self.signals = QuoteWorkerSignals()
+
+    def run(self):
+        missing = []
+        error = ''
+        try:
+            if self.force:
+                quotes = self.market_data.refresh(self.symbols)
+            else:
+                quotes = self.market_data.get_quotes(self.symbols)
+            self.signals.quotes_ready.emit(quotes)
+            missing = [symbol for symbol in self.symbols if symbol not in quotes]
+        except Exception as e:
+            error = f"Error fetching quotes for {', '.join(self.symbols)}: {e}"
+            # Fall back to the last known prices; a failed fetch never marks symbols as unknown
+            try:
+                self.signals.quotes_ready.emit(self.market_data.get_cached(self.symbols))
+            except Exception as cache_error:
+                print(f"Quote cache unavailable: {cache_error}")
+
+        try:
+            self.price_history.sync(self.symbols)
+            year_ago = datetime.date.today() - datetime.timedelta(days=365)
+            self.signals.history_ready.emit(self.price_history.closes_on_or_after(self.symbols, year_ago))
+        except Exception as e:
+            print(f"Price history sync failed: {e}")  # Fall back to the bars already stored
+
+        self.signals.finished.emit(self.generation, missing, error)
+
+
+# Splits a refresh into batches, runs them on a bounded thread pool and re-emits
+# the results on the GUI thread so views can fill in as each batch arrives
+class QuoteRefresher(QObject):
+    quotes_ready = pyqtSignal(dict)
+    history_ready = pyqtSignal(dict)
+    finished = pyqtSignal(list, list)  # symbols the provider does not know, error messages
+
+    def __init__(self, market_data, price_history, max_workers=MAX_WORKERS, batch_size=BATCH_SIZE, parent=None):
+        super().__init__(parent)
+        self.market_data = market_data
+        self.price_history = price_history
+        self.batch_size = batch_size
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.generation = 0
+        self.pending = 0
+        self.missing = []
+        self.errors = []
+
+    def start(self, symbols, force=False):
+        symbols = normalize_symbols(symbols)
+        # A new refresh supersedes any batches still running from the previous one
+        self.generation += 1
+        self.missing = []
+        self.errors = []
+        batches = [symbols[i:i + self.batch_size] for i in range(0, len(symbols), self.batch_size)]
+        self.pending = len(batches)
+        if not batches:
+            # Nothing to fetch (no holdings). Finish on the next event loop pass, like a refresh with
+            # batches would, so listeners clear their "refreshing" state; unless a newer refresh started.
+            generation = self.generation
+            QTimer.singleShot(0, lambda: generation == self.generation and self.finished.emit([], []))
+
+        for batch in batches:
+            worker = QuoteWorker(self.market_data, self.price_history, batch, self.generation, force)
+            worker.signals.quotes_ready.connect(self.quotes_ready)
+            worker.signals.history_ready.connect(self.history_ready)
+            worker.signals.finished.connect(self.batch_finished)
+            self.pool.start(worker)
+
+    def batch_finished(self, generation, missing, error):
+        if generation != self.generation:
+            return
+        self.missing.extend(missing)
+        if error:
+            self.errors.append(error)
+        self.pending -= 1
+        if self.pending == 0:
+            self.finished.emit(self.missing, self.errors)
+
+
+class ImportWorkerSignals(QObject):
+    progress = pyqtSignal(int, int)  # lines read, percent of the file
+    finished = pyqtSignal(object, str)  # ImportResult (None on failure), error message ('' on success)
+
+
+# Imports one bank statement on a pool thread through its own write connection
+class ImportWorker(QRunnable):
+    def __init__(self, storage, user_id, path, date_format=None):
+        super().__init__()
+        self.importer = StatementImporter(storage, date_format=date_format)
+        self.user_id = user_id
+        self.path = path
+        self.error = None  # The exception behind a failed import
+        self.signals = ImportWorkerSignals()
+
+    def cancel(self):
+        # Stops after the chunk being written; chunks already committed stay imported
+        self.importer.cancelled = True
+
+    def run(self):
+        try:
+            result = self.importer.run(self.user_id, self.path,
+                                       lambda read, fraction: self.signals.progress.emit(read, int(fraction * 100)))
+            self.signals.finished.emit(result, '')
+        except Exception as e:
+            self.error = e
+            self.signals.finished.emit(None, str(e))
+
+
+class ExportWorkerSignals(QObject):
+    progress = pyqtSignal(str, int)  # table, rows written
+    finished = pyqtSignal(dict, str)  # {table: rows written}, error message ('' on success)
+
+
+# Exports a user's tables on a pool thread through a pooled read connection
+class ExportWorker(QRunnable):
+    def __init__(self, storage, user_id, directory, export_format):
+        super().__init__()
+        self.exporter = Exporter(storage)
+        self.user_id = user_id
+        self.directory = directory
+        self.export_format = export_format
+        self.signals = ExportWorkerSignals()
+
+    def run(self):
+        try:
+            exported = self.exporter.export(self.user_id, self.directory, self.export_format,
+                                            progress=self.signals.progress.emit)
+            self.signals.finished.emit(exported, '')
+        except Exception as e:
+            self.signals.finished.emit({}, str(e))